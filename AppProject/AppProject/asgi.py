@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+
+私信的实时推送（message/views.py中的message_stream和poll_messages）是长期保持的连接，
+需要通过这个入口由ASGI服务器提供，例如：uvicorn AppProject.asgi:application
 """
 
 import os
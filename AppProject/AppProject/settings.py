@@ -140,3 +140,110 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# 首页时间线（见dynamic/timeline.py）
+# 存储后端：dynamic.timeline.DatabaseTimelineBackend 或 dynamic.timeline.InMemoryTimelineBackend
+TIMELINE_BACKEND = "dynamic.timeline.DatabaseTimelineBackend"
+# 每个用户的时间线最多保留的动态条数
+TIMELINE_MAX_LENGTH = 800
+# 粉丝数超过该值的账号（园区工作人员、官方账号等）发布动态时不再推送给粉丝，而是在粉丝读取时间线时拉取
+TIMELINE_PULL_FOLLOWER_THRESHOLD = 10000
+# 拉模式账号的粉丝数降到阈值的(1 - 该值)倍以下才恢复推模式，并把近期动态回填到粉丝的时间线
+TIMELINE_PULL_HYSTERESIS = 0.1
+
+# 分块上传（见dynamic/uploads.py）
+# 上传中的临时文件所在目录，应与媒体文件存储在同一文件系统上，完成后直接移动而不复制
+UPLOAD_SESSION_DIR = BASE_DIR / "upload_sessions"
+# 单个文件的最大字节数
+UPLOAD_MAX_SIZE = 1024 * 1024 * 1024
+
+# 媒体文件的衍生版本（见dynamic/derivatives.py）
+# 生成的缩略图宽度（像素）
+DERIVATIVE_WIDTHS = [160, 320, 640, 1280]
+# 后台生成缩略图的进程数，为0时在请求进程中同步生成
+DERIVATIVE_WORKERS = 2
+# 截取视频预览帧使用的ffmpeg
+FFMPEG_BINARY = "ffmpeg"
+
+# 上传处理器：在接收上传数据的同时计算SHA-256，用于媒体文件去重（见dynamic/blobs.py）
+FILE_UPLOAD_HANDLERS = [
+    "dynamic.blobs.HashingMemoryFileUploadHandler",
+    "dynamic.blobs.HashingTemporaryFileUploadHandler",
+]
+
+# 媒体文件下载（见dynamic/serving.py）
+# 生产环境设为"x-accel-redirect"（Nginx）或"x-sendfile"（Apache mod_xsendfile），由前端服务器发送文件内容
+MEDIA_SENDFILE_BACKEND = None
+# X-Accel-Redirect使用的Nginx internal location，需要指向媒体文件目录
+MEDIA_SENDFILE_URL = "/protected-media/"
+# 媒体文件响应的Cache-Control max-age（秒），过期后凭ETag重新验证
+MEDIA_CACHE_MAX_AGE = 3600
+
+# 缓存：动态详情和搜索结果的版本号、动态列表的ETag、通知未读数都依赖所有工作进程共享的缓存，
+# 一个进程中的失效必须对其他进程可见。需要运行Redis服务
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/1",
+        "KEY_PREFIX": "app_api",
+    }
+}
+# 缓存为进程内的LocMemCache或DummyCache时，上述按版本号缓存的功能默认关闭（见dynamic/post_cache.py的shared_cache()），
+# 每次请求都查询数据库。只在单进程运行（runserver、测试）时才可以设为True，使用进程内缓存
+ALLOW_PROCESS_LOCAL_CACHE = False
+
+# 动态详情的响应缓存（见dynamic/post_cache.py）
+# 过期时间只用于淘汰不再访问的内容，与失效无关
+POST_DETAIL_CACHE_TIMEOUT = 60 * 60
+
+# 动态的全文搜索（见dynamic/search.py）
+# 每个查询词项最多读取的倒排项数（按发布时间倒序），决定了单次查询的开销上限
+SEARCH_POSTINGS_LIMIT = 2000
+# 排序结果最多保留的动态数
+SEARCH_MAX_RESULTS = 1000
+# 时间加权：新发布的动态得分最多乘以(1 + SEARCH_RECENCY_WEIGHT)，加成每SEARCH_RECENCY_HALF_LIFE_DAYS天减半
+SEARCH_RECENCY_WEIGHT = 1.0
+SEARCH_RECENCY_HALF_LIFE_DAYS = 30
+# 排序结果和语料统计（动态数、平均长度）的缓存时间（秒）
+SEARCH_RESULT_CACHE_TIMEOUT = 5 * 60
+SEARCH_STATS_TIMEOUT = 10 * 60
+
+# 私信搜索（见message/search.py）
+# 每次从主词项的倒排表读取的条数，以及单个请求最多扫描的倒排项数，决定了单次搜索的耗时上限
+MESSAGE_SEARCH_BATCH_SIZE = 200
+MESSAGE_SEARCH_SCAN_LIMIT = 2000
+
+# 私信实时推送（见message/push.py），SSE和长轮询连接通过ASGI入口提供
+# 发布订阅中心：message.push.InProcessHub只推送给同一进程中的连接；
+# 多个工作进程时使用message.push.BrokerHub，经由消息代理扇出（默认的LocalBroker只是进程内的替身）
+MESSAGE_PUSH_HUB = "message.push.InProcessHub"
+# SSE连接空闲时发送保活注释的间隔（秒），应小于反向代理的读超时
+MESSAGE_PUSH_HEARTBEAT_SECONDS = 15
+# 长轮询没有新消息时最多挂起的秒数
+MESSAGE_PUSH_LONG_POLL_TIMEOUT = 25
+# 每个连接最多缓存的未发送消息数，超过时断开连接，客户端重连后从数据库补发
+MESSAGE_PUSH_QUEUE_SIZE = 100
+# 建立连接时最多补发的消息数
+MESSAGE_PUSH_REPLAY_LIMIT = 100
+
+# 动态推荐（见dynamic/recommendations.py），由build_recommendations命令每晚离线计算
+# 每条动态保留的相似动态数
+RECOMMEND_TOP_K = 50
+# 只对最近若干天内发布的动态计算相似度和推荐
+RECOMMEND_WINDOW_DAYS = 90
+
+# "可能认识的人"（见authAPP/suggestions.py），由build_follow_suggestions命令批量计算，关注关系变化时增量更新
+# 每个用户保留的推荐数
+FOLLOW_SUGGESTION_TOP_K = 100
+# 粉丝数或关注数超过该值时不做增量更新，等待下一次批量计算
+FOLLOW_SUGGESTION_FANOUT_LIMIT = 10000
+
+# 进程内的关注关系索引（见authAPP/graph.py），需要NumPy
+FOLLOW_GRAPH_ENABLED = True
+# 索引加载超过该秒数后在后台重新加载，其他进程中的关注变化最多延迟这么久可见
+FOLLOW_GRAPH_MAX_AGE = 300
+# 覆盖层中新增和删除的关系超过该条数时与CSR数组合并
+FOLLOW_GRAPH_OVERLAY_LIMIT = 10000
+# Bloom过滤器每条关注关系的位数，0为不使用；10位时误判率约1%。
+# 在纯Python中计算7个哈希比在一个用户的关注列表中二分查找更慢，只有单个用户关注数极大时才值得打开
+FOLLOW_GRAPH_BLOOM_BITS_PER_EDGE = 0
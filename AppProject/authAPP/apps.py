@@ -7,3 +7,7 @@ from django.apps import AppConfig
 class AuthAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "authAPP"
+
+    def ready(self):
+        # 注册信号处理函数
+        from . import signals  # noqa: F401
@@ -0,0 +1,317 @@
+"""
+进程内的关注关系索引，判断"是否关注"、查询关注数和粉丝数时不访问数据库。
+
+存储格式为CSR（压缩稀疏行），两个方向各一份：
+ids：出现在关注关系中的全部用户ID，升序；
+following_indptr / following_indices：第i个用户关注的人在ids中的下标，每个用户一段，段内升序；
+followers_indptr / followers_indices：第i个用户的粉丝，格式相同。
+关注数和粉丝数为indptr相邻两项之差，O(1)；是否关注在关注者的一段中二分查找，O(log 关注数)。
+可以另外构建一个Bloom过滤器（settings.FOLLOW_GRAPH_BLOOM_BITS_PER_EDGE），没有关注关系时O(1)直接返回。
+
+下标用array.array('i')（4字节）保存，每条关注关系在两个方向各占一个，共8字节；Bloom过滤器每条另占bits_per_edge/8字节。
+每个用户另占ids和两个indptr各8字节，以及ID到下标的字典项（约100字节）。实测见bench_follow_graph命令。
+
+CSR数组构建后不再修改。关注和取消关注在事务提交后记入一个小的覆盖层（新增和删除的关系集合、计数增量），
+覆盖层超过settings.FOLLOW_GRAPH_OVERLAY_LIMIT条时与CSR合并重建，合并期间的变化与重新加载时一样先记下，合并完成后补上。
+覆盖层的操作是幂等的，重复记入同一个变化不会使计数出错。
+
+每个进程各有一份索引，只能直接看到本进程中发生的变化。索引加载超过settings.FOLLOW_GRAPH_MAX_AGE秒后，
+下一次访问时在后台线程中从数据库重新加载，加载期间继续使用旧的索引，加载完成后补上期间发生的变化再替换，
+因此其他进程中的变化最多延迟这么久可见。
+
+构建索引依赖NumPy；没有安装NumPy或settings.FOLLOW_GRAPH_ENABLED为False时get_graph()返回None，调用方查询数据库。
+"""
+import itertools
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import CustomUser
+
+try:
+    import numpy as np
+except ImportError:  # NumPy是可选依赖，没有安装时不使用内存索引
+    np = None
+
+# 关注关系中间表：from_customuser为被关注者，to_customuser为关注者
+Follow = CustomUser.followers.through
+
+# Bloom过滤器使用的哈希函数个数
+BLOOM_HASHES = 7
+
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _mix(value):
+    """
+    splitmix64的最后一步，把64位整数打散为近似均匀的哈希值
+    """
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK
+    return value ^ (value >> 31)
+
+
+def _mix_array(values):
+    # 与_mix相同，作用于uint64数组
+    with np.errstate(over='ignore'):
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def _bloom_bits(follower_id, followee_id, size):
+    # 双重哈希：第i个位置为 (h1 + i * h2) % size
+    first = _mix((follower_id * _GOLDEN + followee_id) & _MASK)
+    second = _mix(first) | 1
+    return [((first + i * second) & _MASK) % size for i in range(BLOOM_HASHES)]
+
+
+def _bloom_filter(followers, followees, size):
+    bloom = np.zeros((size + 7) // 8, dtype=np.uint8)
+    with np.errstate(over='ignore'):
+        first = _mix_array(followers.astype(np.uint64) * np.uint64(_GOLDEN) + followees.astype(np.uint64))
+        second = _mix_array(first) | np.uint64(1)
+        for i in range(BLOOM_HASHES):
+            bits = (first + np.uint64(i) * second) % np.uint64(size)
+            np.bitwise_or.at(bloom, (bits >> np.uint64(3)).astype(np.int64),
+                             np.left_shift(1, (bits & np.uint64(7)).astype(np.uint8)).astype(np.uint8))
+    return bloom.tobytes()
+
+
+def _csr(rows, columns, size):
+    """
+    由(行, 列)下标数组构建CSR，每行的列下标升序
+    """
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return array('q', indptr.tobytes()), array('i', columns[order].astype(np.int32).tobytes())
+
+
+class FollowGraph:
+    """
+    关注关系的只读CSR快照加上增量覆盖层，见模块说明
+    """
+
+    def __init__(self, followers, followees, bloom_bits_per_edge=0):
+        """
+        :param followers: 关注者ID数组
+        :param followees: 被关注者ID数组，与followers一一对应，不能有重复的关注关系
+        """
+        followers = np.asarray(followers, dtype=np.int64)
+        followees = np.asarray(followees, dtype=np.int64)
+        ids = np.unique(np.concatenate([followers, followees]))
+        rows, columns = np.searchsorted(ids, followers), np.searchsorted(ids, followees)
+        self.ids = array('q', ids.tobytes())
+        self.positions = {user_id: index for index, user_id in enumerate(ids.tolist())}
+        self.following_indptr, self.following_indices = _csr(rows, columns, len(ids))
+        self.followers_indptr, self.followers_indices = _csr(columns, rows, len(ids))
+        self.edge_count = len(followers)
+        self.bloom_bits_per_edge = bloom_bits_per_edge if self.edge_count else 0
+        self.bloom_size = self.edge_count * self.bloom_bits_per_edge
+        self.bloom = _bloom_filter(followers, followees, self.bloom_size) if self.bloom_size else None
+
+        self.added, self.removed = set(), set()
+        self.following_delta, self.followers_delta = {}, {}
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_database(cls, chunk_size=100000, bloom_bits_per_edge=0):
+        """
+        从关注关系中间表加载，按块读取并直接写入数组，不创建模型实例
+        """
+        rows = (Follow.objects.values_list('to_customuser_id', 'from_customuser_id').order_by()
+                .iterator(chunk_size=chunk_size))
+        edges = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64).reshape(-1, 2)
+        return cls(edges[:, 0], edges[:, 1], bloom_bits_per_edge)
+
+    def _in_snapshot(self, follower_id, followee_id):
+        row, column = self.positions.get(follower_id), self.positions.get(followee_id)
+        if row is None or column is None:
+            return False
+        if self.bloom is not None:
+            for bit in _bloom_bits(follower_id, followee_id, self.bloom_size):
+                if not self.bloom[bit >> 3] & (1 << (bit & 7)):
+                    return False
+        end = self.following_indptr[row + 1]
+        index = bisect_left(self.following_indices, column, self.following_indptr[row], end)
+        return index < end and self.following_indices[index] == column
+
+    def is_following(self, follower_id, followee_id):
+        edge = (follower_id, followee_id)
+        if edge in self.removed:
+            return False
+        return edge in self.added or self._in_snapshot(follower_id, followee_id)
+
+    def _degree(self, indptr, delta, user_id):
+        index = self.positions.get(user_id)
+        base = indptr[index + 1] - indptr[index] if index is not None else 0
+        return base + delta.get(user_id, 0)
+
+    def following_count(self, user_id):
+        return self._degree(self.following_indptr, self.following_delta, user_id)
+
+    def follower_count(self, user_id):
+        return self._degree(self.followers_indptr, self.followers_delta, user_id)
+
+    def apply(self, follower_id, followee_id, followed):
+        """
+        记入一条关注（followed为True）或取消关注。已经是目标状态时不做任何修改
+        """
+        edge = (follower_id, followee_id)
+        with self.lock:
+            if self.is_following(follower_id, followee_id) == followed:
+                return
+            if followed and edge in self.removed:
+                # 快照中有、之后被取消的关注关系，重新关注时撤销删除即可
+                self.removed.discard(edge)
+            elif followed:
+                self.added.add(edge)
+            elif edge in self.added:
+                self.added.discard(edge)
+            else:
+                self.removed.add(edge)
+            step = 1 if followed else -1
+            self.following_delta[follower_id] = self.following_delta.get(follower_id, 0) + step
+            self.followers_delta[followee_id] = self.followers_delta.get(followee_id, 0) + step
+
+    @property
+    def overlay_size(self):
+        return len(self.added) + len(self.removed)
+
+    def compacted(self):
+        """
+        合并覆盖层，返回新的快照
+        """
+        with self.lock:
+            ids = np.frombuffer(self.ids, dtype=np.int64)
+            indptr = np.frombuffer(self.following_indptr, dtype=np.int64)
+            rows = np.repeat(np.arange(len(ids)), np.diff(indptr))
+            columns = np.frombuffer(self.following_indices, dtype=np.int32).astype(np.int64)
+            if self.removed:
+                # 被删除的关系都在快照中，用 行 * 用户数 + 列 作为一条关系的键
+                removed = [self.positions[follower_id] * len(ids) + self.positions[followee_id]
+                           for follower_id, followee_id in self.removed]
+                keep = ~np.isin(rows * len(ids) + columns, np.array(removed, dtype=np.int64))
+                rows, columns = rows[keep], columns[keep]
+            added = np.array(sorted(self.added), dtype=np.int64).reshape(-1, 2)
+            followers = np.concatenate([ids[rows], added[:, 0]])
+            followees = np.concatenate([ids[columns], added[:, 1]])
+        return FollowGraph(followers, followees, self.bloom_bits_per_edge)
+
+    @property
+    def nbytes(self):
+        """
+        数组和Bloom过滤器占用的字节数（不含ID字典和覆盖层）
+        """
+        arrays = [self.ids, self.following_indptr, self.following_indices, self.followers_indptr,
+                  self.followers_indices]
+        return sum(len(values) * values.itemsize for values in arrays) + len(self.bloom or b'')
+
+
+_graph = None
+_reloading = False
+# 后台重新加载或合并覆盖层期间发生的变化，完成后补到新的快照上
+_pending = []
+_state_lock = threading.Lock()
+
+
+def _load():
+    return FollowGraph.from_database(bloom_bits_per_edge=_setting('FOLLOW_GRAPH_BLOOM_BITS_PER_EDGE', 0))
+
+
+def _rebuild(build):
+    """
+    在_state_lock之外构建新的快照（_reloading期间的变化记入_pending），完成后补上这些变化再替换
+    """
+    global _graph, _reloading
+    try:
+        graph = build()
+    except Exception:
+        with _state_lock:
+            _reloading = False
+            _pending.clear()
+        raise
+    with _state_lock:
+        for change in _pending:
+            graph.apply(*change)
+        _pending.clear()
+        _graph, _reloading = graph, False
+
+
+def _reload():
+    _rebuild(_load)
+
+
+def get_graph():
+    """
+    返回当前进程的关注关系索引，第一次访问时同步加载；超过FOLLOW_GRAPH_MAX_AGE秒后在后台线程中重新加载
+
+    :return: FollowGraph，未启用或没有安装NumPy时为None
+    """
+    global _graph, _reloading
+    if np is None or not _setting('FOLLOW_GRAPH_ENABLED', True):
+        return None
+    graph = _graph
+    if graph is None:
+        with _state_lock:
+            if _graph is None:
+                _graph = _load()
+            return _graph
+    if time.monotonic() - graph.loaded_at > _setting('FOLLOW_GRAPH_MAX_AGE', 300):
+        with _state_lock:
+            start, _reloading = not _reloading, True
+        if start:
+            threading.Thread(target=_reload, daemon=True).start()
+    return graph
+
+
+def reset():
+    """
+    丢弃当前进程的索引，下次访问时重新加载（用于测试和直接修改数据库之后）
+    """
+    global _graph
+    with _state_lock:
+        _graph = None
+        _pending.clear()
+
+
+def _apply(pairs, followed):
+    global _reloading
+    # 记入覆盖层和_pending在同一个锁内完成：合并开始之前的变化都在合并的快照中，之后的变化都在_pending中
+    with _state_lock:
+        graph = _graph
+        if graph is None:
+            # 还没有加载过，加载时会从数据库读到这些变化
+            return
+        if _reloading:
+            _pending.extend((follower_id, followee_id, followed) for follower_id, followee_id in pairs)
+        for follower_id, followee_id in pairs:
+            graph.apply(follower_id, followee_id, followed)
+        # 合并与重新加载一样在锁外构建；正在重新加载时不需要合并，新的快照会替换当前的索引
+        compact = not _reloading and graph.overlay_size > _setting('FOLLOW_GRAPH_OVERLAY_LIMIT', 10000)
+        if compact:
+            _reloading = True
+    if compact:
+        _rebuild(graph.compacted)
+
+
+def follow_changed(pairs, followed):
+    """
+    关注关系变化时调用，事务提交后更新索引，回滚的变化不会进入索引
+
+    :param pairs: [(关注者ID, 被关注者ID)]
+    :param followed: True为关注，False为取消关注
+    """
+    pairs = list(pairs)
+    transaction.on_commit(lambda: _apply(pairs, followed))
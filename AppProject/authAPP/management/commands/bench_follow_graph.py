@@ -0,0 +1,89 @@
+"""
+关注关系索引性能基准：在合成数据上测量从数据库加载的耗时、每条关注关系占用的内存，以及is_following和计数的延迟。
+
+用法：python manage.py bench_follow_graph --users 100000 --edges 1000000
+被关注者服从Zipf分布（少数大账号有大量粉丝）。所有测试数据在一个事务中写入，结束后回滚。
+"""
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from authAPP.graph import FollowGraph
+
+
+class Command(BaseCommand):
+    help = 'Benchmark loading and querying the in-memory follow graph.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--edges', type=int, default=1000000)
+        parser.add_argument('--lookups', type=int, default=100000)
+        parser.add_argument('--bloom-bits', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def _timed(self, label, function, arguments):
+        timings = []
+        for argument in arguments:
+            start = time.perf_counter()
+            function(*argument)
+            timings.append((time.perf_counter() - start) * 1e6)
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(f'{label:<34} median {statistics.median(timings):8.2f} us   p99 {p99:8.2f} us')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        User = get_user_model()
+        through = User.followers.through
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            start = time.perf_counter()
+            User.objects.bulk_create([User(username=f'bench_graph_{i}', email=f'bench_graph_{i}@example.com')
+                                      for i in range(options['users'])], batch_size=batch_size)
+            user_ids = np.array(User.objects.filter(username__startswith='bench_graph_').order_by('id')
+                                .values_list('id', flat=True))
+            followers = rng.choice(user_ids, size=options['edges'])
+            followees = user_ids[np.minimum(rng.zipf(1.5, size=options['edges']) - 1, len(user_ids) - 1)]
+            followees = rng.permutation(user_ids)[np.searchsorted(user_ids, followees)]
+            edges = np.unique(np.stack([followers, followees], axis=1), axis=0)
+            edges = edges[edges[:, 0] != edges[:, 1]]
+            for begin in range(0, len(edges), batch_size):
+                through.objects.bulk_create([through(to_customuser_id=int(a), from_customuser_id=int(b))
+                                             for a, b in edges[begin:begin + batch_size].tolist()])
+            self.stdout.write(f'seeded {len(user_ids)} users, {len(edges)} edges in {time.perf_counter() - start:.1f}s')
+
+            for bloom_bits in (0, options['bloom_bits']):
+                start = time.perf_counter()
+                graph = FollowGraph.from_database(bloom_bits_per_edge=bloom_bits)
+                elapsed = time.perf_counter() - start
+                # tracemalloc会明显拖慢加载，单独再加载一次测量内存
+                del graph
+                tracemalloc.start()
+                graph = FollowGraph.from_database(bloom_bits_per_edge=bloom_bits)
+                retained = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+                start = time.perf_counter()
+                FollowGraph(edges[:, 0], edges[:, 1], bloom_bits)
+                built = time.perf_counter() - start
+                self.stdout.write(
+                    f'bloom {bloom_bits:>2} bits/edge: load {elapsed:.2f}s (build from arrays {built:.2f}s), '
+                    f'arrays {graph.nbytes / len(edges):.2f} B/edge, '
+                    f'total retained {retained / len(edges):.2f} B/edge ({retained / 2 ** 20:.1f} MiB)')
+
+                hits = edges[rng.integers(len(edges), size=options['lookups'])].tolist()
+                misses = rng.choice(user_ids, size=(options['lookups'], 2)).tolist()
+                self._timed('  is_following, existing edge', graph.is_following, hits)
+                self._timed('  is_following, random pair', graph.is_following, misses)
+                self._timed('  follower_count', graph.follower_count, [(user_id,) for user_id, _ in misses])
+
+            sample = misses[:1000]
+            self._timed('database exists() query', lambda a, b: through.objects.filter(
+                to_customuser_id=a, from_customuser_id=b).exists(), sample)
+            self._timed('database follower count query', lambda a, b: through.objects.filter(
+                from_customuser_id=a).count(), sample)
+            transaction.set_rollback(True)
@@ -0,0 +1,24 @@
+"""
+批量重新计算"可能认识的人"（见authAPP/suggestions.py），替换FollowSuggestion表。
+关注关系变化时表会增量更新，这个命令用于首次上线以及定期修正未做增量更新的大账号。
+
+用法：python manage.py build_follow_suggestions --top-k 100 --block-size 1000
+"""
+from django.core.management.base import BaseCommand
+
+from authAPP import suggestions
+
+
+class Command(BaseCommand):
+    help = 'Recompute friends-of-friends follow suggestions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int)
+        parser.add_argument('--block-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        stats = suggestions.build(options['top_k'], options['block_size'])
+        self.stdout.write(f'{stats["users"]} users, {stats["edges"]} follow edges: '
+                          f'load {stats["load_seconds"]:.1f}s, compute {stats["compute_seconds"]:.1f}s, '
+                          f'write {stats["write_seconds"]:.1f}s')
+        self.stdout.write(self.style.SUCCESS(f'Stored {stats["suggestions"]} suggestions.'))
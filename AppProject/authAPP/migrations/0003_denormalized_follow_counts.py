@@ -0,0 +1,47 @@
+# Generated by Django 5.0.3 on 2026-10-18 16:53
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(model, field):
+    counts = (
+        model.objects.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def backfill_counts(apps, schema_editor):
+    CustomUser = apps.get_model("authAPP", "CustomUser")
+    # 中间表中from_customuser为被关注者，to_customuser为关注者
+    Follow = CustomUser.followers.through
+    CustomUser.objects.update(
+        follower_count=_count(Follow, "from_customuser"),
+        following_count=_count(Follow, "to_customuser"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authAPP", "0002_follow_suggestions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="follower_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="customuser",
+            name="following_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
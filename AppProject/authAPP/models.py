@@ -4,7 +4,9 @@ from django.db import models
 定义用户模型（或扩展Django提供的默认用户模型），以便存储用户的身份验证信息和其他相关信息。
 """
 # Create your models here.
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import m2m_changed
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.utils.translation import gettext_lazy as _
 
@@ -35,14 +37,88 @@ class CustomUser(AbstractUser):
     )
     email = models.EmailField(unique=True)
     followers = models.ManyToManyField('self', symmetrical=False, related_name='following')
+    # 冗余的粉丝数和关注数，关注关系变化时在同一事务中由信号更新（见signals.py），读取时不需要COUNT(*)
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
 
+    # 与批量操作走同一条加锁的路径，并发的follow()和follow_many()不会重复增加计数
     def follow(self, user):
-        if not self.is_following(user):
-            self.following.add(user)
+        self.follow_many([user.pk])
 
     def unfollow(self, user):
-        if self.is_following(user):
-            self.following.remove(user)
+        self.unfollow_many([user.pk])
 
     def is_following(self, user):
+        # 优先使用进程内的关注关系索引（见graph.py），未启用时查询数据库
+        from .graph import get_graph
+        index = get_graph()
+        if index is not None:
+            return index.is_following(self.id, user.id)
         return self.following.filter(id=user.id).exists()
+
+    def _lock(self):
+        # 锁住自己所在的行，同一用户的并发批量操作依次执行，差集和计数不会重复计算
+        CustomUser.objects.select_for_update().filter(pk=self.pk).values_list('pk').first()
+
+    def _following_changed(self, action, pk_set):
+        # 发送与self.following.add()/remove()相同的信号，冗余计数、推荐和关注索引照常更新
+        m2m_changed.send(sender=CustomUser.followers.through, instance=self, action=action, reverse=True,
+                         model=CustomUser, pk_set=pk_set, using=self._state.db or 'default')
+
+    def follow_many(self, user_ids):
+        """
+        批量关注：一条查询得到存在的用户以及是否已经关注，一次bulk_create写入新的关注关系，查询次数与用户数无关
+
+        :param user_ids: 要关注的用户ID，自己和不存在的用户会被忽略
+        :return: (新关注的用户ID集合, 之前已经关注的用户ID集合)
+        """
+        through = CustomUser.followers.through
+        with transaction.atomic():
+            self._lock()
+            states = dict(CustomUser.objects.filter(pk__in=set(user_ids) - {self.pk}).annotate(
+                followed=Exists(through.objects.filter(from_customuser_id=OuterRef('pk'), to_customuser_id=self.pk))
+            ).values_list('pk', 'followed'))
+            new_ids = {pk for pk, followed in states.items() if not followed}
+            if new_ids:
+                self._following_changed('pre_add', new_ids)
+                # ignore_conflicts兜底与单条关注并发的情况，唯一约束保证不会产生重复记录
+                through.objects.bulk_create([through(from_customuser_id=pk, to_customuser_id=self.pk)
+                                             for pk in new_ids], ignore_conflicts=True)
+                self._following_changed('post_add', new_ids)
+        return new_ids, set(states) - new_ids
+
+    def unfollow_many(self, user_ids):
+        """
+        批量取消关注：一条查询得到已有的关注关系，一条DELETE删除
+
+        :param user_ids: 要取消关注的用户ID，没有关注的用户会被忽略
+        :return: 取消关注的用户ID集合
+        """
+        through = CustomUser.followers.through
+        with transaction.atomic():
+            self._lock()
+            edges = through.objects.filter(to_customuser_id=self.pk, from_customuser_id__in=set(user_ids))
+            removed_ids = set(edges.values_list('from_customuser_id', flat=True))
+            if removed_ids:
+                self._following_changed('pre_remove', removed_ids)
+                edges.filter(from_customuser_id__in=removed_ids).delete()
+                self._following_changed('post_remove', removed_ids)
+        return removed_ids
+
+
+class FollowSuggestion(models.Model):
+    """
+    "可能认识的人"（见suggestions.py）：user关注的人中有mutual_count个关注了suggested，而user还没有关注suggested。
+    由build_follow_suggestions命令批量计算，关注和取消关注时增量更新受影响的行
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='follow_suggestions')
+    suggested = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    mutual_count = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-mutual_count', 'suggested'], name='follow_suggestion_rank_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'suggested'], name='unique_follow_suggestion'),
+        ]
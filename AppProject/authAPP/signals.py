@@ -0,0 +1,63 @@
+"""
+用户模块的信号处理：关注关系变化时更新冗余的粉丝数和关注数，增量更新"可能认识的人"（见suggestions.py）
+和进程内的关注关系索引（见graph.py）。
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from . import graph, suggestions
+from .models import CustomUser
+
+
+def _follow_pairs(instance, reverse, pk_set):
+    """
+    把m2m_changed的参数换算为(关注者ID, 被关注者ID)列表
+    """
+    if reverse:
+        # instance.following.add(...)：instance关注了pk_set中的用户
+        return [(instance.pk, pk) for pk in pk_set]
+    # instance.followers.add(...)：pk_set中的用户关注了instance
+    return [(pk, instance.pk) for pk in pk_set]
+
+
+def _update_counts(pairs, sign):
+    """
+    按变化量分组更新冗余计数：通常是一个用户关注或取消关注了多个用户，两边各一条UPDATE
+    """
+    for field, users in (('following_count', Counter(follower for follower, _ in pairs)),
+                         ('follower_count', Counter(followee for _, followee in pairs))):
+        groups = defaultdict(list)
+        for user_id, count in users.items():
+            groups[count].append(user_id)
+        for count, user_ids in groups.items():
+            CustomUser.objects.filter(pk__in=user_ids).update(**{field: F(field) + sign * count})
+
+
+@receiver(m2m_changed, sender=CustomUser.followers.through)
+def update_follow_state(sender, instance, action, reverse, pk_set, **kwargs):
+    field = 'following' if reverse else 'followers'
+    if action == 'post_add':
+        # add()发送的pk_set只包含新增的关系
+        pairs, followed = _follow_pairs(instance, reverse, pk_set), True
+    elif action in ('pre_remove', 'pre_clear'):
+        # remove()发送的是请求删除的全部ID，clear()之后就无法知道删除了哪些关系，所以在删除之前记下确实存在的关系
+        existing = getattr(instance, field).values_list('pk', flat=True)
+        if action == 'pre_remove':
+            existing = existing.filter(pk__in=pk_set)
+        instance._removed_follow_pairs = _follow_pairs(instance, reverse, existing)
+        return
+    elif action in ('post_remove', 'post_clear'):
+        pairs, followed = getattr(instance, '_removed_follow_pairs', []), False
+    else:
+        return
+    if not pairs:
+        return
+    # m2m_changed在写入关系的同一个事务中发送，计数与关注关系一起提交或回滚
+    _update_counts(pairs, 1 if followed else -1)
+    graph.follow_changed(pairs, followed)
+    # 推荐的增量计算在提交之后进行，不占用关注请求的事务；计算按提交后的关注关系重新计数，不依赖执行顺序
+    transaction.on_commit(lambda: suggestions.follows_changed(pairs))
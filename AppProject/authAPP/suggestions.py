@@ -0,0 +1,198 @@
+"""
+"可能认识的人"：按共同关注数推荐"关注的人也关注了"的用户（二度关系）。
+
+设关注邻接矩阵为A（A[u, f] = 1 表示u关注了f），则 (A @ A)[u, c] 就是u关注的人中关注了c的人数。
+批量计算（build_follow_suggestions命令）按行分块计算A的块与A的稀疏矩阵乘积，去掉对角线（自己）和u已经关注的人，
+每个用户保留共同关注数最多的settings.FOLLOW_SUGGESTION_TOP_K个，在一个事务中替换FollowSuggestion表。
+
+增量更新：u关注或取消关注v只会改变两类计数：
+1. (u, c)，c为v关注的人以及v本身；
+2. (w, v)，w为u的粉丝。
+关注关系变化的事务提交之后由信号调用follows_changed()（不占用关注请求的事务和行锁，失败也不会回滚关注），
+用两条分组查询重新计算这些行的准确值并写回（计数为0或已经关注的行删除），不依赖表中原有的值。
+增量写入同样遵守FOLLOW_SUGGESTION_TOP_K：推荐已满的用户只加入计数超过现有最小值的新推荐，多出的行随即删除。
+粉丝或关注数超过settings.FOLLOW_SUGGESTION_FANOUT_LIMIT的一侧不做增量更新，由下一次批量计算修正。
+
+读取时按(user, -mutual_count)索引直接取前几行，不需要在请求中关联关注表。
+"""
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+
+from .models import CustomUser, FollowSuggestion
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # NumPy和SciPy是可选依赖，只在批量计算时需要
+    np = sparse = None
+
+# 关注关系中间表：from_customuser为被关注者，to_customuser为关注者
+Follow = CustomUser.followers.through
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _following(user_id):
+    return Follow.objects.filter(to_customuser_id=user_id).values('from_customuser_id')
+
+
+def _followers(user_id):
+    return Follow.objects.filter(from_customuser_id=user_id).values('to_customuser_id')
+
+
+def _trim(user_id, top_k):
+    # 只保留共同关注数最多的top_k个推荐
+    extra = list(FollowSuggestion.objects.filter(user_id=user_id).order_by('-mutual_count', 'suggested_id')
+                 .values_list('id', flat=True)[top_k:])
+    if extra:
+        FollowSuggestion.objects.filter(id__in=extra).delete()
+
+
+def _write_counts(field, value, other, counts, scope):
+    """
+    写入重新计算的计数：field=value的行中other属于scope的部分替换为counts（{other的值: 计数}），不在counts中的行删除。
+    已存在的行按计数分组UPDATE，新的行用bulk_create(ignore_conflicts=True)写入。
+    不使用bulk_create(update_conflicts=True)：MySQL不支持按unique_fields指定冲突目标
+    """
+    rows = FollowSuggestion.objects.filter(**{field: value})
+    existing = set(rows.filter(**{f'{other}__in': counts}).values_list(other, flat=True))
+    groups = defaultdict(list)
+    for key in existing:
+        groups[counts[key]].append(key)
+    for count, keys in groups.items():
+        rows.filter(**{f'{other}__in': keys}).update(mutual_count=count)
+    rows.filter(**{f'{other}__in': scope - set(counts)}).delete()
+
+    new = [FollowSuggestion(**{field: value, other: key}, mutual_count=count)
+           for key, count in counts.items() if key not in existing]
+    if not new:
+        return
+    top_k = _setting('FOLLOW_SUGGESTION_TOP_K', 100)
+    # 新推荐所属用户现有的推荐数和最小计数：推荐已满时，计数不超过最小值的新推荐不会进入前top_k个
+    stats = {user_id: (size, lowest) for user_id, size, lowest in
+             FollowSuggestion.objects.filter(user_id__in={row.user_id for row in new})
+             .values('user_id').annotate(size=Count('id'), lowest=Min('mutual_count'))
+             .values_list('user_id', 'size', 'lowest')}
+    new = [row for row in new if row.user_id not in stats or stats[row.user_id][0] < top_k
+           or row.mutual_count > stats[row.user_id][1]]
+    FollowSuggestion.objects.bulk_create(new, ignore_conflicts=True)
+    added = defaultdict(int)
+    for row in new:
+        added[row.user_id] += 1
+    for user_id, size in added.items():
+        if stats.get(user_id, (0, 0))[0] + size > top_k:
+            _trim(user_id, top_k)
+
+
+def _refresh_user(user_id, candidates):
+    """
+    重新计算(user_id, c)，c属于candidates：user_id关注的人中关注了c的人数
+    """
+    candidates = set(candidates)
+    following = set(_following(user_id).filter(from_customuser_id__in=candidates)
+                    .values_list('from_customuser_id', flat=True))
+    rows = (Follow.objects.filter(to_customuser_id__in=_following(user_id),
+                                  from_customuser_id__in=candidates - following - {user_id})
+            .values('from_customuser_id').annotate(count=Count('id')).values_list('from_customuser_id', 'count'))
+    _write_counts('user_id', user_id, 'suggested_id', dict(rows), candidates)
+
+
+def _refresh_suggested(suggested_id, users):
+    """
+    重新计算(w, suggested_id)，w属于users：w关注的人中关注了suggested_id的人数
+    """
+    users = set(users)
+    already = set(_followers(suggested_id).filter(to_customuser_id__in=users)
+                  .values_list('to_customuser_id', flat=True))
+    rows = (Follow.objects.filter(to_customuser_id__in=users - already - {suggested_id},
+                                  from_customuser_id__in=_followers(suggested_id))
+            .values('to_customuser_id').annotate(count=Count('id')).values_list('to_customuser_id', 'count'))
+    _write_counts('suggested_id', suggested_id, 'user_id', dict(rows), users)
+
+
+def follows_changed(pairs):
+    """
+    关注或取消关注的事务提交之后调用，关注和取消关注的处理完全相同。同一关注者的多条变化合并处理：
+    受影响的(关注者, c)一次重新计算，关注者的粉丝只查询一次
+
+    :param pairs: [(关注者ID, 被关注者ID)]
+    """
+    limit = _setting('FOLLOW_SUGGESTION_FANOUT_LIMIT', 10000)
+    followees = defaultdict(set)
+    for follower_id, followee_id in pairs:
+        followees[follower_id].add(followee_id)
+    for follower_id, followee_ids in followees.items():
+        candidates = list(Follow.objects.filter(to_customuser_id__in=followee_ids)
+                          .values_list('from_customuser_id', flat=True)[:limit + 1])
+        if len(candidates) <= limit:
+            _refresh_user(follower_id, [*candidates, *followee_ids])
+        users = list(_followers(follower_id).values_list('to_customuser_id', flat=True)[:limit + 1])
+        if users and len(users) <= limit:
+            for followee_id in followee_ids:
+                _refresh_suggested(followee_id, users)
+
+
+def build(top_k=None, block_size=1000, batch_size=5000):
+    """
+    批量重新计算全部用户的推荐并替换FollowSuggestion表
+
+    :return: 统计信息和耗时（秒）
+    """
+    if np is None:
+        raise RuntimeError('NumPy and SciPy are required to build follow suggestions.')
+    top_k = top_k or _setting('FOLLOW_SUGGESTION_TOP_K', 100)
+
+    start = time.perf_counter()
+    edges = np.array(list(Follow.objects.values_list('to_customuser_id', 'from_customuser_id')
+                          .iterator(chunk_size=10000)), dtype=np.int64).reshape(-1, 2)
+    users = np.unique(edges)
+    size = len(users)
+    adjacency = sparse.csr_matrix(
+        (np.ones(len(edges), dtype=np.int32),
+         (np.searchsorted(users, edges[:, 0]), np.searchsorted(users, edges[:, 1]))),
+        shape=(size, size))
+    stats = {'users': size, 'edges': len(edges), 'load_seconds': time.perf_counter() - start}
+
+    start = time.perf_counter()
+    suggestions = []
+    for begin in range(0, size, block_size):
+        rows = adjacency[begin:begin + block_size]
+        counts = (rows @ adjacency).tocsr()
+        # 去掉已经关注的人和自己
+        counts = (counts - counts.multiply(rows)
+                  - counts.multiply(sparse.eye(rows.shape[0], size, k=begin, dtype=np.int32, format='csr'))).tocsr()
+        counts.eliminate_zeros()
+        for row in range(counts.shape[0]):
+            first, last = counts.indptr[row], counts.indptr[row + 1]
+            columns, values = counts.indices[first:last], counts.data[first:last]
+            if len(values) > top_k:
+                best = np.argpartition(-values, top_k)[:top_k]
+                columns, values = columns[best], values[best]
+            user_id = int(users[begin + row])
+            suggestions.extend(FollowSuggestion(user_id=user_id, suggested_id=int(users[column]),
+                                                mutual_count=int(value))
+                               for column, value in zip(columns.tolist(), values.tolist()))
+    stats.update(suggestions=len(suggestions), compute_seconds=time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with transaction.atomic():
+        FollowSuggestion.objects.all().delete()
+        FollowSuggestion.objects.bulk_create(suggestions, batch_size=batch_size)
+    stats['write_seconds'] = time.perf_counter() - start
+    return stats
+
+
+def suggestions_for(user_id, limit):
+    """
+    :return: [(推荐的用户, 共同关注数)]，按共同关注数降序
+    """
+    rows = (FollowSuggestion.objects.filter(user_id=user_id).select_related('suggested')
+            .only('mutual_count', 'suggested__id', 'suggested__username')
+            .order_by('-mutual_count', 'suggested_id')[:limit])
+    return [(row.suggested, row.mutual_count) for row in rows]
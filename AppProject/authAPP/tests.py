@@ -1,8 +1,18 @@
-from django.test import TestCase, Client
+import io
+import json
+from unittest import mock, skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
 
+from . import graph, suggestions, views
+from .models import FollowSuggestion
+
 """
 包含应用程序的单元测试代码，用于测试应用程序的功能和逻辑。
 """
@@ -174,3 +184,399 @@ class UserRelationshipTestCase(TestCase):
         response = self.client.post(url)
         self.assertEqual(response.status_code, 404)
         self.assertJSONEqual(str(response.content, encoding='utf8'), {'error': 'User not found'})
+
+
+class FollowListConditionalGetTestCase(TestCase):
+    """
+    关注列表和粉丝列表的条件请求测试
+    """
+
+    def setUp(self):
+        User_test = get_user_model()
+        self.user1 = User_test.objects.create_user(username='user1', email='user1@example.com', password='12345')
+        self.user2 = User_test.objects.create_user(username='user2', email='user2@example.com', password='12345')
+        self.user3 = User_test.objects.create_user(username='user3', email='user3@example.com', password='12345')
+        self.user1.follow(self.user2)
+
+    def test_unchanged_list_returns_304(self):
+        url = reverse('get_following_users', kwargs={'user_id': self.user1.id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        # 只执行计算ETag的一条聚合查询
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_follow_changes_etag(self):
+        url = reverse('get_followers', kwargs={'user_id': self.user2.id})
+        etag = self.client.get(url)['ETag']
+        self.user3.follow(self.user2)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.user3.following.remove(self.user2)
+        self.user1.following.remove(self.user2)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class FollowListPaginationTestCase(TestCase):
+    """
+    关注列表和粉丝列表的游标分页和流式导出测试
+    """
+
+    def setUp(self):
+        User_test = get_user_model()
+        self.star = User_test.objects.create_user(username='star', email='star@example.com', password='12345')
+        self.fans = [User_test.objects.create_user(username=f'fan{i}', email=f'fan{i}@example.com', password='12345')
+                     for i in range(7)]
+        for fan in self.fans:
+            fan.follow(self.star)
+
+    @mock.patch.object(views, 'FOLLOW_PAGE_SIZE', 3)
+    def test_cursor_pages_newest_first(self):
+        url = reverse('get_followers', kwargs={'user_id': self.star.id})
+        seen, cursor = [], ''
+        while cursor is not None:
+            # 判断用户是否存在、计算ETag、读取一页
+            with self.assertNumQueries(3):
+                data = self.client.get(url, {'cursor': cursor}).json()
+            self.assertLessEqual(len(data['users']), 3)
+            seen.extend(data['users'])
+            cursor = data['next_cursor']
+        self.assertEqual(seen, [{'id': fan.id, 'username': fan.username} for fan in reversed(self.fans)])
+
+        following = self.client.get(reverse('get_following_users', kwargs={'user_id': self.fans[0].id}),
+                                    {'cursor': ''}).json()
+        self.assertEqual(following, {'users': [{'id': self.star.id, 'username': 'star'}], 'next_cursor': None})
+        self.assertEqual(self.client.get(url, {'cursor': 'bad'}).status_code, 400)
+
+    @mock.patch.object(views, 'FOLLOW_PAGE_SIZE', 3)
+    def test_pages_have_distinct_etags(self):
+        url = reverse('get_followers', kwargs={'user_id': self.star.id})
+        first = self.client.get(url, {'cursor': ''})
+        self.assertNotEqual(first['ETag'], self.client.get(url)['ETag'])
+        second = {'cursor': first.json()['next_cursor']}
+        response = self.client.get(url, second, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, second, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    @mock.patch.object(views, 'FOLLOW_EXPORT_CHUNK_SIZE', 2)
+    def test_export_streams_full_list(self):
+        response = self.client.get(reverse('get_followers', kwargs={'user_id': self.star.id}), {'export': ''})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data, [{'id': fan.id, 'username': fan.username} for fan in self.fans])
+
+        response = self.client.get(reverse('get_following_users', kwargs={'user_id': self.star.id}), {'export': ''})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+        missing = reverse('get_followers', kwargs={'user_id': self.fans[-1].id + 100})
+        self.assertEqual(self.client.get(missing, {'export': ''}).status_code, 404)
+
+
+class BulkFollowTestCase(TestCase):
+    """
+    批量关注、取消关注以及冗余的粉丝数和关注数的测试
+    """
+
+    def setUp(self):
+        User_test = get_user_model()
+        self.me = User_test.objects.create_user(username='me', email='me@example.com', password='12345')
+        self.accounts = [User_test.objects.create_user(username=f'park{i}', email=f'park{i}@example.com',
+                                                       password='12345') for i in range(30)]
+
+    def _assert_counts(self):
+        for user in get_user_model().objects.all():
+            self.assertEqual((user.follower_count, user.following_count),
+                             (user.followers.count(), user.following.count()), user.username)
+
+    def test_follow_many_queries_do_not_grow(self):
+        ids = [account.id for account in self.accounts]
+        with CaptureQueriesContext(connection) as few:
+            self.me.follow_many(ids[:3])
+        with CaptureQueriesContext(connection) as many:
+            followed, already = self.me.follow_many(ids)
+        self.assertEqual(len(many), len(few))
+        self.assertEqual((followed, already), (set(ids[3:]), set(ids[:3])))
+        self._assert_counts()
+        self.me.refresh_from_db()
+        self.assertEqual(self.me.following_count, 30)
+
+    def test_counts_follow_every_path(self):
+        a, b, c = self.accounts[:3]
+        self.me.follow_many([a.id, b.id, self.me.id, 10 ** 9])
+        self.me.follow(c)
+        a.followers.add(b, c)
+        # 删除不存在的关注关系不影响计数
+        a.following.remove(self.me)
+        self.me.unfollow(a)
+        self._assert_counts()
+        self.assertEqual(self.me.unfollow_many([a.id, b.id, c.id]), {b.id, c.id})
+        a.followers.clear()
+        self._assert_counts()
+        self.assertEqual(get_user_model().objects.filter(follower_count__gt=0).count(), 0)
+
+    def test_single_follow_takes_the_row_lock(self):
+        a = self.accounts[0]
+        with mock.patch.object(get_user_model(), '_lock', autospec=True,
+                               side_effect=get_user_model()._lock) as lock:
+            self.me.follow(a)
+            # 已经关注时不再写入，计数不变
+            self.me.follow(a)
+            self.me.unfollow(a)
+        self.assertEqual(lock.call_count, 3)
+        self._assert_counts()
+
+    def test_bulk_follow_updates_suggestions_and_graph(self):
+        graph.reset()
+        self.addCleanup(graph.reset)
+        a, b = self.accounts[:2]
+        a.follow(b)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.me.follow_many([a.id])
+        self.assertTrue(FollowSuggestion.objects.filter(user=self.me, suggested=b, mutual_count=1).exists())
+        if graph.np is not None:
+            self.assertTrue(self.me.is_following(a))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.me.unfollow_many([a.id])
+        self.assertFalse(FollowSuggestion.objects.filter(user=self.me).exists())
+        if graph.np is not None:
+            self.assertFalse(self.me.is_following(a))
+
+    def test_endpoints(self):
+        follow_url, unfollow_url = reverse('follow_users'), reverse('unfollow_users')
+        self.assertEqual(self.client.post(follow_url, {'user_ids': '1'}).status_code, 302)
+        self.client.login(username='me', password='12345')
+        self.assertEqual(self.client.post(follow_url).status_code, 400)
+        self.assertEqual(self.client.post(follow_url, {'user_ids': 'a,b'}).status_code, 400)
+
+        a, b = self.accounts[:2]
+        self.me.follow(a)
+        missing = b.id + 1000
+        response = self.client.post(follow_url, {'user_ids': f'{b.id},{a.id},{missing},{self.me.id}'})
+        self.assertEqual(response.json(), {'message': 'Users followed successfully.', 'followed': [b.id],
+                                           'already_following': [a.id], 'not_found': [missing]})
+        response = self.client.post(unfollow_url, {'user_ids': [a.id, missing]})
+        self.assertEqual(response.json(), {'message': 'Users unfollowed successfully.', 'unfollowed': [a.id],
+                                           'not_following': [missing]})
+        self._assert_counts()
+
+
+class FollowSuggestionTestCase(TestCase):
+    """
+    "可能认识的人"的测试
+    """
+
+    def setUp(self):
+        User_test = get_user_model()
+        self.a, self.b, self.c, self.d, self.e = [
+            User_test.objects.create_user(username=name, email=f'{name}@example.com', password='12345')
+            for name in 'abcde']
+        # 推荐在关注的事务提交之后增量更新
+        with self.captureOnCommitCallbacks(execute=True):
+            self.a.follow(self.b)
+            self.a.follow(self.c)
+            self.b.follow(self.d)
+            self.c.follow(self.d)
+            self.b.follow(self.e)
+
+    def _table(self):
+        return set(FollowSuggestion.objects.values_list('user__username', 'suggested__username', 'mutual_count'))
+
+    def test_incremental_updates(self):
+        self.assertEqual(self._table(), {('a', 'd', 2), ('a', 'e', 1)})
+        # 关注之后不再推荐
+        with self.captureOnCommitCallbacks(execute=True):
+            self.a.follow(self.d)
+        self.assertEqual(self._table(), {('a', 'e', 1)})
+        # 取消关注之后重新计算
+        with self.captureOnCommitCallbacks(execute=True):
+            self.a.unfollow(self.d)
+            self.c.unfollow(self.d)
+        self.assertEqual(self._table(), {('a', 'd', 1), ('a', 'e', 1)})
+        # e关注a：e得到了(e, b)、(e, c)；e的粉丝b得到了(b, a)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.e.follow(self.a)
+        self.assertEqual(self._table(), {('a', 'd', 1), ('a', 'e', 1), ('e', 'b', 1), ('e', 'c', 1), ('b', 'a', 1)})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.b.following.clear()
+        self.assertEqual(self._table(), {('e', 'b', 1), ('e', 'c', 1)})
+
+    @skipUnless(suggestions.np is not None, 'NumPy and SciPy are required.')
+    def test_build_matches_incremental(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.e.follow(self.a)
+            self.d.follow(self.a)
+        incremental = self._table()
+        FollowSuggestion.objects.all().delete()
+        out = io.StringIO()
+        call_command('build_follow_suggestions', stdout=out)
+        self.assertIn('Stored', out.getvalue())
+        self.assertEqual(self._table(), incremental)
+
+        suggestions.build(top_k=1)
+        self.assertEqual(set(FollowSuggestion.objects.filter(user=self.a).values_list('suggested__username',
+                                                                                      flat=True)), {'d'})
+
+    @override_settings(FOLLOW_SUGGESTION_FANOUT_LIMIT=1)
+    def test_fanout_limit_skips_large_accounts(self):
+        FollowSuggestion.objects.all().delete()
+        # b关注了两个人，超过上限，a关注b时不更新a的推荐
+        with self.captureOnCommitCallbacks(execute=True):
+            self.a.unfollow(self.b)
+            self.a.follow(self.b)
+        self.assertFalse(FollowSuggestion.objects.filter(user=self.a, suggested=self.e).exists())
+
+    def test_updates_run_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.a.follow(self.d)
+        # 提交之前推荐不变，关注请求的事务中不做推荐的计算
+        self.assertIn(('a', 'd', 2), self._table())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self._table(), {('a', 'e', 1)})
+
+    def test_without_conflict_target_support(self):
+        # MySQL不支持bulk_create(update_conflicts=True, unique_fields=...)，增量更新不能依赖它
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            with self.captureOnCommitCallbacks(execute=True):
+                # 已有的(a, d)更新计数，新的(e, b)、(e, c)、(b, a)写入
+                self.c.unfollow(self.d)
+                self.e.follow_many([self.a.id])
+        self.assertEqual(self._table(), {('a', 'd', 1), ('a', 'e', 1), ('e', 'b', 1), ('e', 'c', 1), ('b', 'a', 1)})
+
+    @override_settings(FOLLOW_SUGGESTION_TOP_K=1)
+    def test_incremental_updates_keep_top_k(self):
+        FollowSuggestion.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.c.unfollow(self.d)
+            self.c.follow(self.d)
+        self.assertEqual(self._table(), {('a', 'd', 2)})
+        # a的推荐已满，e的计数2不超过现有的最小值，不加入
+        with self.captureOnCommitCallbacks(execute=True):
+            self.c.follow(self.e)
+        self.assertEqual(self._table(), {('a', 'd', 2)})
+        # e的计数3超过d，替换d
+        f = get_user_model().objects.create_user(username='f', email='f@example.com', password='12345')
+        with self.captureOnCommitCallbacks(execute=True):
+            f.follow(self.e)
+            self.a.follow(f)
+        self.assertEqual(self._table(), {('a', 'e', 3)})
+
+    def test_suggestions_endpoint(self):
+        url = reverse('get_follow_suggestions')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.login(username='a', password='12345')
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.json(), [{'id': self.d.id, 'username': 'd', 'mutual_count': 2},
+                                           {'id': self.e.id, 'username': 'e', 'mutual_count': 1}])
+
+
+@skipUnless(graph.np is not None, 'NumPy is required.')
+class FollowGraphTestCase(TestCase):
+    """
+    进程内关注关系索引的测试
+    """
+
+    def setUp(self):
+        graph.reset()
+        self.addCleanup(graph.reset)
+        User_test = get_user_model()
+        self.a, self.b, self.c, self.d = [
+            User_test.objects.create_user(username=name, email=f'{name}@example.com', password='12345')
+            for name in 'abcd']
+        self.a.follow(self.b)
+        self.a.follow(self.c)
+        self.b.follow(self.c)
+
+    def _assert_matches_database(self, index):
+        users = [self.a, self.b, self.c, self.d]
+        for user in users:
+            self.assertEqual(index.following_count(user.id), user.following.count())
+            self.assertEqual(index.follower_count(user.id), user.followers.count())
+            for other in users:
+                self.assertEqual(index.is_following(user.id, other.id),
+                                 user.following.filter(id=other.id).exists())
+
+    def test_lookups_do_not_query(self):
+        index = graph.get_graph()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.a.is_following(self.b))
+            self.assertFalse(self.b.is_following(self.a))
+            self.assertEqual(index.following_count(self.a.id), 2)
+            self.assertEqual(index.follower_count(self.c.id), 2)
+            self.assertEqual(index.follower_count(self.d.id), 0)
+        self._assert_matches_database(index)
+
+    def test_follow_and_unfollow_update_after_commit(self):
+        index = graph.get_graph()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.d.follow(self.a)
+            self.a.unfollow(self.b)
+            # 重复的关注和取消关注不影响计数
+            self.d.follow(self.a)
+            self.a.unfollow(self.b)
+        self.assertTrue(self.d.is_following(self.a))
+        self.assertFalse(self.a.is_following(self.b))
+        self._assert_matches_database(index)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.a.follow(self.b)
+            self.d.unfollow(self.a)
+            self.c.followers.clear()
+        self.assertEqual((index.added, index.removed), (set(), {(self.a.id, self.c.id), (self.b.id, self.c.id)}))
+        self._assert_matches_database(index)
+
+    def test_changes_wait_for_commit(self):
+        index = graph.get_graph()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.d.follow(self.a)
+        self.assertFalse(index.is_following(self.d.id, self.a.id))
+        for callback in callbacks:
+            callback()
+        self.assertTrue(index.is_following(self.d.id, self.a.id))
+
+    @override_settings(FOLLOW_GRAPH_OVERLAY_LIMIT=1, FOLLOW_GRAPH_BLOOM_BITS_PER_EDGE=10)
+    def test_compaction_and_bloom_filter(self):
+        graph.get_graph()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.d.follow(self.a)
+            self.d.follow(self.b)
+            self.a.unfollow(self.c)
+        index = graph.get_graph()
+        self.assertIsNotNone(index.bloom)
+        self.assertLessEqual(index.overlay_size, 1)
+        self._assert_matches_database(index)
+        self._assert_matches_database(graph.FollowGraph.from_database(bloom_bits_per_edge=10))
+
+    @override_settings(FOLLOW_GRAPH_OVERLAY_LIMIT=1)
+    def test_changes_during_compaction_are_kept(self):
+        graph.get_graph()
+        compacted = graph.FollowGraph.compacted
+        concurrent = [(self.d.id, self.c.id)]
+
+        def compact_then_follow(index):
+            snapshot = compacted(index)
+            # 其他线程在快照之后、替换之前提交了关注（它自己不触发合并）
+            if concurrent:
+                with override_settings(FOLLOW_GRAPH_OVERLAY_LIMIT=10000):
+                    graph._apply([concurrent.pop()], True)
+            return snapshot
+
+        with mock.patch.object(graph.FollowGraph, 'compacted', autospec=True, side_effect=compact_then_follow):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.d.follow(self.a)
+                self.d.follow(self.b)
+        self.d.following.add(self.c)
+        index = graph.get_graph()
+        self.assertTrue(index.is_following(self.d.id, self.c.id))
+        self._assert_matches_database(index)
+
+    @override_settings(FOLLOW_GRAPH_ENABLED=False)
+    def test_disabled_falls_back_to_database(self):
+        self.assertIsNone(graph.get_graph())
+        with self.assertNumQueries(1):
+            self.assertTrue(self.a.is_following(self.b))
@@ -1,6 +1,6 @@
 from django.urls import path
 from .views import user_login, user_register, user_logout, get_user_info, get_following_users, get_followers, \
-    login_test_page, register_test_page
+    login_test_page, register_test_page, get_follow_suggestions, follow_users, unfollow_users
 
 """
 将视图函数添加到urlpatterns列表中，并为每个URL配置指定了相应的路径和视图函数。这样可以将不同的请求映射到对应的视图函数上，实现各种功能的API
@@ -15,5 +15,8 @@ urlpatterns = [
     path('user/<int:user_id>/', get_user_info, name='get_user_info'),  # 获取用户信息
     path('user/<int:user_id>/following/', get_following_users, name='get_following_users'),  # 获取用户的关注列表
     path('user/<int:user_id>/followers/', get_followers, name='get_followers'),  # 获取用户的粉丝列表
+    path('suggestions/', get_follow_suggestions, name='get_follow_suggestions'),  # 可能认识的人
+    path('follow/', follow_users, name='follow_users'),  # 批量关注
+    path('unfollow/', unfollow_users, name='unfollow_users'),  # 批量取消关注
 
 ]
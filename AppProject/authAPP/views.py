@@ -1,3 +1,6 @@
+import hashlib
+import json
+
 from django.shortcuts import render
 
 """
@@ -5,11 +8,18 @@ from django.shortcuts import render
 """
 # Create your views here.
 from django.contrib.auth import authenticate, login
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.contrib.auth import get_user_model
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import condition, require_http_methods, require_POST
+from django.db.models import Count, F, Max
 from django.contrib.auth import logout
+from django.contrib.auth.decorators import login_required
+
+from dynamic.pagination import InvalidCursor, paginate_by_cursor
+from dynamic.params import parse_ids
+
+from . import suggestions
 
 
 @csrf_exempt
@@ -104,8 +114,84 @@ def get_user_info(request, user_id):
         return JsonResponse({'error': 'User not found'}, status=404)
 
 
+# 游标分页模式下每页的用户数
+FOLLOW_PAGE_SIZE = 50
+# 导出模式下每次从数据库读取的行数
+FOLLOW_EXPORT_CHUNK_SIZE = 2000
+
+
+def _follow_etag(request, **lookup):
+    """
+    关注列表的ETag：在关注关系中间表上取最大ID和行数，关注、取消关注都会改变它；
+    分页和导出的参数也计入ETag，不同的页不会互相命中。
+    没有任何关注关系时（包括用户不存在）不返回ETag，由视图正常处理
+    """
+    through = get_user_model().followers.through
+    state = through.objects.filter(**lookup).aggregate(last_id=Max('id'), count=Count('id'))
+    if not state['count']:
+        return None
+    query = hashlib.md5(request.GET.urlencode().encode('utf-8')).hexdigest()[:8]
+    return f'{state["last_id"]}-{state["count"]}-{query}'
+
+
+def _following_etag(request, user_id):
+    # to_customuser为关注者
+    return _follow_etag(request, to_customuser_id=user_id)
+
+
+def _followers_etag(request, user_id):
+    return _follow_etag(request, from_customuser_id=user_id)
+
+
+def _stream_users(rows, chunk_size):
+    """
+    按中间表ID分批读取(用户ID, 用户名)并逐批输出JSON数组。每批是一次独立的keyset查询，
+    内存占用只与chunk_size有关，与列表长度无关（MySQL驱动会把整个结果集读入客户端，不能依赖单个查询的iterator()）
+    """
+    yield '['
+    last_id, first = 0, True
+    while True:
+        batch = list(rows.filter(id__gt=last_id).order_by('id')[:chunk_size].iterator(chunk_size=chunk_size))
+        if not batch:
+            break
+        yield (('' if first else ',') +
+               ','.join(json.dumps({'id': user_id, 'username': username}) for _, user_id, username in batch))
+        last_id, first = batch[-1][0], False
+    yield ']'
+
+
+def _follow_listing(request, user_id, lookup, other):
+    """
+    关注列表和粉丝列表的公共实现，只查询中间表和对方用户的必要字段，不创建模型实例。
+
+    :param lookup: 在中间表上筛选该用户的条件
+    :param other: 列表中的用户在中间表中对应的字段（from_customuser或to_customuser）
+    """
+    User = get_user_model()
+    if not User.objects.filter(id=user_id).exists():
+        return JsonResponse({'error': 'User not found'}, status=404)
+    rows = User.followers.through.objects.filter(**lookup)
+
+    if 'export' in request.GET:
+        users = rows.values_list('id', f'{other}_id', f'{other}__username')
+        return StreamingHttpResponse(_stream_users(users, FOLLOW_EXPORT_CHUNK_SIZE), content_type='application/json')
+    if 'cursor' in request.GET:
+        users = rows.values('id', user_id=F(f'{other}_id'), username=F(f'{other}__username'))
+        try:
+            page, next_cursor = paginate_by_cursor(users, request.GET.get('cursor'), FOLLOW_PAGE_SIZE,
+                                                   fields=('id',))
+        except InvalidCursor:
+            return JsonResponse({'message': 'Invalid cursor.'}, status=400)
+        return JsonResponse({'users': [{'id': row['user_id'], 'username': row['username']} for row in page],
+                             'next_cursor': next_cursor})
+
+    users = rows.values_list(f'{other}__username', f'{other}__email')
+    return JsonResponse([{'username': username, 'email': email} for username, email in users], safe=False)
+
+
 @csrf_exempt
-@require_POST
+@require_http_methods(["GET", "POST"])
+@condition(etag_func=_following_etag)
 def get_following_users(request, user_id):
     """
     用于处理获取关注的用户列表请求的视图函数。接收用户ID作为参数，从数据库中获取对应用户关注的用户列表，并返回关注用户的基本信息，如用户名和电子邮件。
@@ -113,20 +199,18 @@ def get_following_users(request, user_id):
     :param request: 包含获取关注用户列表的请求对象
     :param user_id: 要获取关注用户列表的用户ID
     :return: 返回JSON响应，包含关注用户的基本信息列表
+    支持GET轮询：响应带有ETag，请求带上If-None-Match且关注列表没有变化时直接返回304。
+    游标模式：请求中带有cursor参数（第一页传空字符串）时按关注的先后倒序分页，每页50个，
+    返回{'users': [{'id', 'username'}], 'next_cursor'}。
+    导出模式：请求中带有export参数时以流式响应返回完整的[{'id', 'username'}]列表，内存占用与列表长度无关。
     """
-    User = get_user_model()
-    try:
-        user = User.objects.get(id=user_id)
-        following_users = user.following.all()
-        following_list = [{'username': following_user.username, 'email': following_user.email} for following_user in
-                          following_users]
-        return JsonResponse(following_list, safe=False)
-    except User.DoesNotExist:
-        return JsonResponse({'error': 'User not found'}, status=404)
+    # to_customuser为关注者
+    return _follow_listing(request, user_id, {'to_customuser_id': user_id}, 'from_customuser')
 
 
 @csrf_exempt
-@require_POST
+@require_http_methods(["GET", "POST"])
+@condition(etag_func=_followers_etag)
 def get_followers(request, user_id):
     """
     用于处理获取粉丝列表请求的视图函数。接收用户ID作为参数，从数据库中获取对应用户的粉丝列表，并返回粉丝的基本信息，如用户名和电子邮件。
@@ -134,12 +218,79 @@ def get_followers(request, user_id):
     :param request: 包含获取粉丝列表的请求对象
     :param user_id: 要获取粉丝列表的用户ID
     :return: 返回JSON响应，包含粉丝的基本信息列表
+    支持GET轮询：响应带有ETag，请求带上If-None-Match且粉丝列表没有变化时直接返回304。
+    游标模式和导出模式与get_following_users相同。
     """
-    User = get_user_model()
-    try:
-        user = User.objects.get(id=user_id)
-        followers = user.followers.all()
-        followers_list = [{'username': follower.username, 'email': follower.email} for follower in followers]
-        return JsonResponse(followers_list, safe=False)
-    except User.DoesNotExist:
-        return JsonResponse({'error': 'User not found'}, status=404)
+    return _follow_listing(request, user_id, {'from_customuser_id': user_id}, 'to_customuser')
+
+
+# 批量关注和取消关注每次最多的用户数
+MAX_BATCH_FOLLOWS = 500
+
+
+def _batch_user_ids(request):
+    """
+    :return: (去重后的用户ID列表, 错误响应或None)
+    """
+    user_ids = parse_ids(request.POST.getlist('user_ids'))
+    if not user_ids:
+        return None, JsonResponse({'message': 'Please provide user_ids.'}, status=400)
+    if len(user_ids) > MAX_BATCH_FOLLOWS:
+        return None, JsonResponse({'message': f'At most {MAX_BATCH_FOLLOWS} users per request.'}, status=400)
+    return user_ids, None
+
+
+@login_required
+@require_http_methods(["POST"])
+def follow_users(request):
+    """
+    批量关注，例如新用户注册后一次关注推荐的一批账号。查询次数固定，与用户数无关：
+    一条查询得到存在的用户和已有的关注关系，bulk_create写入新关系，冗余的粉丝数和关注数各一条UPDATE。
+    已经关注的用户会被忽略，因此重复提交同一批是安全的。
+    """
+    user_ids, error = _batch_user_ids(request)
+    if error:
+        return error
+    followed, already_following = request.user.follow_many(user_ids)
+    return JsonResponse({
+        'message': 'Users followed successfully.',
+        'followed': [user_id for user_id in user_ids if user_id in followed],
+        'already_following': [user_id for user_id in user_ids if user_id in already_following],
+        'not_found': [user_id for user_id in user_ids
+                      if user_id not in followed and user_id not in already_following and user_id != request.user.id],
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def unfollow_users(request):
+    """
+    批量取消关注：一条查询得到已有的关注关系，一条DELETE删除，冗余计数各一条UPDATE。没有关注的用户会被忽略
+    """
+    user_ids, error = _batch_user_ids(request)
+    if error:
+        return error
+    unfollowed = request.user.unfollow_many(user_ids)
+    return JsonResponse({
+        'message': 'Users unfollowed successfully.',
+        'unfollowed': [user_id for user_id in user_ids if user_id in unfollowed],
+        'not_following': [user_id for user_id in user_ids if user_id not in unfollowed],
+    })
+
+
+FOLLOW_SUGGESTION_PAGE_SIZE = 20
+
+
+@login_required
+@require_http_methods(["GET"])
+def get_follow_suggestions(request):
+    """
+    "可能认识的人"：当前用户关注的人也关注了、而当前用户还没有关注的用户，按共同关注数降序。
+    结果预先计算在FollowSuggestion表中（见suggestions.py），请求中只读取这张表。
+
+    :return: 返回JSON响应，包含推荐用户的ID、用户名和共同关注数
+    """
+    suggestion_list = [{'id': user.id, 'username': user.username, 'mutual_count': mutual_count}
+                       for user, mutual_count in suggestions.suggestions_for(request.user.id,
+                                                                             FOLLOW_SUGGESTION_PAGE_SIZE)]
+    return JsonResponse(suggestion_list, safe=False)
@@ -0,0 +1,225 @@
+"""
+按内容寻址、带引用计数的媒体文件存储。
+
+同一张照片被转发、重复发布时，Media.file_path（upload_to='media/'）每次都会另存一份。这里按文件内容的SHA-256
+把文件存为MediaBlob（blobs/<前两位>/<摘要>.<扩展名>），每个摘要只存一份，Media通过blob外键引用，并把file_path指向同一个文件。
+
+摘要在接收上传时边读边算（HashingMemoryFileUploadHandler/HashingTemporaryFileUploadHandler，
+通过settings.FILE_UPLOAD_HANDLERS启用），分块上传的文件在挂到动态时从临时文件流式计算，内存占用都与文件大小无关。
+已经存在相同摘要的文件时只给引用计数加一，不再向媒体存储写入任何数据。新文件先暂存，在事务提交之后才以摘要为文件名
+写入媒体存储（同名文件已经存在时直接使用），回滚时媒体存储中不会留下没有记录的文件。
+
+删除Media（包括删除动态时的级联删除）会减少引用计数；计数降为0时删除记录，并在事务提交后删除文件。
+"""
+import hashlib
+import os
+import re
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Media, MediaBlob
+
+# 从文件流式计算摘要时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+# 等待事务提交的上传文件的后缀（见_stage()）
+STAGED_SUFFIX = '.blob'
+
+
+class _HashingMixin:
+    """
+    在上传处理器接收数据的同时计算SHA-256，完成后保存在文件对象的content_digest属性上
+    """
+
+    def new_file(self, *args, **kwargs):
+        # MemoryFileUploadHandler.new_file会抛出StopFutureHandlers，先初始化
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def _consumes_data(self):
+        return True
+
+    def receive_data_chunk(self, raw_data, start):
+        if self._consumes_data():
+            self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_digest = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(_HashingMixin, MemoryFileUploadHandler):
+    def _consumes_data(self):
+        # 文件超过内存上限时不由这个处理器接收，数据会交给后面的临时文件处理器
+        return self.activated
+
+
+class HashingTemporaryFileUploadHandler(_HashingMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def file_digest(file):
+    """
+    返回上传文件的SHA-256：上传处理器已经算好时直接使用，否则分块读取计算
+    """
+    digest = getattr(file, 'content_digest', None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks(HASH_CHUNK_SIZE):
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def _blob_name(digest, filename):
+    # 保留第一次上传时的扩展名，便于按扩展名推断Content-Type
+    extension = os.path.splitext(filename or '')[1].lower()
+    if not re.fullmatch(r'\.[a-z0-9]{1,8}', extension):
+        extension = ''
+    return f'blobs/{digest[:2]}/{digest}{extension}'
+
+
+def _create(digest, name, size):
+    """
+    引用计数加一；还没有这个摘要的blob时创建，返回(MediaBlob, 是否新建)
+    """
+    if MediaBlob.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1):
+        return MediaBlob.objects.get(digest=digest), False
+    try:
+        with transaction.atomic():
+            return MediaBlob.objects.create(digest=digest, file=name, size=size, ref_count=1), True
+    except IntegrityError:
+        # 并发上传了相同的文件，对方先创建了blob，引用对方的blob
+        MediaBlob.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1)
+        return MediaBlob.objects.get(digest=digest), False
+
+
+def _store(file, blob_id, name):
+    """
+    在事务提交之后把文件存入媒体存储。文件名由摘要决定，同名文件已经存在时内容相同，直接使用；
+    存储仍然生成了另一个文件名时（例如大小写不敏感的存储），blob和Media随之更新
+    """
+    if default_storage.exists(name):
+        return
+    saved = default_storage.save(name, file)
+    if saved != name:
+        MediaBlob.objects.filter(id=blob_id).update(file=saved)
+        Media.objects.filter(blob_id=blob_id, file_path=name).update(file_path=saved)
+
+
+def _staging_dir():
+    # 与分块上传的临时文件在同一目录，和媒体存储在同一文件系统上，提交后移动时只是rename
+    return getattr(settings, 'UPLOAD_SESSION_DIR', os.path.join(settings.BASE_DIR, 'upload_sessions'))
+
+
+def _stage(file):
+    """
+    把上传的文件暂存到本地：请求结束时上传的文件会被关闭和删除，而事务可能在那之后才提交。
+    磁盘上的临时文件用硬链接暂存，不复制数据；内存中的小文件直接写出
+
+    :return: 暂存文件的路径
+    """
+    os.makedirs(_staging_dir(), exist_ok=True)
+    path = os.path.join(_staging_dir(), f'{uuid.uuid4().hex}{STAGED_SUFFIX}')
+    if hasattr(file, 'temporary_file_path'):
+        try:
+            os.link(file.temporary_file_path(), path)
+            return path
+        except OSError:
+            pass
+    file.seek(0)
+    with open(path, 'wb') as staged:
+        for chunk in file.chunks(HASH_CHUNK_SIZE):
+            staged.write(chunk)
+    file.seek(0)
+    return path
+
+
+def clear_staged(before):
+    """
+    删除修改时间早于before（时间戳）的暂存文件：事务回滚时暂存的文件不会移入媒体存储，由clear_upload_sessions命令清理
+
+    :return: 删除的文件数
+    """
+    count = 0
+    if not os.path.isdir(_staging_dir()):
+        return count
+    for entry in os.scandir(_staging_dir()):
+        if entry.name.endswith(STAGED_SUFFIX) and entry.stat().st_mtime < before:
+            os.remove(entry.path)
+            count += 1
+    return count
+
+
+def acquire(file, digest=None):
+    """
+    取得内容与file相同的blob并给引用计数加一；还没有时创建blob，文件先暂存到本地，在当前事务提交之后才移入媒体存储，
+    事务回滚时媒体存储中不会留下没有记录的文件
+
+    :param file: 上传的文件；提供temporary_file_path()时用硬链接暂存，移入媒体存储时直接移动而不是复制
+    :return: MediaBlob
+    """
+    digest = digest or file_digest(file)
+    blob, created = _create(digest, _blob_name(digest, file.name), file.size)
+    if created:
+        path = _stage(file)
+        transaction.on_commit(lambda: _store_path(path, file.name, blob.id, blob.file.name, staged=True))
+    return blob
+
+
+class _LocalFile(File):
+    """
+    提供temporary_file_path()，FileSystemStorage保存时会直接移动文件而不是逐块复制
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def _store_path(path, filename, blob_id, name, staged=False):
+    with open(path, 'rb') as local:
+        _store(_LocalFile(local, name=filename), blob_id, name)
+    if staged and os.path.exists(path):
+        # 媒体存储中已经有同名文件，暂存的文件没有被移走
+        os.remove(path)
+
+
+def acquire_path(path, filename):
+    """
+    与acquire()相同，文件为本地的临时文件path（例如分块上传的会话文件）。
+    事务回滚时不会移动文件，临时文件保持原样
+
+    :return: MediaBlob
+    """
+    with open(path, 'rb') as local:
+        digest = file_digest(File(local))
+    blob, created = _create(digest, _blob_name(digest, filename), os.path.getsize(path))
+    if created:
+        transaction.on_commit(lambda: _store_path(path, filename, blob.id, blob.file.name))
+    return blob
+
+
+def _delete_file(name):
+    # 事务提交后删除文件；期间又有相同内容的文件创建了同名的blob时保留文件
+    if not MediaBlob.objects.filter(file=name).exists():
+        default_storage.delete(name)
+
+
+def release(blob_id):
+    """
+    引用计数减一，降为0时删除blob，并在事务提交后删除文件
+    """
+    MediaBlob.objects.filter(id=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    name = MediaBlob.objects.filter(id=blob_id, ref_count=0).values_list('file', flat=True).first()
+    if name is not None and MediaBlob.objects.filter(id=blob_id, ref_count=0).delete()[0]:
+        transaction.on_commit(lambda: _delete_file(name))
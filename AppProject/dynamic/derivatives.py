@@ -0,0 +1,192 @@
+"""
+媒体文件的衍生版本（缩略图、视频预览帧）生成。
+
+Media只保存原始文件，动态列表直接把全分辨率的图片发给手机。这里在动态发布（事务提交）之后，
+把生成任务提交到进程池，在请求之外生成若干宽度（settings.DERIVATIVE_WIDTHS）的JPEG缩略图，
+视频则先用ffmpeg截取一帧预览图再缩放。工作进程只读写文件、不访问数据库，结果由主进程写回Media.derivatives。
+
+任务可以重复执行：已经记录过的宽度会被跳过，衍生文件按(媒体ID, 类型, 宽度)确定文件名并覆盖写入。
+Media.derivative_state在全部完成后才改为done，进程崩溃时未完成的媒体保持pending，
+用generate_derivatives命令即可继续处理。
+
+工作进程中执行的部分见imaging.py。图片处理依赖Pillow，视频预览帧还依赖ffmpeg，二者都是可选的：缺少时对应的媒体标记为failed，
+安装后用generate_derivatives --retry-failed重新生成。
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connections
+
+from .imaging import render
+from . import post_cache
+from .models import Media
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def derivative_widths():
+    return sorted(getattr(settings, 'DERIVATIVE_WIDTHS', [160, 320, 640, 1280]))
+
+
+def _workers():
+    return getattr(settings, 'DERIVATIVE_WORKERS', 2)
+
+
+def _pool(workers):
+    # 工作进程以spawn方式启动，不会继承主进程的数据库连接
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _job(media):
+    """
+    媒体缺少的宽度；全部都有时返回None
+    """
+    done = {item['width'] for item in media.derivatives}
+    widths = [width for width in derivative_widths() if width not in done]
+    if not widths:
+        return None
+    try:
+        source_path = media.file_path.path
+    except NotImplementedError:
+        # 非本地存储需要先下载到本地，暂不支持
+        source_path = None
+    ffmpeg = shutil.which(getattr(settings, 'FFMPEG_BINARY', 'ffmpeg'))
+    return media.id, media.media_type, source_path, widths, ffmpeg
+
+
+def record(media_id, results, error):
+    """
+    在主进程中执行：把工作进程生成的文件存入媒体存储，并写回Media.derivatives和derivative_state
+    """
+    media = Media.objects.filter(id=media_id).only('id', 'post_id', 'derivatives').first()
+    if media is None:
+        # 媒体在生成期间被删除
+        for _, _, _, path in results:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        return
+    if error:
+        logger.warning('Failed to generate derivatives for media %s: %s', media_id, error)
+        Media.objects.filter(id=media_id).update(derivative_state=Media.DERIVATIVES_FAILED)
+        return
+
+    derivatives = {item['width']: item for item in media.derivatives}
+    for kind, width, height, path in results:
+        name = f'derivatives/{media_id}/{kind}_{width}.jpg'
+        # 重复执行时覆盖上一次（可能只写了一半）的文件，文件名保持不变
+        default_storage.delete(name)
+        with open(path, 'rb') as f:
+            name = default_storage.save(name, File(f))
+        derivatives[width] = {'kind': kind, 'width': width, 'height': height, 'file_path': name}
+    for _, _, _, path in results[:1]:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    updated = Media.objects.filter(id=media_id).update(
+        derivatives=[derivatives[width] for width in sorted(derivatives)],
+        derivative_state=Media.DERIVATIVES_DONE)
+    if not updated:
+        # 媒体在写入文件期间被删除，删除时的信号处理看不到这些文件
+        delete_files(item['file_path'] for item in derivatives.values())
+        return
+    # 详情中的缩略图发生了变化
+    post_cache.bump(media.post_id)
+
+
+def delete_files(names):
+    """
+    删除媒体的衍生文件，媒体被删除（包括随动态级联删除）的事务提交后由信号调用
+    """
+    for name in names:
+        default_storage.delete(name)
+
+
+def _mark_done(media_ids):
+    if media_ids:
+        Media.objects.filter(id__in=media_ids).update(derivative_state=Media.DERIVATIVES_DONE)
+
+
+def process(media_ids, workers=None):
+    """
+    生成一批媒体的衍生版本并等待完成，用于管理命令和不使用进程池的配置
+
+    :param workers: 进程数，为0或1时在当前进程中逐个生成
+    :return: (成功数, 失败数)
+    """
+    workers = _workers() if workers is None else workers
+    medias = Media.objects.filter(id__in=list(media_ids)).only('id', 'media_type', 'file_path', 'derivatives')
+    jobs, complete = [], []
+    for media in medias:
+        job = _job(media)
+        if job is None:
+            complete.append(media.id)
+        else:
+            jobs.append(job)
+    _mark_done(complete)
+
+    succeeded, failed = len(complete), 0
+
+    def collect(outcomes):
+        nonlocal succeeded, failed
+        for media_id, results, error in outcomes:
+            record(media_id, results, error)
+            if error:
+                failed += 1
+            else:
+                succeeded += 1
+
+    if workers <= 1:
+        collect(render(*job) for job in jobs)
+    else:
+        with _pool(workers) as pool:
+            collect(future.result() for future in as_completed([pool.submit(render, *job) for job in jobs]))
+    return succeeded, failed
+
+
+def _record_future(future):
+    # 在进程池的结果线程中执行，用完后关闭该线程的数据库连接
+    try:
+        record(*future.result())
+    except Exception:
+        logger.exception('Failed to record derivatives.')
+    finally:
+        connections.close_all()
+
+
+def schedule(media_ids):
+    """
+    动态发布（事务提交）后调用：把生成任务提交到后台进程池，立即返回。
+    settings.DERIVATIVE_WORKERS为0时在当前进程中同步生成（开发和测试环境）。
+    """
+    global _executor
+    if _workers() == 0:
+        process(media_ids, workers=0)
+        return
+    if _executor is None:
+        _executor = _pool(_workers())
+    medias = Media.objects.filter(id__in=list(media_ids)).only('id', 'media_type', 'file_path', 'derivatives')
+    for media in medias:
+        job = _job(media)
+        if job is None:
+            _mark_done([media.id])
+            continue
+        _executor.submit(render, *job).add_done_callback(_record_future)
+
+
+def pick_variant(media, width):
+    """
+    选出宽度不小于width的最小衍生版本；都比width小时用原文件（衍生版本不会比原图大）。
+    没有指定width或还没有衍生版本时也返回原文件。
+
+    :return: 文件路径
+    """
+    if width:
+        for item in media.derivatives:
+            if item['width'] >= width:
+                return item['file_path']
+    return media.file_path.name
@@ -0,0 +1,77 @@
+"""
+衍生版本生成中在工作进程里执行的部分：缩放图片、截取视频帧。
+
+这个模块只依赖标准库和Pillow，不导入Django的模型和配置，进程池以spawn方式启动工作进程时可以直接导入，
+工作进程也不会继承主进程的数据库连接。
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow是可选依赖，未安装时不生成衍生版本
+    Image = None
+
+JPEG_QUALITY = 80
+
+
+def _resize_all(image, widths, kind, output_dir):
+    """
+    从大到小依次缩放（每次在上一个结果上缩小，比每次都从原图缩放快），不放大原图
+    """
+    image = image.convert('RGB')
+    results = []
+    for width in sorted(widths, reverse=True):
+        if width >= image.width:
+            continue
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.LANCZOS)
+        path = os.path.join(output_dir, f'{kind}_{width}.jpg')
+        image.save(path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+        results.append((kind, width, height, path))
+    return results
+
+
+def _extract_frame(ffmpeg, source_path, output_dir):
+    if ffmpeg is None:
+        raise RuntimeError('ffmpeg is not available.')
+    frame = os.path.join(output_dir, 'frame.jpg')
+    # 取第1秒的一帧，片长不足1秒时取不到帧，再退回第一帧
+    for seek in ('1', '0'):
+        subprocess.run([ffmpeg, '-v', 'error', '-y', '-ss', seek, '-i', source_path, '-frames:v', '1', frame],
+                       check=True, stdin=subprocess.DEVNULL, timeout=120)
+        if os.path.exists(frame):
+            return frame
+    raise RuntimeError('No frame could be extracted.')
+
+
+def render(media_id, media_type, source_path, widths, ffmpeg=None):
+    """
+    生成一个媒体文件缺少的衍生版本，写入一个新的临时目录
+
+    :param widths: 需要生成的宽度
+    :param ffmpeg: ffmpeg可执行文件的路径，视频需要
+    :return: (media_id, [(kind, width, height, 临时文件路径), ...], 错误信息或None)
+    """
+    output_dir = tempfile.mkdtemp(prefix=f'derivatives-{media_id}-')
+    try:
+        if Image is None:
+            raise RuntimeError('Pillow is not installed.')
+        if source_path is None:
+            raise RuntimeError('Media storage is not on the local filesystem.')
+        if media_type == 'video':
+            source_path, kind = _extract_frame(ffmpeg, source_path, output_dir), 'preview'
+        else:
+            kind = 'thumbnail'
+        with Image.open(source_path) as image:
+            # JPEG可以在解码时直接缩小，大图生成小缩略图时省去大部分解码工作
+            image.draft('RGB', (max(widths), max(widths)))
+            results = _resize_all(image, widths, kind, output_dir)
+    except Exception as e:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return media_id, [], f'{type(e).__name__}: {e}'
+    if not results:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return media_id, results, None
@@ -0,0 +1,122 @@
+"""
+评论楼读取性能基准：在一条有大量多层嵌套评论的动态上，比较按物化路径读取与按邻接表逐层展开的查询次数和耗时。
+
+用法：python manage.py bench_comment_thread --comments 50000 --depth 10
+评论的ID和路径在写入前预先算好，一次bulk_create完成；所有测试数据在一个事务中写入，结束后回滚。
+"""
+import json
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from dynamic.models import Comment, Post, COMMENT_PATH_SEGMENT_LENGTH
+from dynamic.pagination import encode_cursor
+from dynamic.views import comment_subtree, comment_thread
+
+
+class Command(BaseCommand):
+    help = 'Benchmark comment thread reads on a post with many nested comments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--depth', type=int, default=10)
+        parser.add_argument('--roots', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.factory = RequestFactory()
+        self.repeat = options['repeat']
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(
+                username='bench_comment_thread', email='bench_comment_thread@example.com', password='bench')
+            post = Post.objects.create(user=user, content='bench thread')
+            start = time.perf_counter()
+            roots = self._seed(post, user, options['comments'], options['depth'], options['roots'],
+                               options['batch_size'])
+            self.stdout.write(f'seeded {options["comments"]} comments in {time.perf_counter() - start:.1f}s')
+
+            # 构造"已经翻到中间一条根评论"时客户端持有的游标
+            cursor = encode_cursor([Comment.objects.get(id=roots[len(roots) // 2]).path])
+            largest = Comment.objects.get(id=roots[0])
+
+            self.stdout.write(f'{"operation":<40} {"queries":>8} {"median (ms)":>12}')
+            self._report('thread, first page (20 roots, 3 replies)',
+                         lambda: comment_thread(self._get({'limit': 20, 'replies': 3}), post.id))
+            self._report('thread, middle page',
+                         lambda: comment_thread(self._get({'limit': 20, 'replies': 3, 'cursor': cursor}), post.id))
+            self._report('whole subtree via path (all pages)', lambda: self._read_subtree(largest))
+            self._report('whole subtree via adjacency list', lambda: self._walk_levels(largest))
+            transaction.set_rollback(True)
+
+    def _seed(self, post, user, total, depth, root_count, batch_size):
+        """
+        每条根评论下先挂一条深度为depth的回复链，其余回复随机挂在该子树中深度未满的评论下
+        """
+        rng = random.Random(0)
+        next_id = (Comment.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+        per_root = max(total // root_count, depth)
+        width = COMMENT_PATH_SEGMENT_LENGTH - 1
+        comments, roots = [], []
+
+        def add(parent):
+            nonlocal next_id
+            path = f'{parent.path if parent else ""}{next_id:0{width}d}/'
+            comment = Comment(id=next_id, post=post, user=user, content=f'bench comment {next_id}',
+                              parent=parent, path=path, depth=parent.depth + 1 if parent else 0)
+            comments.append(comment)
+            next_id += 1
+            return comment
+
+        while len(comments) < total:
+            root = add(None)
+            roots.append(root.id)
+            subtree, node = [root], root
+            for _ in range(depth - 1):
+                node = add(node)
+                subtree.append(node)
+            for _ in range(min(per_root - depth, total - len(comments))):
+                parent = rng.choice([c for c in subtree[-50:] if c.depth < depth - 1] or [root])
+                subtree.append(add(parent))
+        Comment.objects.bulk_create(comments[:total], batch_size=batch_size)
+        return roots
+
+    def _get(self, params):
+        return self.factory.get('/dynamic/comment_thread/', params)
+
+    def _read_subtree(self, root):
+        cursor, count = '', 0
+        while cursor is not None:
+            request = self.factory.get('/dynamic/comment_subtree/', {'limit': 200, 'cursor': cursor})
+            response = comment_subtree(request, root.id)
+            assert response.status_code == 200
+            cursor = json.loads(response.content)['next_cursor']
+            count += 1
+        return count
+
+    def _walk_levels(self, root):
+        """
+        改造前的做法：沿parent邻接表逐层查询回复
+        """
+        level, nodes = [root.id], []
+        while level:
+            children = list(Comment.objects.filter(parent_id__in=level).select_related('user'))
+            nodes.extend(children)
+            level = [child.id for child in children]
+        return len(nodes)
+
+    def _report(self, label, func):
+        timings = []
+        for _ in range(self.repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                func()
+                timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(f'{label:<40} {len(queries):>8} {statistics.median(timings):>12.2f}')
@@ -0,0 +1,96 @@
+"""
+条件请求基准：模拟客户端轮询动态列表、收件箱和关注列表，比较带与不带If-None-Match时的响应字节数和数据库耗时。
+
+用法：python manage.py bench_conditional_get --polls 500 --write-every 50
+每隔write_every次轮询发生一次写入（新动态、新私信、新关注），客户端随后会收到一次200并更新ETag。
+所有测试数据在一个事务中写入，结束后回滚。
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from authAPP.views import get_followers
+from dynamic import post_cache
+from dynamic.models import Post
+from dynamic.views import list_content
+from message import conversations
+from message.models import Message
+from message.views import receive_messages
+
+
+class Command(BaseCommand):
+    help = 'Benchmark polling endpoints with and without If-None-Match.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--polls', type=int, default=500)
+        parser.add_argument('--write-every', type=int, default=50)
+
+    def handle(self, *args, **options):
+        self.factory = RequestFactory()
+        User = get_user_model()
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f'bench_cond_{i}', email=f'bench_cond_{i}@example.com')
+                for i in range(options['users'])])
+            target = users[0]
+            Post.objects.bulk_create([Post(user=users[i % len(users)], content=f'bench post {i}')
+                                      for i in range(options['posts'])])
+            conversation_ids = conversations.conversation_ids((user.id, target.id) for user in users[1:])
+            Message.objects.bulk_create([
+                Message(sender=user, receiver=target, content='hello',
+                        conversation_id=conversation_ids[conversations.pair_key(user.id, target.id)])
+                for user in users[1:]])
+            target.followers.add(*users[1:len(users) // 2])
+            # 两轮测试依次使用不同的新粉丝，保证每次写入都真正改变了列表
+            new_followers = iter(users[len(users) // 2:])
+
+            def write_post(i):
+                Post.objects.create(user=target, content=f'bench new post {i}')
+                # 基准在回滚的事务中运行，on_commit回调不会执行，直接增加版本号
+                post_cache._bump([])
+
+            endpoints = [
+                ('list_content', lambda: list_content(self._get('/dynamic/list_content/')), write_post),
+                ('receive_messages', lambda: receive_messages(self._get('/message/receive/'), target.id),
+                 lambda i: Message.objects.create(sender=users[1], receiver=target, content=f'new {i}')),
+                ('get_followers', lambda: get_followers(self._get('/auth/followers/'), target.id),
+                 lambda i: target.followers.add(next(new_followers))),
+            ]
+            self.stdout.write(f'{"endpoint":<18} {"mode":<14} {"200s":>6} {"304s":>6} '
+                              f'{"bytes":>12} {"db time (ms)":>13} {"wall (ms)":>10}')
+            for name, call, write in endpoints:
+                for conditional in (False, True):
+                    cache.delete(post_cache._version_key(post_cache.FEED))
+                    self._run(name, call, write, conditional, options['polls'], options['write_every'])
+            transaction.set_rollback(True)
+
+    def _get(self, path):
+        request = self.factory.get(path)
+        request.META.update(self.headers)
+        return request
+
+    def _run(self, name, call, write, conditional, polls, write_every):
+        etag, statuses, body_bytes, db_time = None, {200: 0, 304: 0}, 0, 0.0
+        start = time.perf_counter()
+        for i in range(polls):
+            if write_every and i and i % write_every == 0:
+                write(i)
+            self.headers = {'HTTP_IF_NONE_MATCH': etag} if conditional and etag else {}
+            with CaptureQueriesContext(connection) as queries:
+                response = call()
+            # SQLite后端记录的耗时只精确到毫秒
+            db_time += sum(float(query['time']) for query in queries.captured_queries)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            body_bytes += len(response.content)
+            etag = response.get('ETag', etag)
+        wall = (time.perf_counter() - start) * 1000
+        mode = 'If-None-Match' if conditional else 'unconditional'
+        self.stdout.write(f'{name:<18} {mode:<14} {statuses[200]:>6} {statuses[304]:>6} '
+                          f'{body_bytes:>12} {db_time * 1000:>13.1f} {wall:>10.1f}')
@@ -0,0 +1,69 @@
+"""
+动态列表分页性能基准：比较Paginator页码分页与(created_at, id)游标分页在不同数据量下的耗时。
+
+用法：python manage.py bench_list_content --sizes 10000 100000 1000000
+所有测试数据都在一个事务中写入，结束后回滚，不会污染数据库。
+"""
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from dynamic.models import Post
+from dynamic.pagination import encode_cursor
+from dynamic.views import list_content
+
+PAGE_SIZE = 10
+
+
+class Command(BaseCommand):
+    help = 'Benchmark list_content page-number pagination against cursor pagination.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.factory = RequestFactory()
+        self.repeat = options['repeat']
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(
+                username='bench_list_content', email='bench_list_content@example.com', password='bench')
+            seeded = Post.objects.count()
+            self.stdout.write(f'{"posts":>10} {"depth":>10} {"page (ms)":>12} {"cursor (ms)":>12}')
+            for size in sorted(options['sizes']):
+                seeded = self._seed(user, seeded, size, options['batch_size'])
+                for depth in (0, size // 2, size - PAGE_SIZE):
+                    page_ms = self._time({'page': depth // PAGE_SIZE + 1})
+                    cursor_ms = self._time({'cursor': self._cursor_at(depth)})
+                    self.stdout.write(f'{size:>10} {depth:>10} {page_ms:>12.2f} {cursor_ms:>12.2f}')
+            transaction.set_rollback(True)
+
+    def _seed(self, user, seeded, size, batch_size):
+        while seeded < size:
+            count = min(batch_size, size - seeded)
+            Post.objects.bulk_create(
+                [Post(user=user, content=f'bench post {seeded + i}') for i in range(count)])
+            seeded += count
+        return seeded
+
+    def _cursor_at(self, depth):
+        # 构造"已经翻到depth条"时客户端持有的游标，这一步不计入耗时
+        if depth == 0:
+            return ''
+        last = Post.objects.order_by('-created_at', '-id').values_list('created_at', 'id')[depth - 1]
+        return encode_cursor(list(last))
+
+    def _time(self, params):
+        timings = []
+        for _ in range(self.repeat):
+            request = self.factory.get('/dynamic/list_content/', params)
+            start = time.perf_counter()
+            response = list_content(request)
+            timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200
+        return statistics.median(timings)
@@ -0,0 +1,83 @@
+"""
+推荐性能基准：在合成数据上测量离线计算的耗时和推荐接口的P99延迟。
+
+用法：python manage.py bench_recommendations --users 20000 --posts 50000 --likes 500000
+动态的热度服从Zipf分布，每个用户的兴趣集中在几个作者上。所有测试数据在一个事务中写入，结束后回滚。
+"""
+import statistics
+import time
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from dynamic import recommendations
+from dynamic.models import Comment, Post, PostLike
+from dynamic.views import recommend
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the offline recommendation build and the recommend endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--likes', type=int, default=200000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--follows', type=int, default=50000)
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        User = get_user_model()
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            start = time.perf_counter()
+            User.objects.bulk_create([User(username=f'bench_rec_{i}', email=f'bench_rec_{i}@example.com')
+                                      for i in range(options['users'])], batch_size=batch_size)
+            user_ids = np.array(User.objects.filter(username__startswith='bench_rec_').order_by('id')
+                                .values_list('id', flat=True))
+            authors = rng.choice(user_ids, size=options['posts'])
+            Post.objects.bulk_create([Post(user_id=int(author), content='bench') for author in authors],
+                                     batch_size=batch_size)
+            post_ids = np.array(Post.objects.filter(user_id__in=user_ids.tolist()).order_by('id')
+                                .values_list('id', flat=True))
+
+            def pairs(count):
+                users = rng.choice(user_ids, size=count)
+                posts = post_ids[np.minimum(rng.zipf(1.3, size=count) - 1, len(post_ids) - 1)]
+                return np.unique(np.stack([users, rng.permutation(posts)], axis=1), axis=0)
+
+            PostLike.objects.bulk_create([PostLike(user_id=int(u), post_id=int(p)) for u, p in pairs(options['likes'])],
+                                         batch_size=batch_size, ignore_conflicts=True)
+            Comment.objects.bulk_create([Comment(user_id=int(u), post_id=int(p), content='bench')
+                                         for u, p in pairs(options['comments'])], batch_size=batch_size)
+            through = User.followers.through
+            edges = np.unique(rng.choice(user_ids, size=(options['follows'], 2)), axis=0)
+            through.objects.bulk_create([through(from_customuser_id=int(a), to_customuser_id=int(b))
+                                         for a, b in edges if a != b], batch_size=batch_size, ignore_conflicts=True)
+            self.stdout.write(f'seeded in {time.perf_counter() - start:.1f}s')
+
+            start = time.perf_counter()
+            stats = recommendations.build()
+            self.stdout.write(
+                f'build: {stats["users"]} users x {stats["posts"]} posts, {stats["interactions"]} interactions, '
+                f'{stats["neighbors"]} neighbors in {time.perf_counter() - start:.1f}s '
+                f'(load {stats["load_seconds"]:.1f}s, similarity {stats["similarity_seconds"]:.1f}s, '
+                f'write {stats["write_seconds"]:.1f}s)')
+
+            factory = RequestFactory()
+            timings = []
+            for user_id in rng.choice(user_ids, size=options['requests']):
+                request = factory.get(f'/dynamic/recommend/{user_id}/')
+                start = time.perf_counter()
+                response = recommend(request, int(user_id))
+                timings.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200
+            timings.sort()
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            self.stdout.write(f'recommend: median {statistics.median(timings):.2f} ms, p99 {p99:.2f} ms')
+            transaction.set_rollback(True)
@@ -0,0 +1,90 @@
+"""
+动态搜索性能基准：在大量动态上比较倒排索引搜索与content__icontains全表扫描的耗时。
+
+用法：python manage.py bench_search --posts 1000000 --queries 200
+动态内容由中英文常见词按Zipf分布随机组合，再加上一个从大量标签中随机选取的罕见词。
+查询一半为常见词组合（倒排表很长，受SEARCH_POSTINGS_LIMIT限制），一半为罕见标签。
+报告重建索引的耗时、不命中结果缓存时第一页和随后翻页的耗时中位数和P99；icontains只测少量罕见标签作为对照。所有测试数据在一个事务中写入，结束后回滚。
+"""
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from dynamic import search
+from dynamic.models import Post, SearchPosting
+from dynamic.views import search_posts
+
+CJK_WORDS = ['故宫', '门票', '颐和园', '长城', '排队', '讲解', '导游', '天气', '下雨', '拍照', '游客', '停车场',
+             '地铁', '餐厅', '小吃', '博物馆', '展览', '文物', '开放时间', '预约', '夜景', '樱花', '红叶', '雪景']
+LATIN_WORDS = ['museum', 'ticket', 'palace', 'garden', 'queue', 'guide', 'photo', 'night', 'summer', 'winter',
+               'coffee', 'metro', 'bike', 'family', 'weekend', 'sunset', 'lake', 'temple', 'bridge', 'market']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark post full-text search against an icontains scan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--scan-queries', type=int, default=5)
+        parser.add_argument('--tags', type=int, default=50000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        vocabulary = CJK_WORDS + LATIN_WORDS
+        weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+        rng.shuffle(weights)
+        factory = RequestFactory()
+
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(
+                username='bench_search', email='bench_search@example.com', password='bench')
+            start = time.perf_counter()
+            for offset in range(0, options['posts'], options['batch_size']):
+                count = min(options['batch_size'], options['posts'] - offset)
+                Post.objects.bulk_create([
+                    Post(user=user, content=' '.join(rng.choices(vocabulary, weights, k=rng.randint(3, 15)))
+                         + f' 标签tag{rng.randrange(options["tags"])}')
+                    for _ in range(count)])
+            self.stdout.write(f'seeded {options["posts"]} posts in {time.perf_counter() - start:.1f}s')
+
+            start = time.perf_counter()
+            search.rebuild(options['batch_size'])
+            self.stdout.write(f'built index ({SearchPosting.objects.count()} postings) '
+                              f'in {time.perf_counter() - start:.1f}s')
+
+            common = [' '.join(rng.sample(vocabulary, rng.randint(1, 3))) for _ in range(options['queries'] // 2)]
+            rare = [f'tag{rng.randrange(options["tags"])}' for _ in range(options['queries'] - len(common))]
+            for label, queries in (('common words', common), ('rare tag', rare)):
+                first, second = [], []
+                for query in queries:
+                    # 清空缓存，第一页测量的是实际打分的耗时，第二页从缓存的排序结果中切片
+                    cache.clear()
+                    for page, timings in ((1, first), (2, second)):
+                        request = factory.get('/dynamic/search/', {'q': query, 'page': page})
+                        start = time.perf_counter()
+                        response = search_posts(request)
+                        timings.append((time.perf_counter() - start) * 1000)
+                        assert response.status_code == 200
+                self._report(f'{label}, first page', first)
+                self._report(f'{label}, next page', second)
+
+            timings = []
+            for query in rare[:options['scan_queries']]:
+                start = time.perf_counter()
+                list(Post.objects.filter(content__icontains=query).order_by('-created_at')[:10])
+                timings.append((time.perf_counter() - start) * 1000)
+            self._report('rare tag, icontains scan', timings)
+            transaction.set_rollback(True)
+
+    def _report(self, label, timings):
+        timings = sorted(timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(f'{label:<28} median {statistics.median(timings):>8.2f} ms   p99 {p99:>8.2f} ms')
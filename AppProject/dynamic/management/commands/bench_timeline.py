@@ -0,0 +1,75 @@
+"""
+首页时间线性能基准：比较纯推模式与推拉结合模式在不同粉丝数分布下的发布耗时和读取耗时。
+
+用法：python manage.py bench_timeline --followers 100 1000 10000 50000 --threshold 1000
+读取者关注了所有测试作者。所有测试数据都在一个事务中写入，结束后回滚，不会污染数据库。
+"""
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from dynamic import timeline
+from dynamic.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Benchmark home timeline publish and read latency for push-only and hybrid fan-out.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', nargs='+', type=int, default=[100, 1000, 10000, 50000])
+        parser.add_argument('--threshold', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        through = User.followers.through
+        follower_counts = sorted(options['followers'])
+        repeat = options['repeat']
+
+        with transaction.atomic():
+            pool = User.objects.bulk_create(
+                [User(username=f'bench_fan_{i}', email=f'bench_fan_{i}@example.com', password='!')
+                 for i in range(follower_counts[-1])], batch_size=5000)
+            reader = pool[0]
+            authors = []
+            for count in follower_counts:
+                # 直接写入中间表不会触发信号，冗余的粉丝数在这里一并写入
+                author = User.objects.create(username=f'bench_author_{count}',
+                                             email=f'bench_author_{count}@example.com', password='!',
+                                             follower_count=count)
+                through.objects.bulk_create(
+                    [through(from_customuser_id=author.id, to_customuser_id=fan.id) for fan in pool[:count]],
+                    batch_size=5000)
+                authors.append((author, count))
+
+            self.stdout.write(f'{"mode":>8} {"followers":>10} {"publish (ms)":>14}')
+            read_results = []
+            for mode, threshold in (('push', follower_counts[-1] + 1), ('hybrid', options['threshold'])):
+                with override_settings(TIMELINE_PULL_FOLLOWER_THRESHOLD=threshold):
+                    for author, _ in authors:
+                        timeline.refresh_pull_author(author.id)
+                    for author, count in authors:
+                        timings = []
+                        for i in range(repeat):
+                            start = time.perf_counter()
+                            post = Post.objects.create(user=author, content=f'{mode} post {i}')
+                            timeline.fan_out_post(post)
+                            timings.append((time.perf_counter() - start) * 1000)
+                        self.stdout.write(f'{mode:>8} {count:>10} {statistics.median(timings):>14.2f}')
+
+                    timings = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        timeline.read_home_timeline(reader.id, None, 10)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    pulled = sum(1 for author, _ in authors if timeline.is_pull_author(author.id))
+                    read_results.append((mode, pulled, statistics.median(timings)))
+
+            self.stdout.write(f'\n{"mode":>8} {"pulled authors":>15} {"read (ms)":>10}')
+            for mode, pulled, read_ms in read_results:
+                self.stdout.write(f'{mode:>8} {pulled:>15} {read_ms:>10.2f}')
+            transaction.set_rollback(True)
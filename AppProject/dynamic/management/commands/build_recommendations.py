@@ -0,0 +1,26 @@
+"""
+离线计算动态之间的相似度（见dynamic/recommendations.py），替换PostNeighbor表。建议每晚执行一次。
+
+用法：python manage.py build_recommendations --top-k 50 --window-days 90 --block-size 1000
+--block-size为每次相乘的动态数，越大越快，占用的内存也越多。
+"""
+from django.core.management.base import BaseCommand
+
+from dynamic import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Recompute item-item similarities used by the recommend endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int)
+        parser.add_argument('--window-days', type=int)
+        parser.add_argument('--block-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        stats = recommendations.build(options['top_k'], options['window_days'], options['block_size'])
+        self.stdout.write(
+            f'{stats["users"]} users x {stats["posts"]} posts, {stats["interactions"]} interactions: '
+            f'load {stats["load_seconds"]:.1f}s, similarity {stats["similarity_seconds"]:.1f}s, '
+            f'write {stats["write_seconds"]:.1f}s')
+        self.stdout.write(self.style.SUCCESS(f'Stored {stats["neighbors"]} neighbors.'))
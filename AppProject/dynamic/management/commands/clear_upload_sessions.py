@@ -0,0 +1,32 @@
+"""
+清理过期的分块上传会话：删除长时间没有新分块且未挂到动态上的会话及其临时文件，以及已经完成的会话记录；
+同时删除发布失败、事务回滚后留下的暂存媒体文件（见blobs.py）。
+
+用法：python manage.py clear_upload_sessions --hours 24
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from dynamic import blobs, uploads
+from dynamic.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Delete upload sessions that have not received data for a while.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(hours=options['hours'])
+        stale = UploadSession.objects.filter(updated_at__lt=before)
+        count = 0
+        for session in stale.iterator():
+            uploads.discard(session)
+            session.delete()
+            count += 1
+        self.stdout.write(f'Deleted {count} upload sessions.')
+        staged = blobs.clear_staged(before.timestamp())
+        self.stdout.write(f'Deleted {staged} staged files.')
@@ -0,0 +1,52 @@
+"""
+把去重存储上线之前上传的媒体文件迁移到MediaBlob：逐个计算文件摘要，已有相同内容的blob时引用它并删除重复的文件，
+否则直接把现有文件登记为新的blob（不复制文件）。按ID顺序处理，中断后重新执行会跳过已经迁移的媒体。
+
+用法：python manage.py dedupe_media [--dry-run]
+"""
+import hashlib
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from dynamic.blobs import HASH_CHUNK_SIZE
+from dynamic.models import Media, MediaBlob
+
+
+class Command(BaseCommand):
+    help = 'Move media uploaded before content-addressed storage onto deduplicated blobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        migrated = duplicates = missing = saved = 0
+        for media in Media.objects.filter(blob__isnull=True).order_by('id').iterator():
+            name = media.file_path.name
+            if not name or not default_storage.exists(name):
+                missing += 1
+                continue
+            hasher = hashlib.sha256()
+            with default_storage.open(name, 'rb') as f:
+                for chunk in f.chunks(HASH_CHUNK_SIZE):
+                    hasher.update(chunk)
+            digest, size = hasher.hexdigest(), default_storage.size(name)
+            if options['dry_run']:
+                continue
+
+            with transaction.atomic():
+                blob = MediaBlob.objects.select_for_update().filter(digest=digest).first()
+                if blob is None:
+                    blob = MediaBlob.objects.create(digest=digest, file=name, size=size, ref_count=1)
+                else:
+                    MediaBlob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + 1)
+                Media.objects.filter(id=media.id).update(blob=blob, file_path=blob.file.name)
+                if blob.file.name != name:
+                    duplicates += 1
+                    saved += size
+                    transaction.on_commit(lambda name=name: default_storage.delete(name))
+            migrated += 1
+        self.stdout.write(f'Migrated {migrated} media ({duplicates} duplicates, {saved} bytes freed), '
+                          f'{missing} missing files.')
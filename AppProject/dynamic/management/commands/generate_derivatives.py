@@ -0,0 +1,39 @@
+"""
+生成媒体文件的衍生版本（缩略图、视频预览帧）。
+
+处理derivative_state为pending的媒体：进程崩溃或重启后用它继续处理未完成的任务，也用于给历史媒体补生成缩略图。
+任务是幂等的，重复执行只会补齐缺少的宽度。
+
+用法：python manage.py generate_derivatives --workers 4 [--retry-failed]
+"""
+from django.core.management.base import BaseCommand
+
+from dynamic import derivatives
+from dynamic.models import Media
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnails and preview frames for media that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--retry-failed', action='store_true')
+
+    def handle(self, *args, **options):
+        states = [Media.DERIVATIVES_PENDING]
+        if options['retry_failed']:
+            states.append(Media.DERIVATIVES_FAILED)
+        pending = Media.objects.filter(derivative_state__in=states).order_by('id')
+
+        # 按ID分批，每批处理完成后状态已写回，中断后重新执行会从剩余的媒体继续
+        last_id, total_succeeded, total_failed = 0, 0, 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id).values_list('id', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            succeeded, failed = derivatives.process(batch, workers=options['workers'])
+            total_succeeded += succeeded
+            total_failed += failed
+            last_id = batch[-1]
+        self.stdout.write(f'Generated derivatives for {total_succeeded} media, {total_failed} failed.')
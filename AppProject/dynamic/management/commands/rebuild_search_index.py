@@ -0,0 +1,31 @@
+"""
+清空并重建动态的全文索引（见dynamic/search.py）。
+
+首次上线、调整分词规则之后或索引与动态不一致时使用。整个重建在一个事务中完成，
+提交之前搜索继续使用旧的索引。
+
+用法：python manage.py rebuild_search_index --batch-size 1000
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dynamic import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        def progress(indexed):
+            self.stdout.write(f'indexed {indexed} posts ({time.perf_counter() - start:.1f}s)')
+
+        with transaction.atomic():
+            indexed = search.rebuild(options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} posts in {time.perf_counter() - start:.1f}s.'))
@@ -0,0 +1,22 @@
+"""
+裁剪超出长度上限的首页时间线。推送动态时不逐个裁剪粉丝的时间线，读取首页时才裁剪，
+从不读取首页的用户的时间线由这个命令定期（例如每小时）裁剪到settings.TIMELINE_MAX_LENGTH条。
+
+按用户ID分块，每块用一条分组计数找出超出上限的时间线。
+
+用法：python manage.py trim_timelines --chunk-size 1000
+"""
+from django.core.management.base import BaseCommand
+
+from dynamic.timeline import get_timeline_backend
+
+
+class Command(BaseCommand):
+    help = 'Trim home timelines that exceed TIMELINE_MAX_LENGTH.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        trimmed = get_timeline_backend().trim_all(options['chunk_size'])
+        self.stdout.write(f'Trimmed {trimmed} timelines.')
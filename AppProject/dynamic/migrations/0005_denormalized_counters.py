@@ -0,0 +1,67 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:47
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(model, field):
+    counts = (
+        model.objects.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model("dynamic", "Post")
+    Comment = apps.get_model("dynamic", "Comment")
+    PostLike = apps.get_model("dynamic", "PostLike")
+    CommentLike = apps.get_model("dynamic", "CommentLike")
+    Post.objects.update(
+        like_count=_count(PostLike, "post"), comment_count=_count(Comment, "post")
+    )
+    Comment.objects.update(like_count=_count(CommentLike, "comment"))
+    # MySQL不允许UPDATE的子查询引用被更新的表本身，回复数逐个父评论写入
+    replies = (
+        Comment.objects.filter(parent__isnull=False)
+        .order_by()
+        .values("parent")
+        .annotate(count=Count("*"))
+    )
+    for row in replies.iterator():
+        Comment.objects.filter(pk=row["parent"]).update(reply_count=row["count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dynamic", "0004_timeline_pull_authors"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="reply_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="comment_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
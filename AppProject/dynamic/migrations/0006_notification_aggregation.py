@@ -0,0 +1,71 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:49
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_unread_notifications(apps, schema_editor):
+    """
+    添加唯一约束之前，把已有的重复未读通知合并为一条，保留最新的一条
+    """
+    Notification = apps.get_model("dynamic", "Notification")
+    key = ("to_user", "type", "content_type", "object_id")
+    groups = (
+        Notification.objects.filter(is_read=False, object_id__isnull=False)
+        .order_by()
+        .values(*key)
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+    )
+    for group in groups.iterator():
+        rows = list(
+            Notification.objects.filter(is_read=False, **{k: group[k] for k in key})
+            .order_by("-created_at", "-id")
+            .values_list("id", "from_user_id", "created_at")
+        )
+        latest_id, _, latest_at = rows[0]
+        recent_actors = "".join(f"{actor_id}," for _, actor_id, _ in rows if actor_id)
+        Notification.objects.filter(id=latest_id).update(
+            actor_count=len(rows),
+            recent_actors=recent_actors[:128],
+            updated_at=latest_at,
+        )
+        Notification.objects.filter(id__in=[row[0] for row in rows[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("dynamic", "0005_denormalized_counters"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="actor_count",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="recent_actors",
+            field=models.CharField(blank=True, default="", max_length=128),
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="updated_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(merge_unread_notifications, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="notification",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_read", False)),
+                fields=("to_user", "type", "content_type", "object_id"),
+                name="unique_unread_notification",
+            ),
+        ),
+    ]
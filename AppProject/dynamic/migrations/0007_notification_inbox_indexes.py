@@ -0,0 +1,29 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("dynamic", "0006_notification_aggregation"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["to_user", "updated_at", "id"], name="notification_inbox_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["to_user", "is_read", "updated_at", "id"],
+                name="notification_unread_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    # 按层写入：先写根评论，再根据上一层已写好的路径写入下一层，每次处理一批
+    Comment = apps.get_model("dynamic", "Comment")
+    level, depth = Comment.objects.filter(parent__isnull=True), 0
+    while True:
+        rows = list(level.filter(path="").values_list("id", "parent__path")[:1000])
+        if rows:
+            Comment.objects.bulk_update(
+                [Comment(id=pk, path=f"{parent_path or ''}{pk:010d}/", depth=depth) for pk, parent_path in rows],
+                ["path", "depth"],
+            )
+        elif level.exists():
+            depth += 1
+            level = Comment.objects.filter(parent__depth=depth - 1).exclude(parent__path="")
+        else:
+            break
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dynamic", "0007_notification_inbox_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="depth",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="path",
+            field=models.CharField(default="", max_length=220),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(fields=["post", "path"], name="comment_post_path_idx"),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
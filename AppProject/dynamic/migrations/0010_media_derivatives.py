@@ -0,0 +1,32 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dynamic", "0009_upload_session"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="media",
+            name="derivative_state",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("done", "Done"),
+                    ("failed", "Failed"),
+                ],
+                db_index=True,
+                default="pending",
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="media",
+            name="derivatives",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.3 on 2026-10-18 16:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dynamic", "0012_post_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PostNeighbor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("score", models.FloatField()),
+                (
+                    "neighbor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="dynamic.post",
+                    ),
+                ),
+                (
+                    "post",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="dynamic.post",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["post", "score"], name="post_neighbor_idx")
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="postneighbor",
+            constraint=models.UniqueConstraint(
+                fields=("post", "neighbor"), name="unique_post_neighbor"
+            ),
+        ),
+    ]
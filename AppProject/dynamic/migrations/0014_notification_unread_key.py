@@ -0,0 +1,69 @@
+# Generated by Django 5.0.3 on 2026-10-18 17:26
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import CharField, Count, Max, Value
+from django.db.models.functions import Cast, Concat
+
+
+def assign_unread_keys(apps, schema_editor):
+    """
+    为未读通知设置合并键。MySQL上原来的部分唯一约束没有生效，可能已有重复的未读通知：
+    每组只有最新的一条得到合并键，之后的通知合并到这一条，其余的保留为独立的未读通知
+    """
+    Notification = apps.get_model("dynamic", "Notification")
+    key = ("to_user", "type", "content_type", "object_id")
+    unread = Notification.objects.filter(
+        is_read=False, content_type__isnull=False, object_id__isnull=False
+    )
+    duplicates = (
+        unread.order_by()
+        .values(*key)
+        .annotate(count=Count("id"), latest=Max("id"))
+        .filter(count__gt=1)
+    )
+    older = set()
+    for group in duplicates.iterator():
+        older.update(
+            unread.filter(**{k: group[k] for k in key})
+            .exclude(id=group["latest"])
+            .values_list("id", flat=True)
+        )
+    unread.exclude(id__in=older).update(
+        unread_key=Concat(
+            "type",
+            Value(":"),
+            Cast("content_type_id", CharField()),
+            Value(":"),
+            Cast("object_id", CharField()),
+            output_field=CharField(),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("dynamic", "0013_post_neighbors"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="notification",
+            name="unique_unread_notification",
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="unread_key",
+            field=models.CharField(blank=True, default=None, max_length=64, null=True),
+        ),
+        migrations.RunPython(assign_unread_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="notification",
+            constraint=models.UniqueConstraint(
+                fields=("to_user", "unread_key"), name="unique_unread_notification_key"
+            ),
+        ),
+    ]
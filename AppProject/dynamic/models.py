@@ -4,10 +4,22 @@ from django.db import models
 包含应用程序的数据模型定义，定义了用户模型和其他相关模型。
 """
 # Create your models here.
+import uuid
+
 from django.conf import settings
 from django.db import models
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+# 合并通知中保存的最近发起者ID字符串的最大长度，以及对外展示的最近发起者个数
+RECENT_ACTORS_MAX_LENGTH = 128
+RECENT_ACTORS_SHOWN = 5
+
+# 评论物化路径中每一级ID的固定宽度（补零后按字符串排序即按ID排序）以及允许的最大嵌套层数，
+# 路径总长度为 COMMENT_PATH_SEGMENT_LENGTH * COMMENT_MAX_DEPTH，不超过path字段的长度
+COMMENT_PATH_SEGMENT_LENGTH = 11
+COMMENT_MAX_DEPTH = 20
 """
 首先，我们定义一个Post模型，它将包含动态的基本信息，如文本内容、发布时间和关联的用户。
 为了支持未来可能的多媒体内容，我们可以创建一个Media模型，用于存储媒体文件的相关信息，如文件类型、文件路径等。
@@ -26,16 +38,54 @@ class Post(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='posts')
     content = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # 冗余计数，在点赞、取消点赞、发表评论的同一事务中用F()表达式原子更新，偏差可用reconcile_counters命令修正
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # 动态列表的游标分页按(created_at, id)排序和定位，需要联合索引支撑范围扫描
+            models.Index(fields=['created_at', 'id'], name='post_created_id_idx'),
+            # 首页时间线按作者拉取动态
+            models.Index(fields=['user', 'created_at', 'id'], name='post_user_created_id_idx'),
+        ]
 
     def __str__(self):
         return f'Post {self.id} by {self.user}'
 
 
+class MediaBlob(models.Model):
+    """
+    按内容寻址存储的媒体文件：相同内容（SHA-256相同）的文件只保存一份，
+    ref_count为引用它的Media数，降为0时文件和记录一起删除（见blobs.py）
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='blobs/')
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Blob {self.digest[:12]} ({self.ref_count} refs)'
+
+
 class Media(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='media')
     media_type = models.CharField(max_length=50)  # 例如 'image', 'video'
     file_path = models.FileField(upload_to='media/')  # 假设所有媒体文件都保存在media目录下
+    # 去重存储的文件，file_path与blob.file指向同一个文件；为空表示文件由该媒体独占（去重之前上传的文件）
+    blob = models.ForeignKey(MediaBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='media')
     created_at = models.DateTimeField(auto_now_add=True)
+    # 衍生版本（缩略图、视频预览帧），由后台任务生成（见derivatives.py），
+    # 每项为{'kind', 'width', 'height', 'file_path'}，按宽度升序；直接存在媒体行上，展示时不需要额外查询
+    derivatives = models.JSONField(default=list, blank=True)
+    DERIVATIVES_PENDING = 'pending'
+    DERIVATIVES_DONE = 'done'
+    DERIVATIVES_FAILED = 'failed'
+    DERIVATIVE_STATE_CHOICES = [(DERIVATIVES_PENDING, 'Pending'), (DERIVATIVES_DONE, 'Done'),
+                                (DERIVATIVES_FAILED, 'Failed')]
+    derivative_state = models.CharField(max_length=10, choices=DERIVATIVE_STATE_CHOICES,
+                                        default=DERIVATIVES_PENDING, db_index=True)
 
     def __str__(self):
         return f'Media {self.id} for Post {self.post_id}'
@@ -47,10 +97,32 @@ class Comment(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    # 冗余计数：点赞数和直接回复数，维护方式同Post
+    like_count = models.PositiveIntegerField(default=0)
+    reply_count = models.PositiveIntegerField(default=0)
+    # 物化路径：从根评论到本评论的ID依次补零拼接，例如"0000000012/0000000040/"。
+    # 同一条动态的评论按path排序即为整棵评论树的先序遍历，某条评论的子树就是path以其path为前缀的评论
+    path = models.CharField(max_length=COMMENT_PATH_SEGMENT_LENGTH * COMMENT_MAX_DEPTH, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ]
 
     def __str__(self):
         return f'Comment by {self.user.username} on {self.post.id}'
 
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        super().save(*args, **kwargs)
+        if creating and not self.path:
+            # 路径包含评论自身的ID，只能在插入之后写入
+            parent_path = self.parent.path if self.parent_id else ''
+            self.path = f'{parent_path}{self.id:0{COMMENT_PATH_SEGMENT_LENGTH - 1}d}/'
+            self.depth = self.parent.depth + 1 if self.parent_id else 0
+            Comment.objects.filter(id=self.id).update(path=self.path, depth=self.depth)
+
 
 class CommentLike(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='comment_likes')
@@ -82,6 +154,45 @@ class Notification(models.Model):
     object_id = models.PositiveIntegerField(null=True, blank=True)  # 允许object_id为空
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    # 以下字段用于合并通知（见dynamic/notifications.py）：同一接收者、同一类型、同一对象的未读通知合并为一条，
+    # 例如"N个人赞了你的动态"。from_user为最近一个发起者
+    # 合并进来的发起者人次
+    actor_count = models.PositiveIntegerField(default=1)
+    # 最近的发起者ID，按时间倒序、逗号分隔，超长部分被截掉
+    recent_actors = models.CharField(max_length=RECENT_ACTORS_MAX_LENGTH, blank=True, default='')
+    # 最近一次合并的时间
+    updated_at = models.DateTimeField(default=timezone.now)
+    # 未读通知的合并键"类型:content_type_id:object_id"，标记已读时置为NULL。
+    # 与to_user组成普通的唯一约束，保证每个(接收者, 类型, 对象)最多只有一条未读通知；
+    # 不使用带condition的部分唯一约束：MySQL不支持部分索引，Django会跳过这种约束（W036），数据库不会执行它。
+    # 这里依赖的是各数据库（MySQL、PostgreSQL、SQLite）唯一索引中NULL互不相同的行为，已读通知不受约束
+    unread_key = models.CharField(max_length=64, null=True, blank=True, default=None)
+
+    class Meta:
+        indexes = [
+            # 通知列表按最近一次活动时间倒序、游标分页；未读列表还要按是否已读过滤
+            models.Index(fields=['to_user', 'updated_at', 'id'], name='notification_inbox_idx'),
+            models.Index(fields=['to_user', 'is_read', 'updated_at', 'id'], name='notification_unread_idx'),
+        ]
+        constraints = [
+            # 每个(接收者, 类型, 对象)最多只有一条未读的合并通知
+            models.UniqueConstraint(fields=['to_user', 'unread_key'], name='unique_unread_notification_key'),
+        ]
+
+    @property
+    def recent_actor_ids(self):
+        """
+        最近的发起者ID列表（去重，最多RECENT_ACTORS_SHOWN个）
+        """
+        # 每个ID后面都跟一个逗号：没有被截断时最后一段为空，被截断时最后一段可能是半个ID，两种情况都丢弃最后一段
+        ids = []
+        for part in self.recent_actors.split(',')[:-1]:
+            if int(part) not in ids:
+                ids.append(int(part))
+        if not ids and self.from_user_id:
+            ids.append(self.from_user_id)
+        return ids[:RECENT_ACTORS_SHOWN]
+
 
 class PostLike(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='post_likes')
@@ -90,3 +201,110 @@ class PostLike(models.Model):
 
     class Meta:
         unique_together = ('user', 'post')  # 确保一个用户对同一动态的点赞是唯一的
+
+
+class TimelineEntry(models.Model):
+    """
+    首页时间线（推模式）：发布动态时把动态ID写入每个粉丝的时间线，读取时直接按时间倒序取，无需关联关注表和动态表
+    """
+    # 时间线的所有者
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey('Post', on_delete=models.CASCADE, related_name='+')
+    # 冗余存储动态的发布时间，用于排序和游标分页
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('owner', 'post')
+        indexes = [
+            models.Index(fields=['owner', 'created_at', 'post'], name='timeline_owner_created_idx'),
+        ]
+
+
+class TimelinePullAuthor(models.Model):
+    """
+    粉丝数超过阈值、动态改为在读取时拉取的账号（见dynamic/timeline.py），在关注关系变化时维护
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+
+
+class UploadSession(models.Model):
+    """
+    分块上传会话。文件分多次请求上传，每块直接追加写入磁盘上的临时文件，received记录已经连续写入的字节数；
+    网络中断后客户端查询received并从该位置继续上传。全部上传完成后在发布动态时转存为Media。
+    """
+    STATUS_ACTIVE = 'active'
+    STATUS_ATTACHED = 'attached'
+    STATUS_CHOICES = [(STATUS_ACTIVE, 'Active'), (STATUS_ATTACHED, 'Attached')]
+
+    # 使用随机UUID作为主键，上传地址不可猜测
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    media_type = models.CharField(max_length=50)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
+    media = models.OneToOneField('Media', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Upload {self.id} by {self.user_id} ({self.received}/{self.size})'
+
+
+class SearchTerm(models.Model):
+    """
+    动态全文索引的词项（见search.py），doc_count为包含该词项的动态数，用于计算IDF
+    """
+    term = models.CharField(max_length=64, unique=True)
+    doc_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.term
+
+
+class SearchDocument(models.Model):
+    """
+    已建立索引的动态及其词项总数（文档长度），用于BM25的长度归一化
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    length = models.PositiveIntegerField()
+
+
+class SearchPosting(models.Model):
+    """
+    倒排表：词项在一条动态中出现的次数。文档长度和发布时间冗余存储在倒排项上，
+    打分时只读取倒排表，不需要关联动态表
+    """
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE, related_name='postings')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    frequency = models.PositiveIntegerField()
+    length = models.PositiveIntegerField()
+    # 动态的发布时间（Unix时间戳，秒）。用整数而不是DateTimeField，读取大量倒排项时不需要逐行转换为datetime
+    published = models.PositiveBigIntegerField()
+
+    class Meta:
+        indexes = [
+            # 每个词项的倒排项按发布时间倒序读取，常见词只读取最近的一部分
+            models.Index(fields=['term', 'published', 'post'], name='search_posting_term_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'term'], name='unique_search_posting'),
+        ]
+
+
+class PostNeighbor(models.Model):
+    """
+    离线计算的相似动态（见recommendations.py）：每条动态保留相似度最高的若干条，推荐时只合并这些列表
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    neighbor = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'score'], name='post_neighbor_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'neighbor'], name='unique_post_neighbor'),
+        ]
@@ -0,0 +1,202 @@
+"""
+通知的创建与合并。
+
+热门动态会收到成千上万次点赞，如果每次点赞都写一条Notification，接收者看到的其实只是"N个人赞了你的动态"。
+因此同一(接收者, 类型, 对象)的未读通知只保留一条滚动的记录（由(to_user, unread_key)唯一约束保证，
+unread_key是未读通知的合并键，标记已读时置为NULL；见Notification.unread_key关于数据库的说明）：
+新的发起者通过一条UPDATE合并进去（人次加一、记录最近的发起者、刷新时间），只有在没有未读记录时才插入新行。
+接收者读过之后，下一次通知会开启新的一条。对象仍然通过通知原有的content_type/object_id通用关联表示。
+
+未读数（App图标上的角标）存放在Django缓存中并增量维护：新建通知行时加一，标记已读时减去实际更新的行数；
+批量创建时无法知道哪些行因唯一约束被忽略，改为让接收者的缓存失效。只有缓存缺失时才执行一次COUNT(*)。为了限制级联删除等情况造成的偏差，缓存设置了过期时间。
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Left
+from django.utils import timezone
+
+from . import post_cache
+from .models import Comment, Notification, Post, RECENT_ACTORS_MAX_LENGTH
+
+# 未读数缓存的过期时间（秒）
+UNREAD_COUNT_TIMEOUT = 60 * 60
+
+
+def _merge_values(actor_id):
+    """
+    把一个发起者合并进已有未读通知时要更新的字段，全部用数据库表达式计算，一条UPDATE完成
+    """
+    return {
+        'actor_count': F('actor_count') + 1,
+        'from_user_id': actor_id,
+        # 新的发起者放在最前面，超出长度的旧发起者被截掉
+        'recent_actors': Left(Concat(Value(f'{actor_id},'), F('recent_actors')), RECENT_ACTORS_MAX_LENGTH),
+        'updated_at': timezone.now(),
+    }
+
+
+def _unread_key(type, content_type, object_id):
+    """
+    未读通知的合并键，格式与迁移0014中为已有通知生成的相同
+    """
+    content_type_id = content_type.id if content_type is not None else ''
+    return f'{type}:{content_type_id}:{"" if object_id is None else object_id}'
+
+
+def notify(type, to_user_id, from_user, content_type, object_id):
+    """
+    发送一条通知，优先合并到已有的未读通知中。
+
+    :return: 是否创建了新的通知行（合并到已有通知时返回False）
+    """
+    unread_key = _unread_key(type, content_type, object_id)
+    unread = Notification.objects.filter(to_user_id=to_user_id, unread_key=unread_key)
+    if unread.update(**_merge_values(from_user.id)):
+        return False
+    try:
+        with transaction.atomic():
+            Notification.objects.create(type=type, to_user_id=to_user_id, from_user=from_user,
+                                        content_type=content_type, object_id=object_id,
+                                        recent_actors=f'{from_user.id},', unread_key=unread_key)
+        _adjust_unread_count_on_commit(to_user_id, 1)
+        return True
+    except IntegrityError:
+        # 并发请求已经创建了未读通知（唯一约束保证只有一条），合并进去即可
+        unread.update(**_merge_values(from_user.id))
+        return False
+
+
+def notify_many(type, from_user, content_type, targets):
+    """
+    同一个发起者对多个对象发送同类通知（例如批量点赞）。查询次数固定：
+    一次查询已有的未读通知，一条UPDATE合并到这些通知，一次bulk_create为其余对象创建通知。
+
+    :param targets: [(object_id, to_user_id), ...]
+    :return: 新创建的通知行数
+    """
+    if not targets:
+        return 0
+
+    pairs = set(targets)
+    rows = (Notification.objects
+            .filter(to_user_id__in={to_user_id for _, to_user_id in targets},
+                    unread_key__in={_unread_key(type, content_type, object_id) for object_id, _ in targets})
+            .values_list('id', 'object_id', 'to_user_id'))
+    existing = {(object_id, to_user_id): pk for pk, object_id, to_user_id in rows if (object_id, to_user_id) in pairs}
+    if existing:
+        Notification.objects.filter(id__in=existing.values()).update(**_merge_values(from_user.id))
+    new = [pair for pair in targets if pair not in existing]
+    # 与并发请求同时创建同一条未读通知时，唯一约束会忽略后插入的一条，只损失一次合并计数
+    Notification.objects.bulk_create([
+        Notification(type=type, to_user_id=to_user_id, from_user=from_user, content_type=content_type,
+                     object_id=object_id, recent_actors=f'{from_user.id},',
+                     unread_key=_unread_key(type, content_type, object_id))
+        for object_id, to_user_id in new
+    ], ignore_conflicts=True)
+    # ignore_conflicts不返回哪些行被忽略，不能逐行加一；提交后让这些接收者的缓存未读数失效，下次读取时重新统计
+    _invalidate_unread_counts_on_commit({to_user_id for _, to_user_id in new})
+    return len(new)
+
+
+def _unread_count_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def _adjust_unread_count(user_id, delta):
+    """
+    增量调整缓存中的未读数。缓存中没有时不做处理，下次读取时会重新统计
+    """
+    try:
+        if delta > 0:
+            cache.incr(_unread_count_key(user_id), delta)
+        elif delta < 0:
+            cache.decr(_unread_count_key(user_id), -delta)
+    except ValueError:
+        pass
+
+
+def _adjust_unread_count_on_commit(user_id, delta):
+    # 事务回滚时通知行不会写入，因此在提交之后再调整缓存
+    transaction.on_commit(lambda: _adjust_unread_count(user_id, delta))
+
+
+def _invalidate_unread_counts_on_commit(user_ids):
+    if user_ids:
+        keys = [_unread_count_key(user_id) for user_id in user_ids]
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def unread_count(user_id):
+    """
+    返回用户的未读通知数。命中缓存时不访问数据库
+    """
+    if not post_cache.shared_cache():
+        # 进程内的缓存无法看到其他进程的增减
+        return Notification.objects.filter(to_user_id=user_id, is_read=False).count()
+    count = cache.get(_unread_count_key(user_id))
+    if count is None:
+        count = Notification.objects.filter(to_user_id=user_id, is_read=False).count()
+        # add不会覆盖并发请求已经增量更新过的值
+        cache.add(_unread_count_key(user_id), count, UNREAD_COUNT_TIMEOUT)
+    return max(count, 0)
+
+
+def mark_read(user_id, up_to=None):
+    """
+    把用户最近一次活动时间不晚于高水位通知的未读通知全部标记为已读，一条UPDATE完成
+
+    :param up_to: 高水位通知的ID（通常是客户端看到的最新一条），为None时标记全部未读通知
+    :return: 标记为已读的通知数，高水位通知不存在时返回None
+    """
+    unread = Notification.objects.filter(to_user_id=user_id, is_read=False)
+    if up_to is not None:
+        high_water = (Notification.objects.filter(id=up_to, to_user_id=user_id)
+                      .values_list('updated_at', flat=True).first())
+        if high_water is None:
+            return None
+        unread = unread.filter(updated_at__lte=high_water)
+    # 清空合并键，之后的通知开启新的一条
+    count = unread.update(is_read=True, unread_key=None)
+    _adjust_unread_count_on_commit(user_id, -count)
+    return count
+
+
+def _serialize_object(content_object):
+    """
+    通知关联对象的摘要信息
+    """
+    if isinstance(content_object, Post):
+        return {'type': 'post', 'id': content_object.id, 'content': content_object.content[:50]}
+    if isinstance(content_object, Comment):
+        return {'type': 'comment', 'id': content_object.id, 'post_id': content_object.post_id,
+                'content': content_object.content[:50]}
+    return None
+
+
+def notification_queryset(user_id):
+    """
+    用户收到的通知。关联对象通过prefetch_related按content_type分组批量加载（每种类型一次查询），
+    不会在序列化时逐条查询
+    """
+    return Notification.objects.filter(to_user_id=user_id).prefetch_related('content_object')
+
+
+def serialize_notifications(notifications):
+    """
+    序列化一页notification_queryset()返回的通知。最近发起者的用户名一次查询批量加载，查询次数与通知条数无关。
+    """
+    notifications = list(notifications)
+    actor_ids = {actor_id for notification in notifications for actor_id in notification.recent_actor_ids}
+    usernames = dict(get_user_model().objects.filter(id__in=actor_ids).values_list('id', 'username'))
+    return [{
+        'id': notification.id,
+        'type': notification.type,
+        'actor_count': notification.actor_count,
+        'actors': [usernames[actor_id] for actor_id in notification.recent_actor_ids if actor_id in usernames],
+        'object': _serialize_object(notification.content_object),
+        'is_read': notification.is_read,
+        'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'updated_at': notification.updated_at.strftime('%Y-%m-%d %H:%M:%S'),
+    } for notification in notifications]
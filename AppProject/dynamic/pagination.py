@@ -0,0 +1,96 @@
+"""
+基于游标（keyset）的分页工具。
+
+与Paginator的OFFSET分页不同，游标分页记住上一页最后一条记录的排序键（例如(created_at, id)），
+下一页直接用 WHERE (created_at, id) < (上一页最后的值) 走索引范围扫描，不需要COUNT(*)，
+也不会随着翻页深度变慢。游标对客户端是不透明的字符串，客户端只需要原样带回即可。
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """
+    客户端传入的游标无法解析时抛出
+    """
+
+
+def encode_cursor(values):
+    """
+    将排序键的值编码为不透明的游标字符串
+
+    :param values: 排序键的值列表，例如 [created_at, id]
+    :return: URL安全的base64字符串
+    """
+    payload = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, model, fields):
+    """
+    将游标字符串还原为排序键的值，并按模型字段类型转换（例如把ISO字符串转回datetime）
+
+    :param cursor: encode_cursor生成的字符串
+    :param model: 被分页的模型类
+    :param fields: 排序字段名元组
+    :return: 与fields一一对应的值列表
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor.')
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise InvalidCursor('Invalid cursor.')
+    try:
+        return [model._meta.get_field(name).to_python(value) for name, value in zip(fields, values)]
+    except Exception:
+        raise InvalidCursor('Invalid cursor.')
+
+
+def _after(fields, values, descending):
+    """
+    构建"排在游标之后"的过滤条件，等价于行值比较 (f1, f2, ...) < (v1, v2, ...)。
+    额外加上首字段的闭区间条件 f1 <= v1，使数据库可以直接在联合索引上定位起点，而不是扫描OR的各个分支。
+    """
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for i, name in enumerate(fields):
+        term = Q(**{f'{name}__{lookup}': values[i]})
+        for prev_name, prev_value in zip(fields[:i], values[:i]):
+            term &= Q(**{prev_name: prev_value})
+        condition |= term
+    return Q(**{f'{fields[0]}__{lookup}e': values[0]}) & condition
+
+
+def paginate_by_cursor(queryset, cursor, limit, fields=('created_at', 'id'), descending=True):
+    """
+    对查询集进行游标分页。多取一条记录用于判断是否还有下一页，不执行COUNT(*)。
+    排序键的最后一个字段必须唯一（通常是id），以保证顺序稳定。
+
+    :param queryset: 待分页的查询集
+    :param cursor: 客户端传入的游标，为空时返回第一页
+    :param limit: 每页条数
+    :param fields: 排序字段名元组
+    :param descending: 是否降序
+    :return: (本页记录列表, 下一页游标或None)
+    """
+    fields = tuple(fields)
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, fields)
+        queryset = queryset.filter(_after(fields, values, descending))
+    ordering = [f'-{name}' if descending else name for name in fields]
+    items = list(queryset.order_by(*ordering)[:limit + 1])
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor([
+            last[name] if isinstance(last, dict) else getattr(last, name) for name in fields
+        ])
+    return items, next_cursor
@@ -0,0 +1,19 @@
+"""
+请求参数的解析工具，供各个应用的视图共用（例如批量点赞和批量关注的ID列表）。
+"""
+
+
+def parse_ids(values):
+    """
+    解析请求中的ID列表，支持重复的参数（ids=1&ids=2）和逗号分隔（ids=1,2）两种写法，去重后保持原有顺序，无法解析时返回None
+    """
+    ids = []
+    for value in values:
+        for part in value.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if not part.isdigit():
+                return None
+            ids.append(int(part))
+    return list(dict.fromkeys(ids))
@@ -0,0 +1,125 @@
+"""
+动态详情的响应缓存，以每条动态的版本号为键。
+
+热门动态的详情每分钟被请求上千次，每次都要查询Post、User和Media。这里把序列化结果存入Django缓存，
+键中带有动态当前的版本号：修改、删除、点赞、取消点赞、评论以及媒体文件变化（例如缩略图生成完成）时给版本号加一，
+旧版本的缓存从此不会再被读到，由缓存自行淘汰。失效是精确的，不依赖过期时间。
+
+版本号同样存放在缓存中。版本号在事务提交之后才增加，保证新版本号对应的一定是已提交的数据；
+版本号被淘汰后用当前时间（纳秒）重新初始化，不会与之前用过的版本号重复。
+命中和未命中次数记录在缓存的两个计数器中，通过stats()和cache_stats视图查看。
+
+任何一条动态发生变化（包括发布新动态）时，全局的动态列表版本号也会加一，动态列表以它作为条件请求的ETag。
+
+版本号必须存放在所有工作进程共享的缓存中（settings.CACHES，例如Redis）。缓存是进程内的LocMemCache或DummyCache时，
+shared_cache()返回False，动态详情不再缓存、动态列表不带ETag（搜索结果和通知未读数同样不缓存），
+除非settings.ALLOW_PROCESS_LOCAL_CACHE为True（只用于单进程运行）。
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+HITS_KEY = 'post_detail:hits'
+MISSES_KEY = 'post_detail:misses'
+# 全局的动态列表版本号，与单条动态的版本号共用同一套读写函数
+FEED = 'all'
+
+
+def shared_cache():
+    """
+    默认缓存能否在工作进程之间共享失效：进程内的缓存中，一个进程增加的版本号对其他进程不可见，
+    它们会继续返回旧的详情和304
+    """
+    if getattr(settings, 'ALLOW_PROCESS_LOCAL_CACHE', False):
+        return True
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def _timeout():
+    return getattr(settings, 'POST_DETAIL_CACHE_TIMEOUT', 60 * 60)
+
+
+def _version_key(post_id):
+    return f'post:version:{post_id}'
+
+
+def get_version(post_id):
+    """
+    返回动态当前的版本号，缓存中没有时初始化
+    """
+    key = _version_key(post_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def feed_version():
+    """
+    动态列表的版本号：任何动态发生变化时都会增加
+    """
+    return get_version(FEED)
+
+
+def _bump(post_ids):
+    for post_id in (*post_ids, FEED):
+        try:
+            cache.incr(_version_key(post_id))
+        except ValueError:
+            # 版本号已被淘汰，用一个新的、不会与旧版本重复的值代替
+            cache.set(_version_key(post_id), time.time_ns(), None)
+
+
+def bump(*post_ids):
+    """
+    动态发布、内容或计数发生变化后调用，在事务提交后使这些动态已缓存的详情和动态列表的ETag失效
+    """
+    transaction.on_commit(lambda: _bump(post_ids))
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def get_or_build(post_id, variant, build):
+    """
+    读取动态详情的缓存，未命中时调用build()生成并写入缓存
+
+    :param variant: 影响响应内容的其他参数（例如显示宽度），作为键的一部分
+    :param build: 返回可JSON序列化的详情；动态不存在时返回None，不缓存
+    :return: (详情或None, 是否命中缓存)
+    """
+    if not shared_cache():
+        return build(), False
+    key = f'post:detail:{post_id}:{get_version(post_id)}:{variant}'
+    data = cache.get(key)
+    if data is not None:
+        _count(HITS_KEY)
+        return data, True
+    _count(MISSES_KEY)
+    data = build()
+    if data is not None:
+        cache.set(key, data, _timeout())
+    return data, False
+
+
+def stats():
+    """
+    命中次数、未命中次数和命中率
+    """
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counts.get(HITS_KEY, 0), counts.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total, 4) if total else None}
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,184 @@
+"""
+基于物品的协同过滤推荐（item-item CF）。
+
+离线部分（build_recommendations命令，每晚执行一次）：
+1. 取最近settings.RECOMMEND_WINDOW_DAYS天内发布的动态，构建稀疏的 用户 x 动态 交互矩阵X：
+   点赞记LIKE_WEIGHT，评论记COMMENT_WEIGHT（多次评论先累加再取log1p，避免刷评论的用户主导相似度），
+   关注某个作者记FOLLOW_WEIGHT到该作者的每一条动态上（关注矩阵 x 作者-动态矩阵，一次稀疏矩阵乘法得到）；
+2. 对X按列做L2归一化，动态之间的余弦相似度为 Xn^T Xn。按动态分块计算，每块得到一个稀疏的 块 x 全部动态 矩阵，
+   内存占用由块大小控制；每行用argpartition取出相似度最高的settings.RECOMMEND_TOP_K条；
+3. 在一个事务中替换PostNeighbor表。
+
+在线部分（recommend视图）：读取用户最近点赞和评论过的动态，合并这些动态的相似动态列表（按交互权重加权求和），
+去掉用户已经交互过的和自己发布的动态。只有几条索引查询，不做任何矩阵运算；候选不足时用近期的热门动态补齐。
+
+矩阵运算依赖NumPy和SciPy，只有离线任务需要，Web进程不需要安装。
+"""
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Comment, Post, PostLike, PostNeighbor
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # NumPy和SciPy是可选依赖，只在离线计算时需要
+    np = sparse = None
+
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+FOLLOW_WEIGHT = 0.2
+
+# 在线推荐时使用的用户最近交互的动态数
+RECENT_INTERACTIONS = 50
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _pairs(queryset):
+    """
+    把values_list(用户ID, 另一列ID)的结果读成两个int64数组
+    """
+    rows = np.array(list(queryset.iterator(chunk_size=10000)), dtype=np.int64).reshape(-1, 2)
+    return rows[:, 0], rows[:, 1]
+
+
+def _interaction_matrix(since):
+    """
+    :return: (交互矩阵X（用户 x 动态，CSR）, 按列顺序排列的动态ID数组)
+    """
+    posts = np.array(list(Post.objects.filter(created_at__gte=since).order_by('id')
+                          .values_list('id', 'user_id')), dtype=np.int64).reshape(-1, 2)
+    post_ids, authors = posts[:, 0], posts[:, 1]
+
+    like_users, like_posts = _pairs(PostLike.objects.filter(post__created_at__gte=since)
+                                    .values_list('user_id', 'post_id'))
+    comment_users, comment_posts = _pairs(Comment.objects.filter(post__created_at__gte=since)
+                                          .values_list('user_id', 'post_id'))
+    # 中间表中to_customuser为关注者，from_customuser为被关注者
+    through = get_user_model().followers.through
+    followers, followees = _pairs(through.objects.values_list('to_customuser_id', 'from_customuser_id'))
+
+    users = np.unique(np.concatenate([like_users, comment_users, followers]))
+    author_ids, author_index = np.unique(authors, return_inverse=True)
+    shape = (len(users), len(post_ids))
+
+    def matrix(user_ids, columns, weight):
+        return sparse.csr_matrix((np.full(len(user_ids), weight), (np.searchsorted(users, user_ids), columns)),
+                                 shape=shape)
+
+    # 点赞和评论在读取动态列表之后才查询，期间新发布（或删除）的动态不在列表中，映射到列之前先去掉
+    in_posts = np.isin(comment_posts, post_ids)
+    comment_users, comment_posts = comment_users[in_posts], comment_posts[in_posts]
+    in_posts = np.isin(like_posts, post_ids)
+    like_users, like_posts = like_users[in_posts], like_posts[in_posts]
+
+    # 同一用户多次评论同一动态时坐标重复，csr_matrix会把它们累加
+    comments = matrix(comment_users, np.searchsorted(post_ids, comment_posts), COMMENT_WEIGHT)
+    comments.data = np.log1p(comments.data)
+    interactions = matrix(like_users, np.searchsorted(post_ids, like_posts), LIKE_WEIGHT) + comments
+
+    # 只保留关注了近期发过动态的作者的关注关系
+    followed = np.isin(followees, author_ids)
+    follow_matrix = sparse.csr_matrix(
+        (np.full(followed.sum(), FOLLOW_WEIGHT),
+         (np.searchsorted(users, followers[followed]), np.searchsorted(author_ids, followees[followed]))),
+        shape=(len(users), len(author_ids)))
+    author_posts = sparse.csr_matrix((np.ones(len(post_ids)), (author_index, np.arange(len(post_ids)))),
+                                     shape=(len(author_ids), len(post_ids)))
+    return (interactions + follow_matrix @ author_posts).tocsr(), post_ids
+
+
+def _top_neighbors(matrix, post_ids, top_k, block_size):
+    """
+    分块计算余弦相似度，逐块产出(动态ID, 相似动态ID, 相似度)
+    """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0))).ravel()
+    norms[norms == 0] = 1
+    normalized = (matrix @ sparse.diags(1 / norms)).tocsc()
+    transposed = normalized.T.tocsr()
+    for start in range(0, len(post_ids), block_size):
+        block = (transposed[start:start + block_size] @ normalized).tocsr()
+        for row in range(block.shape[0]):
+            begin, end = block.indptr[row], block.indptr[row + 1]
+            columns, scores = block.indices[begin:end], block.data[begin:end]
+            keep = columns != start + row
+            columns, scores = columns[keep], scores[keep]
+            if len(scores) > top_k:
+                best = np.argpartition(-scores, top_k)[:top_k]
+                columns, scores = columns[best], scores[best]
+            post_id = int(post_ids[start + row])
+            for column, score in zip(columns.tolist(), scores.tolist()):
+                yield post_id, int(post_ids[column]), score
+
+
+def build(top_k=None, window_days=None, block_size=1000, batch_size=5000):
+    """
+    重新计算全部动态的相似动态并替换PostNeighbor表
+
+    :return: 各阶段的统计信息和耗时（秒）
+    """
+    if np is None:
+        raise RuntimeError('NumPy and SciPy are required to build recommendations.')
+    top_k = top_k or _setting('RECOMMEND_TOP_K', 50)
+    window_days = window_days or _setting('RECOMMEND_WINDOW_DAYS', 90)
+    stats = {}
+
+    start = time.perf_counter()
+    matrix, post_ids = _interaction_matrix(timezone.now() - timedelta(days=window_days))
+    stats.update(users=matrix.shape[0], posts=matrix.shape[1], interactions=matrix.nnz,
+                 load_seconds=time.perf_counter() - start)
+
+    start = time.perf_counter()
+    neighbors = [PostNeighbor(post_id=post_id, neighbor_id=neighbor_id, score=score)
+                 for post_id, neighbor_id, score in _top_neighbors(matrix, post_ids, top_k, block_size)]
+    stats.update(neighbors=len(neighbors), similarity_seconds=time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with transaction.atomic():
+        PostNeighbor.objects.all().delete()
+        PostNeighbor.objects.bulk_create(neighbors, batch_size=batch_size)
+    stats['write_seconds'] = time.perf_counter() - start
+    return stats
+
+
+def recommend(user_id, limit):
+    """
+    为用户推荐动态：合并用户最近交互过的动态的相似动态列表
+
+    :return: 动态ID列表，按推荐得分降序
+    """
+    seeds = Counter()
+    for post_id in (PostLike.objects.filter(user_id=user_id).order_by('-created_at')
+                    .values_list('post_id', flat=True)[:RECENT_INTERACTIONS]):
+        seeds[post_id] += LIKE_WEIGHT
+    for post_id in (Comment.objects.filter(user_id=user_id).order_by('-created_at')
+                    .values_list('post_id', flat=True)[:RECENT_INTERACTIONS]):
+        seeds[post_id] += COMMENT_WEIGHT
+
+    scores = Counter()
+    for post_id, neighbor_id, score in (PostNeighbor.objects.filter(post_id__in=list(seeds))
+                                        .values_list('post_id', 'neighbor_id', 'score')):
+        if neighbor_id not in seeds:
+            scores[neighbor_id] += seeds[post_id] * score
+    # 多取一些，去掉用户自己发布的动态之后仍然够用
+    candidates = [post_id for post_id, _ in scores.most_common(limit * 2)]
+    own = set(Post.objects.filter(id__in=candidates, user_id=user_id).values_list('id', flat=True))
+    ranked = [post_id for post_id in candidates if post_id not in own][:limit]
+
+    if len(ranked) < limit:
+        # 冷启动或交互太少：用近期点赞最多的动态补齐
+        since = timezone.now() - timedelta(days=_setting('RECOMMEND_WINDOW_DAYS', 90))
+        popular = (Post.objects.filter(created_at__gte=since).exclude(user_id=user_id)
+                   .exclude(id__in=[*ranked, *seeds]).order_by('-like_count', '-id')
+                   .values_list('id', flat=True)[:limit - len(ranked)])
+        ranked.extend(popular)
+    return ranked
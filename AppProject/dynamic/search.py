@@ -0,0 +1,248 @@
+"""
+动态的全文搜索：增量维护的倒排索引，BM25打分并按发布时间加权。
+
+分词：文本先做NFKC规范化并转为小写。中日韩文字没有空格分词，连续的中日韩字符切成相邻的二元组
+（"故宫门票" -> "故宫"、"宫门"、"门票"，只有一个字时保留单字）；其他语言按字母数字组成的单词切分。
+查询使用同样的分词，不需要词典。
+
+索引：SearchTerm为词项及其文档频率，SearchPosting为倒排项(词项, 动态, 词频)，SearchDocument记录每条动态的词项总数。
+publish_content和edit_content在保存动态的同一事务中调用index_post()重建该动态的倒排项，index_post()自身也在事务
+（外层已有事务时为保存点）中执行，倒排项和文档频率、文档长度统计总是一起更新；删除动态时（包括级联删除）由信号调用remove_post()。
+全量重建使用rebuild_search_index命令。
+
+查询：对每个查询词项按发布时间倒序最多读取settings.SEARCH_POSTINGS_LIMIT条倒排项（索引范围扫描），
+在内存中累加BM25得分，再乘以时间加权 1 + w * 0.5 ** (距今天数 / 半衰期)。
+常见词项只读取最近的倒排项，单次查询读取的行数有上限，与动态总数无关；排序结果按查询词项和索引版本号缓存，
+翻页直接从缓存中切片。索引版本号只在倒排索引变化（index_post、remove_post、全量重建）的事务提交后增加，
+点赞、评论等不影响排序的变化不会使缓存失效。
+"""
+import hashlib
+import math
+import re
+import time
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, F
+from django.utils import timezone
+
+from . import post_cache
+from .models import Post, SearchDocument, SearchPosting, SearchTerm
+
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 单个词项的最大长度，与SearchTerm.term一致
+MAX_TERM_LENGTH = 64
+# 单次查询最多使用的词项数
+MAX_QUERY_TERMS = 32
+
+# 平假名、片假名、中日韩统一表意文字（含扩展A区和兼容区）、韩文音节
+CJK_RANGES = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+TOKEN_RE = re.compile(rf'([{CJK_RANGES}]+)|([^\W_{CJK_RANGES}]+)')
+
+STATS_KEY = 'search:stats'
+INDEX_VERSION_KEY = 'search:index:version'
+
+
+def tokenize(text):
+    """
+    把文本切分为词项列表（可能重复）：中日韩文字为二元组，其他语言为单词
+    """
+    tokens = []
+    for cjk, word in TOKEN_RE.findall(unicodedata.normalize('NFKC', text or '').lower()):
+        if word:
+            tokens.append(word[:MAX_TERM_LENGTH])
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def index_version():
+    """
+    倒排索引的版本号，缓存中没有时初始化
+    """
+    version = cache.get(INDEX_VERSION_KEY)
+    if version is None:
+        cache.add(INDEX_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(INDEX_VERSION_KEY)
+    return version
+
+
+def _bump_index_version():
+    try:
+        cache.incr(INDEX_VERSION_KEY)
+    except ValueError:
+        # 版本号已被淘汰，用一个新的、不会与旧版本重复的值代替
+        cache.set(INDEX_VERSION_KEY, time.time_ns(), None)
+
+
+def _index_changed():
+    # 事务提交后再使缓存的排序结果失效，回滚时不需要
+    transaction.on_commit(_bump_index_version)
+
+
+def _term_ids(terms):
+    """
+    返回词项到ID的映射，不存在的词项先创建。
+    bulk_create在MySQL上不返回自增ID，创建后统一重新查询
+    """
+    SearchTerm.objects.bulk_create([SearchTerm(term=term) for term in terms], ignore_conflicts=True)
+    return dict(SearchTerm.objects.filter(term__in=terms).values_list('term', 'id'))
+
+
+def remove_post(post_id):
+    """
+    删除一条动态的倒排项，并减少相应词项的文档频率
+    """
+    term_ids = list(SearchPosting.objects.filter(post_id=post_id).values_list('term_id', flat=True))
+    with transaction.atomic():
+        if term_ids:
+            SearchTerm.objects.filter(id__in=term_ids, doc_count__gt=0).update(doc_count=F('doc_count') - 1)
+            SearchPosting.objects.filter(post_id=post_id).delete()
+        if SearchDocument.objects.filter(post_id=post_id).delete()[0] or term_ids:
+            _index_changed()
+
+
+def index_post(post):
+    """
+    建立或更新一条动态的索引，在发布或修改动态的同一事务中调用；删除旧倒排项和写入新倒排项在同一事务中完成
+    """
+    counts = Counter(tokenize(post.content))
+    with transaction.atomic():
+        remove_post(post.id)
+        if not counts:
+            return
+        term_ids = _term_ids(list(counts))
+        SearchTerm.objects.filter(id__in=term_ids.values()).update(doc_count=F('doc_count') + 1)
+        length = sum(counts.values())
+        SearchDocument.objects.create(post_id=post.id, length=length)
+        SearchPosting.objects.bulk_create([
+            SearchPosting(term_id=term_ids[term], post_id=post.id, frequency=frequency, length=length,
+                          published=int(post.created_at.timestamp()))
+            for term, frequency in counts.items()
+        ])
+        _index_changed()
+
+
+def rebuild(batch_size=1000, progress=None):
+    """
+    清空并重建全部动态的索引。文档频率在内存中累加，最后批量写回
+
+    :param progress: 每处理完一批时以已处理的动态数调用
+    :return: 建立索引的动态数
+    """
+    SearchPosting.objects.all().delete()
+    SearchDocument.objects.all().delete()
+    SearchTerm.objects.all().delete()
+
+    doc_counts, term_ids = Counter(), {}
+    last_id, indexed = 0, 0
+    while True:
+        rows = list(Post.objects.filter(id__gt=last_id).order_by('id')
+                    .values_list('id', 'content', 'created_at')[:batch_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        documents = [(post_id, created_at, Counter(tokenize(content))) for post_id, content, created_at in rows]
+        new_terms = {term for _, _, counts in documents for term in counts if term not in term_ids}
+        if new_terms:
+            term_ids.update(_term_ids(list(new_terms)))
+
+        search_documents, postings = [], []
+        for post_id, created_at, counts in documents:
+            if not counts:
+                continue
+            length, published = sum(counts.values()), int(created_at.timestamp())
+            search_documents.append(SearchDocument(post_id=post_id, length=length))
+            for term, frequency in counts.items():
+                doc_counts[term] += 1
+                postings.append(SearchPosting(term_id=term_ids[term], post_id=post_id, frequency=frequency,
+                                              length=length, published=published))
+        # 重建期间新发布的动态可能已经由index_post建立了索引，跳过冲突的行
+        SearchDocument.objects.bulk_create(search_documents, ignore_conflicts=True)
+        SearchPosting.objects.bulk_create(postings, batch_size=batch_size, ignore_conflicts=True)
+        indexed += len(search_documents)
+        if progress:
+            progress(indexed)
+
+    SearchTerm.objects.bulk_update([SearchTerm(id=term_ids[term], doc_count=count)
+                                    for term, count in doc_counts.items()], ['doc_count'], batch_size=batch_size)
+    cache.delete(STATS_KEY)
+    _index_changed()
+    return indexed
+
+
+def _corpus_stats():
+    """
+    (已索引的动态数, 平均文档长度)，缓存settings.SEARCH_STATS_TIMEOUT秒，BM25对它们的小幅变化不敏感
+    """
+    stats = cache.get(STATS_KEY)
+    if stats is None:
+        result = SearchDocument.objects.aggregate(count=Count('pk'), average=Avg('length'))
+        stats = (result['count'], result['average'] or 0)
+        cache.set(STATS_KEY, stats, _setting('SEARCH_STATS_TIMEOUT', 10 * 60))
+    return stats
+
+
+def _rank(terms):
+    """
+    计算查询的排序结果：按得分降序的动态ID列表，最多settings.SEARCH_MAX_RESULTS条
+    """
+    rows = SearchTerm.objects.filter(term__in=terms, doc_count__gt=0).values_list('id', 'doc_count')
+    if not rows:
+        return []
+    total, average_length = _corpus_stats()
+    average_length = average_length or 1
+    limit = _setting('SEARCH_POSTINGS_LIMIT', 2000)
+
+    scores, published = Counter(), {}
+    for term_id, doc_count in rows:
+        total = max(total, doc_count)
+        idf = math.log(1 + (total - doc_count + 0.5) / (doc_count + 0.5))
+        postings = (SearchPosting.objects.filter(term_id=term_id).order_by('-published', '-post_id')
+                    .values_list('post_id', 'frequency', 'length', 'published')[:limit])
+        for post_id, frequency, length, timestamp in postings:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+            scores[post_id] += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+            published[post_id] = timestamp
+
+    now = timezone.now().timestamp()
+    half_life = _setting('SEARCH_RECENCY_HALF_LIFE_DAYS', 30) * 86400
+    weight = _setting('SEARCH_RECENCY_WEIGHT', 1.0)
+    for post_id, timestamp in published.items():
+        scores[post_id] *= 1 + weight * 0.5 ** (max(now - timestamp, 0) / half_life)
+    ranked = sorted(scores, key=lambda post_id: (-scores[post_id], -post_id))
+    return ranked[:_setting('SEARCH_MAX_RESULTS', 1000)]
+
+
+def search(query, offset, limit):
+    """
+    搜索动态
+
+    :return: (本页动态ID列表, 是否还有下一页)
+    """
+    terms = sorted(set(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return [], False
+    digest = hashlib.md5(' '.join(terms).encode('utf-8')).hexdigest()
+    if not post_cache.shared_cache():
+        ranked = _rank(terms)
+        return ranked[offset:offset + limit], len(ranked) > offset + limit
+    # 倒排索引变化时版本号增加，旧的排序结果不会再被读到
+    key = f'search:posts:{digest}:{index_version()}'
+    ranked = cache.get(key)
+    if ranked is None:
+        ranked = _rank(terms)
+        cache.set(key, ranked, _setting('SEARCH_RESULT_CACHE_TIMEOUT', 5 * 60))
+    return ranked[offset:offset + limit], len(ranked) > offset + limit
@@ -0,0 +1,60 @@
+"""
+动态的查询集构建与序列化，供动态列表和动态详情共用。
+
+逐条序列化时访问post.user和Media.objects.filter(post=post)会为每条动态额外产生两次查询（N+1问题），
+一页10条动态就要21次以上查询。这里统一使用select_related加载发布者、prefetch_related批量加载媒体文件，
+点赞数和评论数直接读取Post上的冗余计数列，使加载一页动态的查询次数固定，与每页条数无关。
+媒体文件的衍生版本（缩略图）记录在Media.derivatives列中，随媒体文件一起加载，选择合适的版本不需要额外查询。
+"""
+from django.db.models import Prefetch
+
+from .derivatives import pick_variant
+from .models import Post, Media
+
+
+def post_queryset():
+    """
+    返回用于展示的动态查询集：只取需要的列，预加载发布者和媒体文件，并附带点赞数和评论数。
+
+    :return: 动态查询集，可继续过滤、排序和分页
+    """
+    media = Media.objects.only('id', 'post', 'media_type', 'file_path', 'derivatives').order_by('id')
+    return (Post.objects
+            .select_related('user')
+            .only('id', 'content', 'created_at', 'like_count', 'comment_count', 'user__username')
+            .prefetch_related(Prefetch('media', queryset=media)))
+
+
+def serialize_post(post, width=None):
+    """
+    将post_queryset()返回的动态序列化为字典，不会触发额外查询
+
+    :param post: post_queryset()中的动态实例
+    :param width: 客户端的显示宽度（像素），每个媒体文件的variant为不小于该宽度的最小缩略图，未指定时为原文件
+    :return: 可直接JSON序列化的字典
+    """
+    return {
+        'id': post.id,
+        'user': post.user.username,
+        'content': post.content,
+        'created_at': post.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'media': [{'media_type': media.media_type, 'file_path': media.file_path.name,
+                   'variant': pick_variant(media, width)} for media in post.media.all()],
+        'like_count': post.like_count,
+        'comment_count': post.comment_count,
+    }
+
+
+def serialize_posts(posts, width=None):
+    """
+    序列化一页动态。posts可以是查询集、Page对象或列表，媒体文件已在查询集求值时批量加载。
+    """
+    return [serialize_post(post, width) for post in posts]
+
+
+def parse_width(request):
+    """
+    读取请求中的显示宽度参数?width=，无法解析时返回None
+    """
+    width = request.GET.get('width', '')
+    return int(width) if width.isdigit() else None
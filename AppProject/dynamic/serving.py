@@ -0,0 +1,158 @@
+"""
+媒体文件的下载：HTTP Range（视频拖动进度条）、基于内容的强ETag和条件请求（重复查看返回304）。
+
+ETag直接使用去重存储的SHA-256（见blobs.py）；去重之前上传的文件和缩略图在第一次访问时流式计算摘要，
+以(文件名, 大小, 修改时间)为键缓存。条件请求的判断在打开文件之前完成。
+
+文件内容的发送方式：
+整个文件：FileResponse把文件对象交给WSGI服务器的wsgi.file_wrapper，gunicorn等服务器会用sendfile零拷贝发送。
+单个字节范围：按固定大小的缓冲区只读取该范围，内存占用与文件大小无关；多个范围的请求按整个文件返回。
+settings.MEDIA_SENDFILE_BACKEND为'x-sendfile'或'x-accel-redirect'时，Python不读取文件内容，
+只返回指向文件的响应头，由Apache（mod_xsendfile）或Nginx（internal location）发送文件并处理Range。
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .blobs import HASH_CHUNK_SIZE
+
+# 发送字节范围时每次读取的字节数
+RANGE_BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def _sendfile_backend():
+    return getattr(settings, 'MEDIA_SENDFILE_BACKEND', None)
+
+
+def content_etag(path, stat, digest=None):
+    """
+    基于内容的强ETag。已知摘要（去重存储的文件）时直接使用，否则计算一次后缓存
+    """
+    if digest is None:
+        key = f'media_digest:{hashlib.md5(path.encode()).hexdigest()}:{stat.st_size}:{stat.st_mtime_ns}'
+        digest = cache.get(key)
+        if digest is None:
+            hasher = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+            digest = hasher.hexdigest()
+            cache.set(key, digest, None)
+    return quote_etag(digest)
+
+
+def parse_range(header, size):
+    """
+    解析单个字节范围
+
+    :return: (起始位置, 结束位置)，包含两端；请求头缺失、格式不支持或包含多个范围时返回None（按整个文件返回）
+    :raises RangeNotSatisfiable: 范围在文件之外
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        # bytes=-N：最后N个字节
+        start, end = max(size - int(last), 0), size - 1
+        if int(last) == 0:
+            raise RangeNotSatisfiable
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(RANGE_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def _sendfile_response(name, path):
+    response = HttpResponse()
+    if _sendfile_backend() == 'x-accel-redirect':
+        prefix = getattr(settings, 'MEDIA_SENDFILE_URL', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(name)
+    else:
+        response['X-Sendfile'] = path
+    # 内容类型由前端服务器按文件扩展名重新判断，这里删除Django的默认值
+    del response['Content-Type']
+    return response
+
+
+def serve_file(request, name, path, digest=None):
+    """
+    返回媒体文件的响应
+
+    :param name: 文件在媒体存储中的名称
+    :param path: 文件在本地文件系统上的路径
+    :param digest: 已知的内容摘要
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    etag = content_etag(path, stat, digest)
+    last_modified = int(stat.st_mtime)
+
+    # If-None-Match / If-Modified-Since等条件满足时直接返回304（或412），不打开文件
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _file_response(request, name, path, stat.st_size, etag, last_modified)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    patch_cache_control(response, public=True, max_age=getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600))
+    return response
+
+
+def _file_response(request, name, path, size, etag, last_modified):
+    if _sendfile_backend():
+        return _sendfile_response(name, path)
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    byte_range = None
+    # If-Range与当前版本不一致时忽略Range，返回整个文件
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+
+    start, end = byte_range
+    response = StreamingHttpResponse(_read_range(path, start, end), status=206, content_type=content_type)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
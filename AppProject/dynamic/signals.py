@@ -0,0 +1,69 @@
+"""
+动态模块的信号处理：关注关系变化时同步更新首页时间线；删除媒体时释放其引用的去重文件并删除衍生文件；
+删除动态时移除其搜索索引。
+
+关注关系存储在CustomUser.followers这个自关联多对多字段上，user.following.add()/remove()
+和user.followers.add()/remove()都会触发m2m_changed信号，这里统一换算成(关注者, 被关注者)二元组处理。
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+
+from . import blobs, derivatives, search, timeline
+from .models import Media, Post
+
+
+def _follow_pairs(instance, reverse, pk_set):
+    """
+    把m2m_changed的参数换算为(关注者ID, 被关注者ID)列表
+    """
+    if reverse:
+        # instance.following.add(...)：instance关注了pk_set中的用户
+        return [(instance.pk, pk) for pk in pk_set]
+    # instance.followers.add(...)：pk_set中的用户关注了instance
+    return [(pk, instance.pk) for pk in pk_set]
+
+
+def _apply(pairs, followed):
+    if not pairs:
+        return
+    timeline.follows_changed(pairs, followed)
+    # 粉丝数发生变化的用户需要重新判断推/拉模式
+    timeline.refresh_pull_authors({followee_id for _, followee_id in pairs})
+
+
+@receiver(m2m_changed, sender=get_user_model().followers.through)
+def follow_relation_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add':
+        _apply(_follow_pairs(instance, reverse, pk_set), followed=True)
+    elif action == 'post_remove':
+        _apply(_follow_pairs(instance, reverse, pk_set), followed=False)
+    elif action == 'pre_clear':
+        # clear()之后就无法知道删除了哪些关系，所以在清空之前处理
+        field = 'following' if reverse else 'followers'
+        pk_set = getattr(instance, field).values_list('pk', flat=True)
+        instance._cleared_follow_pairs = _follow_pairs(instance, reverse, pk_set)
+    elif action == 'post_clear':
+        _apply(getattr(instance, '_cleared_follow_pairs', []), followed=False)
+
+
+@receiver(post_delete, sender=Media)
+def release_media_blob(sender, instance, **kwargs):
+    # 删除动态时级联删除的媒体同样会触发
+    if instance.blob_id:
+        blobs.release(instance.blob_id)
+
+
+@receiver(post_delete, sender=Media)
+def delete_media_derivatives(sender, instance, **kwargs):
+    # 衍生文件不共享，事务提交后再删除，回滚时文件仍然可用
+    names = [item['file_path'] for item in instance.derivatives]
+    if names:
+        transaction.on_commit(lambda: derivatives.delete_files(names))
+
+
+@receiver(pre_delete, sender=Post)
+def remove_post_from_search(sender, instance, **kwargs):
+    # 倒排项会随动态级联删除，这里在删除之前减少词项的文档频率；删除用户时级联删除的动态同样会触发
+    search.remove_post(instance.id)
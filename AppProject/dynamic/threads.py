@@ -0,0 +1,95 @@
+"""
+评论树（楼中楼）的读取。
+
+Comment.parent是邻接表，逐层展开回复需要每一层一次查询。这里借助Comment.path物化路径：
+同一条动态的评论按path排序就是整棵树的先序遍历，某条评论的子树是path落在[path, path + '~')区间内的评论，
+因此读取一页根评论及其前K条回复、或者分页读取任意一棵子树，查询次数都是固定的，与树的深度和规模无关。
+分页游标为上一页最后一条评论的path，翻页时走(post, path)索引的范围扫描。
+"""
+from collections import defaultdict
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber, Substr
+
+from .models import Comment, COMMENT_PATH_SEGMENT_LENGTH
+from .pagination import encode_cursor, paginate_by_cursor
+
+CURSOR_FIELDS = ('path',)
+
+# 大于路径中出现的所有字符（数字和'/'），path + SUBTREE_END 是子树区间的上界
+SUBTREE_END = '~'
+
+
+def comment_queryset():
+    """
+    用于展示的评论查询集，只取需要的列并预加载评论者
+    """
+    return (Comment.objects
+            .select_related('user')
+            .only('id', 'post_id', 'parent_id', 'content', 'created_at', 'path', 'depth',
+                  'like_count', 'reply_count', 'user__username'))
+
+
+def serialize_comment(comment):
+    return {
+        'id': comment.id,
+        'user': comment.user.username,
+        'content': comment.content,
+        'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'parent_id': comment.parent_id,
+        'depth': comment.depth,
+        'like_count': comment.like_count,
+        'reply_count': comment.reply_count,
+    }
+
+
+def root_comments(post_id, cursor, limit):
+    """
+    按发表顺序分页读取一条动态的根评论
+
+    :return: (根评论列表, 下一页游标或None)
+    """
+    roots = comment_queryset().filter(post_id=post_id, depth=0)
+    return paginate_by_cursor(roots, cursor, limit, fields=CURSOR_FIELDS, descending=False)
+
+
+def first_replies(post_id, roots, count):
+    """
+    一次查询取出每条根评论子树中按先序遍历的前count条回复。
+    用窗口函数按根评论分组编号，每组多取一条用于判断子树是否还有更多回复。
+
+    :return: {根评论ID: (回复列表, 继续读取该子树的游标或None)}
+    """
+    if not roots or count <= 0:
+        return {root.id: ([], encode_cursor([root.path]) if root.reply_count else None) for root in roots}
+
+    root_ids = {root.path: root.id for root in roots}
+    root_path = Substr('path', 1, COMMENT_PATH_SEGMENT_LENGTH)
+    replies = (comment_queryset()
+               .filter(post_id=post_id, depth__gt=0,
+                       path__gt=roots[0].path, path__lt=roots[-1].path + SUBTREE_END)
+               .annotate(root_path=root_path,
+                         rank=Window(RowNumber(), partition_by=[root_path], order_by=F('path').asc()))
+               .filter(root_path__in=list(root_ids), rank__lte=count + 1)
+               .order_by('path'))
+
+    grouped = defaultdict(list)
+    for reply in replies:
+        grouped[root_ids[reply.root_path]].append(reply)
+    result = {}
+    for root in roots:
+        items = grouped[root.id]
+        next_cursor = encode_cursor([items[count - 1].path]) if len(items) > count else None
+        result[root.id] = (items[:count], next_cursor)
+    return result
+
+
+def subtree(comment, cursor, limit):
+    """
+    按先序遍历分页读取一条评论的全部后代（不含其自身）
+
+    :return: (评论列表, 下一页游标或None)
+    """
+    descendants = comment_queryset().filter(post_id=comment.post_id, path__gt=comment.path,
+                                            path__lt=comment.path + SUBTREE_END)
+    return paginate_by_cursor(descendants, cursor, limit, fields=CURSOR_FIELDS, descending=False)
@@ -0,0 +1,361 @@
+"""
+首页时间线（"我关注的人的动态"），采用推拉结合的模式。
+
+推（fan-out-on-write）：普通用户发布动态时，把动态ID推送到发布者本人和每个粉丝的时间线中；
+读取时直接从预先计算好的时间线按时间倒序取出，不需要在请求时关联关注表和动态表。
+每条时间线的长度有上限，超出的旧记录会被裁剪。删除动态、关注和取消关注时会同步更新时间线（关注/取消关注见signals.py）。
+
+拉（fan-out-on-read）：园区工作人员、官方账号等粉丝数超过settings.TIMELINE_PULL_FOLLOWER_THRESHOLD的账号，
+发布时只写入本人的时间线，不再逐个推送给粉丝，发布耗时因此不随粉丝数增长。
+读取时再按(created_at, id)倒序分别拉取当前用户关注的这些账号的动态，与推送得到的时间线做多路归并。
+
+时间线的存储后端可以替换，通过settings.TIMELINE_BACKEND配置：
+DatabaseTimelineBackend：存储在TimelineEntry表中，默认使用。
+InMemoryTimelineBackend：存储在进程内存中，用于测试或单进程开发环境。
+"""
+import bisect
+import threading
+from collections import defaultdict
+import heapq
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count, Q
+from django.utils.module_loading import import_string
+
+from .models import Post, TimelineEntry, TimelinePullAuthor
+from .pagination import decode_cursor, encode_cursor, paginate_by_cursor
+
+# 时间线的游标按(发布时间, 动态ID)编码，两种存储后端通用
+CURSOR_FIELDS = ('created_at', 'post_id')
+
+
+class BaseTimelineBackend:
+    """
+    时间线存储后端的接口。时间线条目为(created_at, post_id, author_id)三元组，按(created_at, post_id)倒序排列。
+    """
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+
+    def push(self, entry, user_ids):
+        """
+        把一条动态推送到多个用户的时间线
+        """
+        raise NotImplementedError
+
+    def extend(self, user_id, entries):
+        """
+        把多条动态加入一个用户的时间线（例如关注某人后回填其近期动态）
+        """
+        raise NotImplementedError
+
+    def remove_post(self, post_id):
+        """
+        从所有时间线中移除一条动态
+        """
+        raise NotImplementedError
+
+    def remove_author(self, user_id, author_id):
+        """
+        从一个用户的时间线中移除某个作者的全部动态（取消关注时使用）
+        """
+        raise NotImplementedError
+
+    def remove_authors(self, user_id, author_ids):
+        """
+        从一个用户的时间线中移除多个作者的全部动态（批量取消关注时使用）
+        """
+        for author_id in author_ids:
+            self.remove_author(user_id, author_id)
+
+    def trim_all(self, chunk_size=1000):
+        """
+        把所有超出长度上限的时间线裁剪到max_length，由trim_timelines命令定期执行
+
+        :return: 裁剪的时间线条数
+        """
+        return 0
+
+    def read(self, user_id, cursor, limit):
+        """
+        读取一页时间线
+
+        :return: ([(created_at, post_id), ...], 下一页游标或None)
+        """
+        raise NotImplementedError
+
+
+class DatabaseTimelineBackend(BaseTimelineBackend):
+    """
+    基于TimelineEntry表的时间线存储。推送使用bulk_create批量写入，不逐个计数裁剪，发布耗时只与粉丝数有关；
+    裁剪在读取第一页和回填之后进行，活跃用户的时间线长度不超过max_length。
+    从不读取首页的用户的时间线由trim_timelines命令定期裁剪（见trim_all()）。
+    """
+    batch_size = 1000
+
+    def push(self, entry, user_ids):
+        created_at, post_id, _ = entry
+        TimelineEntry.objects.bulk_create(
+            (TimelineEntry(owner_id=user_id, post_id=post_id, created_at=created_at) for user_id in user_ids),
+            batch_size=self.batch_size, ignore_conflicts=True)
+
+    def extend(self, user_id, entries):
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=user_id, post_id=post_id, created_at=created_at)
+             for created_at, post_id, _ in entries[:self.max_length]],
+            batch_size=self.batch_size, ignore_conflicts=True)
+        # 多次关注各回填max_length条，合起来会超出上限
+        self.trim(user_id)
+
+    def remove_post(self, post_id):
+        TimelineEntry.objects.filter(post_id=post_id).delete()
+
+    def remove_author(self, user_id, author_id):
+        TimelineEntry.objects.filter(owner_id=user_id, post__user_id=author_id).delete()
+
+    def remove_authors(self, user_id, author_ids):
+        TimelineEntry.objects.filter(owner_id=user_id, post__user_id__in=list(author_ids)).delete()
+
+    def trim(self, user_id):
+        """
+        删除超出长度上限的旧条目：先找到第max_length+1条的位置，再删除它及更旧的条目
+        """
+        entries = TimelineEntry.objects.filter(owner_id=user_id)
+        boundary = list(entries.order_by('-created_at', '-post_id')
+                        .values_list('created_at', 'post_id')[self.max_length:self.max_length + 1])
+        if boundary:
+            created_at, post_id = boundary[0]
+            entries.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, post_id__lte=post_id)).delete()
+
+    def trim_all(self, chunk_size=1000):
+        owners = get_user_model().objects.order_by('pk').values_list('pk', flat=True)
+        trimmed = 0
+        last_id = 0
+        while True:
+            ids = list(owners.filter(pk__gt=last_id)[:chunk_size])
+            if not ids:
+                return trimmed
+            # 一条分组计数找出这一块用户中超出长度上限的时间线
+            oversized = (TimelineEntry.objects.filter(owner_id__in=ids).values('owner_id')
+                         .annotate(size=Count('*')).filter(size__gt=self.max_length)
+                         .values_list('owner_id', flat=True))
+            for user_id in oversized:
+                self.trim(user_id)
+                trimmed += 1
+            last_id = ids[-1]
+
+    def read(self, user_id, cursor, limit):
+        if not cursor:
+            self.trim(user_id)
+        entries = TimelineEntry.objects.filter(owner_id=user_id).values('created_at', 'post_id')
+        items, next_cursor = paginate_by_cursor(entries, cursor, limit, fields=CURSOR_FIELDS)
+        return [(item['created_at'], item['post_id']) for item in items], next_cursor
+
+
+class InMemoryTimelineBackend(BaseTimelineBackend):
+    """
+    进程内的时间线存储，每个用户的时间线是一个按(created_at, post_id)升序排列的列表，
+    插入时立即裁剪。数据不在进程间共享，仅用于测试和单进程开发环境。
+    """
+
+    def __init__(self, max_length):
+        super().__init__(max_length)
+        self._timelines = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _insert(self, timeline, entry):
+        index = bisect.bisect_left(timeline, entry)
+        if index < len(timeline) and timeline[index][:2] == entry[:2]:
+            return
+        timeline.insert(index, entry)
+        if len(timeline) > self.max_length:
+            del timeline[:len(timeline) - self.max_length]
+
+    def push(self, entry, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._insert(self._timelines[user_id], tuple(entry))
+
+    def extend(self, user_id, entries):
+        with self._lock:
+            timeline = self._timelines[user_id]
+            for entry in entries:
+                self._insert(timeline, tuple(entry))
+
+    def remove_post(self, post_id):
+        with self._lock:
+            for user_id, timeline in self._timelines.items():
+                self._timelines[user_id] = [entry for entry in timeline if entry[1] != post_id]
+
+    def remove_author(self, user_id, author_id):
+        with self._lock:
+            timeline = self._timelines.get(user_id, [])
+            self._timelines[user_id] = [entry for entry in timeline if entry[2] != author_id]
+
+    def remove_authors(self, user_id, author_ids):
+        author_ids = set(author_ids)
+        with self._lock:
+            timeline = self._timelines.get(user_id, [])
+            self._timelines[user_id] = [entry for entry in timeline if entry[2] not in author_ids]
+
+    def read(self, user_id, cursor, limit):
+        with self._lock:
+            timeline = list(self._timelines.get(user_id, []))
+        end = len(timeline)
+        if cursor:
+            created_at, post_id = decode_cursor(cursor, TimelineEntry, CURSOR_FIELDS)
+            end = bisect.bisect_left(timeline, (created_at, post_id))
+        page = timeline[max(end - limit, 0):end][::-1]
+        next_cursor = encode_cursor(page[-1][:2]) if end > limit else None
+        return [entry[:2] for entry in page], next_cursor
+
+    def clear(self):
+        with self._lock:
+            self._timelines.clear()
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path, max_length):
+    return import_string(path)(max_length)
+
+
+def get_timeline_backend():
+    """
+    返回当前配置的时间线存储后端（每种配置只实例化一次）
+    """
+    return _load_backend(getattr(settings, 'TIMELINE_BACKEND', 'dynamic.timeline.DatabaseTimelineBackend'),
+                         getattr(settings, 'TIMELINE_MAX_LENGTH', 800))
+
+
+def _followers(user_id):
+    # 直接查询关注关系的中间表，不需要加载用户对象
+    through = get_user_model().followers.through
+    return through.objects.filter(from_customuser_id=user_id)
+
+
+def _pull_threshold():
+    return getattr(settings, 'TIMELINE_PULL_FOLLOWER_THRESHOLD', 10000)
+
+
+def is_pull_author(user_id):
+    """
+    该用户发布的动态是否改为读取时拉取
+    """
+    return TimelinePullAuthor.objects.filter(user_id=user_id).exists()
+
+
+def _push_threshold():
+    # 拉模式账号的粉丝数降到该值以下才恢复推模式，阈值附近的账号不会随关注和取消关注反复切换
+    return _pull_threshold() * (1 - getattr(settings, 'TIMELINE_PULL_HYSTERESIS', 0.1))
+
+
+def refresh_pull_authors(user_ids):
+    """
+    粉丝数变化后重新判断这些用户应采用推模式还是拉模式：粉丝数超过TIMELINE_PULL_FOLLOWER_THRESHOLD时改为拉模式，
+    降到阈值的(1 - TIMELINE_PULL_HYSTERESIS)倍以下时才恢复推模式。
+    粉丝数读取CustomUser上的冗余字段follower_count，它由authAPP的信号在同一事务中更新，
+    authAPP在INSTALLED_APPS中排在前面，其信号处理先于本模块执行。查询次数与用户数无关。
+
+    拉模式期间发布的动态只写入了作者本人的时间线，恢复推模式后不再在读取时拉取，
+    所以按关注时回填的方式把作者的近期动态回填到每个粉丝的时间线中（只在切换时发生一次，查询次数与粉丝数成正比）。
+    """
+    user_ids = set(user_ids)
+    counts = dict(get_user_model().objects.filter(pk__in=user_ids).values_list('pk', 'follower_count'))
+    current = set(TimelinePullAuthor.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+    pull = {user_id for user_id, count in counts.items()
+            if count > _pull_threshold() or (user_id in current and count >= _push_threshold())}
+    TimelinePullAuthor.objects.bulk_create([TimelinePullAuthor(user_id=user_id) for user_id in pull - current],
+                                           ignore_conflicts=True)
+    demoted = current - pull
+    if demoted:
+        TimelinePullAuthor.objects.filter(user_id__in=demoted).delete()
+        through = get_user_model().followers.through
+        follows_changed(list(through.objects.filter(from_customuser_id__in=demoted)
+                             .values_list('to_customuser_id', 'from_customuser_id')), followed=True)
+
+
+def refresh_pull_author(user_id):
+    refresh_pull_authors([user_id])
+
+
+def fan_out_post(post):
+    """
+    把新发布的动态推送到发布者本人的时间线；发布者不是拉模式账号时，再推送到所有粉丝的时间线
+    """
+    backend = get_timeline_backend()
+    entry = (post.created_at, post.id, post.user_id)
+    backend.push(entry, [post.user_id])
+    if not is_pull_author(post.user_id):
+        backend.push(entry, _followers(post.user_id).values_list('to_customuser_id', flat=True).iterator())
+
+
+def remove_post(post_id):
+    """
+    从所有时间线中移除被删除的动态
+    """
+    get_timeline_backend().remove_post(post_id)
+
+
+def follows_changed(pairs, followed):
+    """
+    关注时回填被关注者的近期动态（拉模式账号的动态在读取时拉取，不需要回填），取消关注时移除被关注者的动态。
+    同一关注者的多条变化合并处理：时间线只保留最新的max_length条，所以回填时一次取出这些被关注者合起来最新的max_length条即可
+
+    :param pairs: [(关注者ID, 被关注者ID)]
+    """
+    backend = get_timeline_backend()
+    followees = defaultdict(set)
+    for follower_id, followee_id in pairs:
+        followees[follower_id].add(followee_id)
+    if not followed:
+        for follower_id, author_ids in followees.items():
+            backend.remove_authors(follower_id, author_ids)
+        return
+    pull = set(TimelinePullAuthor.objects.filter(user_id__in={followee_id for _, followee_id in pairs})
+               .values_list('user_id', flat=True))
+    for follower_id, author_ids in followees.items():
+        author_ids = author_ids - pull
+        if author_ids:
+            entries = (Post.objects.filter(user_id__in=author_ids).order_by('-created_at', '-id')
+                       .values_list('created_at', 'id', 'user_id')[:backend.max_length])
+            backend.extend(follower_id, list(entries))
+
+
+def _pull_entries(author_id, cursor_values, limit):
+    posts = Post.objects.filter(user_id=author_id)
+    if cursor_values:
+        created_at, post_id = cursor_values
+        posts = posts.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=post_id))
+    return list(posts.order_by('-created_at', '-id').values_list('created_at', 'id')[:limit])
+
+
+def read_home_timeline(user_id, cursor, limit):
+    """
+    读取用户的首页时间线：推送得到的时间线与所关注的拉模式账号的动态按(created_at, id)倒序做多路归并。
+    每一路最多取limit+1条，归并后取前limit条，因此每页的查询次数只与关注的拉模式账号数有关。
+
+    :return: (动态ID列表, 下一页游标或None)
+    """
+    pushed, pushed_next = get_timeline_backend().read(user_id, cursor, limit)
+
+    # 当前用户关注的拉模式账号（自己的动态已推送到自己的时间线，不需要再拉取）
+    pull_author_ids = (TimelinePullAuthor.objects
+                       .filter(user__followers__id=user_id).exclude(user_id=user_id)
+                       .values_list('user_id', flat=True))
+    cursor_values = decode_cursor(cursor, TimelineEntry, CURSOR_FIELDS) if cursor else None
+    # 拉取的每一路多取一条，用于判断是否还有下一页
+    streams = [pushed] + [_pull_entries(author_id, cursor_values, limit + 1) for author_id in pull_author_ids]
+
+    # 账号切换为拉模式之前推送的动态可能同时出现在两路中，归并时去重
+    entries, seen = [], set()
+    for created_at, post_id in heapq.merge(*streams, reverse=True):
+        if post_id not in seen:
+            seen.add(post_id)
+            entries.append((created_at, post_id))
+
+    page = entries[:limit]
+    has_more = len(entries) > limit or pushed_next is not None
+    next_cursor = encode_cursor(page[-1]) if has_more and page else None
+    return [post_id for _, post_id in page], next_cursor
@@ -0,0 +1,136 @@
+"""
+可续传的分块上传。
+
+publish_content一次multipart请求上传全部媒体文件，在园区的弱网络下大视频很容易中途失败并从头重传，
+上传期间还一直占用一个worker。这里把上传拆成会话：
+1. 创建会话时声明文件名、大小和类型，服务端在settings.UPLOAD_SESSION_DIR下创建一个空的临时文件；
+2. 客户端按顺序提交分块（请求体为原始字节，offset指明写入位置），服务端从请求流中按固定大小的缓冲区
+   边读边写入临时文件，不在内存中缓存整个分块，内存占用与文件和分块大小无关；
+3. 中断后客户端查询会话的received，从该位置继续上传；
+4. 全部字节到齐后，发布动态时通过upload_ids引用会话，临时文件按内容去重（见blobs.py）：
+   已有相同内容的文件时直接引用，否则移动（同一文件系统上为rename，不复制数据）到媒体存储，然后创建Media。
+   会话在发布动态的事务中用select_for_update锁定并检查状态（claim），同一个会话只能挂到一条动态上；
+   临时文件在事务提交之后才移动或删除，发布失败回滚时会话和临时文件保持原样，客户端可以重试。
+"""
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import blobs
+from .models import Media, UploadSession
+
+# 从请求流读取、写入磁盘时使用的缓冲区大小
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """
+    分块无法写入时抛出，status为建议返回给客户端的HTTP状态码
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _session_dir():
+    return getattr(settings, 'UPLOAD_SESSION_DIR', os.path.join(settings.BASE_DIR, 'upload_sessions'))
+
+
+def max_upload_size():
+    return getattr(settings, 'UPLOAD_MAX_SIZE', 1024 * 1024 * 1024)
+
+
+def session_path(session):
+    return os.path.join(_session_dir(), f'{session.id}.part')
+
+
+def create_session(user, filename, size, content_type):
+    """
+    创建上传会话和对应的空临时文件
+    """
+    media_type = 'image' if content_type.startswith('image/') else 'video'
+    session = UploadSession.objects.create(user=user, filename=os.path.basename(filename)[:255],
+                                           media_type=media_type, size=size)
+    os.makedirs(_session_dir(), exist_ok=True)
+    open(session_path(session), 'wb').close()
+    return session
+
+
+def write_chunk(session, stream, offset, length):
+    """
+    把请求流中的length个字节写入临时文件的offset处。
+
+    offset不能超过已经收到的字节数（否则中间会留下空洞）；小于已收到的字节数时视为客户端重传，覆盖写入即可。
+    received用GREATEST条件更新，并发重传同一分块时不会回退。
+
+    :return: 写入后已经收到的字节数
+    """
+    if session.status != UploadSession.STATUS_ACTIVE:
+        raise UploadError('Upload is already attached.', status=409)
+    if offset > session.received:
+        raise UploadError(f'Expected offset {session.received}.', status=409)
+    if offset + length > session.size:
+        raise UploadError('Chunk exceeds the declared file size.')
+
+    written = 0
+    with open(session_path(session), 'r+b') as part:
+        part.seek(offset)
+        while written < length:
+            data = stream.read(min(STREAM_BUFFER_SIZE, length - written))
+            if not data:
+                break
+            part.write(data)
+            written += len(data)
+    # 连接中途断开时written小于length：已写入的字节仍然有效，客户端可以从新的位置继续
+    end = offset + written
+    # update()不会刷新auto_now字段，显式写入updated_at：清理命令按它判断会话最近一次收到分块的时间
+    UploadSession.objects.filter(id=session.id).update(received=Greatest('received', Value(end)),
+                                                       updated_at=timezone.now())
+    session.received = max(session.received, end)
+    return session.received
+
+
+def claim(user, upload_ids):
+    """
+    在发布动态的事务中锁定要挂到动态上的会话：必须属于user、已经上传完成且还没有挂到动态上。
+    并发或重试的发布请求在行锁上排队，拿到锁时会话已经是attached状态，不会把同一个会话挂到两条动态上
+
+    :return: 会话列表；有会话不满足条件时返回None
+    :raises ValidationError: upload_ids中有不合法的UUID
+    """
+    sessions = list(UploadSession.objects.select_for_update()
+                    .filter(id__in=upload_ids, user=user, status=UploadSession.STATUS_ACTIVE, received=F('size'))
+                    .order_by('id'))
+    if len(sessions) != len(set(upload_ids)):
+        return None
+    return sessions
+
+
+def attach(session, post):
+    """
+    把claim()锁定的会话转存为post的媒体文件。临时文件在事务提交之后移入媒体存储，已有相同内容的文件时删除
+
+    :return: 新建的Media
+    """
+    blob = blobs.acquire_path(session_path(session), session.filename)
+    media = Media.objects.create(post=post, media_type=session.media_type, file_path=blob.file.name, blob=blob)
+    UploadSession.objects.filter(id=session.id).update(status=UploadSession.STATUS_ATTACHED, media=media)
+    # 在acquire_path()登记的移动之后执行，文件已经被移走时什么也不做
+    transaction.on_commit(lambda: discard(session))
+    return media
+
+
+def discard(session):
+    """
+    删除会话的临时文件（文件可能已经被移走）
+    """
+    try:
+        os.remove(session_path(session))
+    except FileNotFoundError:
+        pass
@@ -7,18 +7,30 @@ from . import views
 
 urlpatterns = [
     path('publish_content/', views.publish_content, name='publish_content'),
+    path('upload_sessions/', views.create_upload_session, name='create_upload_session'),
+    path('upload_sessions/<uuid:upload_id>/', views.upload_status, name='upload_status'),
+    path('upload_sessions/<uuid:upload_id>/chunk/', views.upload_chunk, name='upload_chunk'),
     path('edit_content/<int:content_id>/', views.edit_content, name='edit_content'),
     path('delete_content/<int:content_id>/', views.delete_content, name='delete_content'),
     path('list_content/', views.list_content, name='list_content'),
+    path('home_timeline/', views.home_timeline, name='home_timeline'),
     path('content_detail/<int:content_id>/', views.get_content_detail, name='get_content_detail'),
+    path('search/', views.search_posts, name='search'),
+    path('recommend/<int:user_id>/', views.recommend, name='recommend'),
+    path('cache_stats/', views.cache_stats, name='cache_stats'),
+    path('media/<int:media_id>/', views.serve_media, name='serve_media'),
     path('publish_comment/<int:post_id>/', views.publish_comment, name='publish_comment'),
+    path('comment_thread/<int:post_id>/', views.comment_thread, name='comment_thread'),
+    path('comment_subtree/<int:comment_id>/', views.comment_subtree, name='comment_subtree'),
     path('like_comment/<int:comment_id>/', views.like_comment, name='like_comment'),
     path('unlike_comment/<int:comment_id>/', views.unlike_comment, name='unlike_comment'),
     path('like_post/<int:post_id>/', views.like_post, name='like_post'),
     path('unlike_post/<int:post_id>/', views.unlike_post, name='unlike_post'),
+    path('like_posts/', views.like_posts, name='like_posts'),
+    path('notifications/', views.list_notifications, name='list_notifications'),
+    path('notifications/unread_count/', views.unread_notification_count, name='unread_notification_count'),
+    path('notifications/mark_read/', views.mark_notifications_read, name='mark_notifications_read'),
 
     # path('follow_user/<int:user_id>/', views.follow_user, name='follow_user'),
     # path('unfollow_user/<int:user_id>/', views.unfollow_user, name='unfollow_user'),
-    # path('search/', views.search, name='search'),
-    # path('recommend/<int:user_id>/', views.recommend, name='recommend'),
 ]
\ No newline at end of file
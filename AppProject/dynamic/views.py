@@ -1,17 +1,30 @@
+import hashlib
+
 from django.shortcuts import render
 
 """
 包含应用程序的视图函数，处理请求并返回响应，实现应用程序的业务逻辑。
 """
 # Create your views here.
-from django.http import JsonResponse, HttpResponseNotFound, HttpResponseForbidden
+from django.http import JsonResponse, HttpResponseNotFound, HttpResponseForbidden, HttpResponseRedirect
 from django import forms
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
 from django.contrib.auth.decorators import login_required
-from .models import Post, Media, Comment, CommentLike, Notification, PostLike
+from .models import Post, Media, Comment, CommentLike, PostLike, UploadSession, COMMENT_MAX_DEPTH
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from .pagination import paginate_by_cursor, InvalidCursor
+from .params import parse_ids
+from .serializers import parse_width, post_queryset, serialize_post, serialize_posts
+from . import blobs, derivatives, post_cache, recommendations, search, serving, threads, timeline, uploads
+from .notifications import (notify, notify_many, notification_queryset, serialize_notifications,
+                            unread_count, mark_read)
 from django.views.decorators.csrf import csrf_exempt
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
 
 
 class PostForm(forms.ModelForm):
@@ -38,26 +51,112 @@ def publish_content(request):
     获取文本内容：从POST请求中获取文本内容。如果没有提供内容，则默认为空字符串。
     创建Post实例：使用请求中的文本内容和当前登录的用户信息创建一个新的Post实例。
     处理媒体文件：从请求中获取名为media_files的文件列表。对于每个文件，根据其MIME类型判断是图片还是视频，并为每个文件创建一个Media实例，关联到刚创建的Post实例。
+    分块上传：大文件可以先通过上传会话（见uploads.py）分块上传，再在upload_ids中传入会话ID，已上传完成的文件会挂到新动态上。
+    事务：动态、媒体、上传会话的状态、时间线和搜索索引在一个事务中写入，任何一步失败都整体回滚，不会留下没有媒体的动态。
     响应：返回一个JSON响应，包含操作成功的消息和新创建的Post的ID。
     """
+    with transaction.atomic():
+        return _publish_content(request)
+
+
+def _publish_content(request):
     # 获取文本内容
     content = request.POST.get('content', '')
 
+    # 引用的上传会话必须属于当前用户且已经上传完成，锁定之后其他发布请求不能再使用
+    try:
+        sessions = uploads.claim(request.user, request.POST.getlist('upload_ids'))
+    except ValidationError:
+        return JsonResponse({'message': 'Invalid upload_ids.'}, status=400)
+    if sessions is None:
+        return JsonResponse({'message': 'Upload not found or not complete.'}, status=400)
+
     # 创建Post实例
     post = Post.objects.create(user=request.user, content=content)
 
     # 处理媒体文件
+    media_ids = []
     media_files = request.FILES.getlist('media_files')  # 假设前端字段名为'media_files'
     for file in media_files:
         # 简单示例，实际应用中可能需要根据文件类型进行更复杂的处理
         media_type = 'image' if file.content_type.startswith('image/') else 'video'
-        Media.objects.create(post=post, media_type=media_type, file_path=file)
+        # 相同内容的文件只存一份，已经存在时不再写入媒体存储
+        blob = blobs.acquire(file)
+        media_ids.append(Media.objects.create(post=post, media_type=media_type, file_path=blob.file.name,
+                                              blob=blob).id)
+    for session in sessions:
+        media_ids.append(uploads.attach(session, post).id)
+
+    # 事务提交后在后台生成缩略图和预览帧
+    if media_ids:
+        transaction.on_commit(lambda: derivatives.schedule(media_ids))
+
+    # 推送到发布者本人和粉丝的首页时间线
+    timeline.fan_out_post(post)
+    search.index_post(post)
+    post_cache.bump(post.id)
 
     return JsonResponse({'message': 'Content published successfully.', 'post_id': post.id})
 
 
 @login_required
 @require_http_methods(["POST"])
+def create_upload_session(request):
+    """
+    创建分块上传会话：参数为filename、size（字节数）和content_type，返回会话ID
+    """
+    filename = request.POST.get('filename', '').strip()
+    size = request.POST.get('size', '')
+    if not filename or not size.isdigit() or int(size) == 0:
+        return JsonResponse({'message': 'Please provide filename and size.'}, status=400)
+    if int(size) > uploads.max_upload_size():
+        return JsonResponse({'message': 'File is too large.'}, status=400)
+    session = uploads.create_session(request.user, filename, int(size),
+                                     request.POST.get('content_type', 'application/octet-stream'))
+    return JsonResponse({'upload_id': str(session.id), 'size': session.size, 'received': session.received})
+
+
+def _get_upload_session(request, upload_id):
+    return UploadSession.objects.filter(id=upload_id, user=request.user).first()
+
+
+@login_required
+@require_http_methods(["POST"])
+def upload_chunk(request, upload_id):
+    """
+    上传一个分块：请求体为原始字节（Content-Type: application/octet-stream），?offset=为分块在文件中的位置。
+    请求体按固定大小的缓冲区边读边写入临时文件，不会整体读入内存。
+    offset与服务端记录的received不一致时返回409和received，客户端据此续传。
+    """
+    session = _get_upload_session(request, upload_id)
+    if session is None:
+        return JsonResponse({'message': 'Upload not found.'}, status=404)
+    offset = request.GET.get('offset', '')
+    length = request.META.get('CONTENT_LENGTH', '')
+    if not offset.isdigit() or not length.isdigit():
+        return JsonResponse({'message': 'Please provide offset and Content-Length.'}, status=400)
+    try:
+        received = uploads.write_chunk(session, request, int(offset), int(length))
+    except uploads.UploadError as e:
+        return JsonResponse({'message': e.message, 'received': session.received}, status=e.status)
+    return JsonResponse({'upload_id': str(session.id), 'size': session.size, 'received': received})
+
+
+@login_required
+def upload_status(request, upload_id):
+    """
+    查询上传会话已经收到的字节数，断线重连后从该位置继续上传
+    """
+    session = _get_upload_session(request, upload_id)
+    if session is None:
+        return JsonResponse({'message': 'Upload not found.'}, status=404)
+    return JsonResponse({'upload_id': str(session.id), 'size': session.size, 'received': session.received,
+                         'status': session.status})
+
+
+@login_required
+@require_http_methods(["POST"])
+@transaction.atomic  # 动态内容和搜索索引一起提交或回滚
 def edit_content(request, content_id):  # 修改参数名为content_id以匹配URL模式
     # 尝试获取要编辑的Post实例
     try:
@@ -70,6 +169,8 @@ def edit_content(request, content_id):  # 修改参数名为content_id以匹配U
     if content:
         post.content = content
         post.save()
+        search.index_post(post)
+        post_cache.bump(post.id)
         return JsonResponse({'message': 'Content updated successfully.'})
     else:
         return JsonResponse({'message': 'No content provided.'}, status=400)
@@ -87,12 +188,38 @@ def delete_content(request, content_id):
     if post.user != request.user:
         return HttpResponseForbidden({'message': 'You do not have permission to delete this post.'})
 
+    timeline.remove_post(post.id)
     post.delete()
+    post_cache.bump(content_id)
     return JsonResponse({'message': 'Post deleted successfully.'})
 
 
+def _list_content_etag(request):
+    # 动态列表版本号加上分页参数，不访问数据库；版本号不能在进程之间共享时不带ETag
+    if not post_cache.shared_cache():
+        return None
+    return hashlib.md5(f'{post_cache.feed_version()}?{request.GET.urlencode()}'.encode()).hexdigest()
+
+
+@condition(etag_func=_list_content_etag)
 def list_content(request):
-    posts_list = Post.objects.all().order_by('-created_at')  # 获取所有动态并按创建时间降序排序
+    """
+    动态列表，支持两种分页方式：
+    页码模式（默认）：?page=N，使用Paginator，会执行COUNT(*)并通过OFFSET定位，翻页越深越慢。
+    游标模式：只要请求中带有cursor参数（第一页传空字符串）即启用，按(created_at, id)进行keyset分页，
+    不执行COUNT(*)，任意深度的翻页都是一次索引范围扫描。响应中的next_cursor为null表示没有更多数据。
+    两种模式都带有ETag（动态列表版本号），轮询时带上If-None-Match，没有变化则直接返回304，不查询数据库。
+    """
+    posts_list = post_queryset().order_by('-created_at', '-id')  # 获取所有动态并按创建时间降序排序
+
+    if 'cursor' in request.GET:
+        try:
+            posts, next_cursor = paginate_by_cursor(posts_list, request.GET.get('cursor'), 10)
+        except InvalidCursor:
+            return JsonResponse({'message': 'Invalid cursor.'}, status=400)
+        posts_data = serialize_posts(posts, parse_width(request))
+        return JsonResponse({'posts': posts_data, 'next_cursor': next_cursor})
+
     page = request.GET.get('page', 1)  # 从请求的查询参数中获取页码
     paginator = Paginator(posts_list, 10)  # 每页显示10条动态
 
@@ -105,45 +232,118 @@ def list_content(request):
         # 如果页码超出范围，展示最后一页
         posts = paginator.page(paginator.num_pages)
 
-    # 将动态数据及其关联的媒体文件序列化为JSON格式
-    posts_data = []
-    for post in posts:
-        media_files = Media.objects.filter(post=post).values('media_type', 'file_path')
-        post_data = {
-            'id': post.id,
-            'user': post.user.username,
-            'content': post.content,
-            'created_at': post.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'media': list(media_files)
-        }
-        posts_data.append(post_data)
+    # 将动态数据及其关联的媒体文件序列化为JSON格式，?width=为客户端显示宽度，用于选择合适的缩略图
+    posts_data = serialize_posts(posts, parse_width(request))
 
     return JsonResponse({'posts': posts_data, 'page': int(page), 'pages': paginator.num_pages}, safe=False)
 
 
-def get_content_detail(request, content_id):
+@login_required
+def home_timeline(request):
+    """
+    首页时间线：当前用户和其关注的人发布的动态，按发布时间倒序，使用游标分页。
+    动态ID直接从预先计算好的时间线中读取，再批量加载动态内容，不在请求时关联关注表。
+    """
     try:
-        # 尝试获取指定ID的动态
-        post = Post.objects.get(id=content_id)
-    except Post.DoesNotExist:
+        post_ids, next_cursor = timeline.read_home_timeline(request.user.id, request.GET.get('cursor'), 10)
+    except InvalidCursor:
+        return JsonResponse({'message': 'Invalid cursor.'}, status=400)
+
+    posts = post_queryset().in_bulk(post_ids)
+    posts_data = serialize_posts((posts[post_id] for post_id in post_ids if post_id in posts), parse_width(request))
+    return JsonResponse({'posts': posts_data, 'next_cursor': next_cursor})
+
+
+def get_content_detail(request, content_id):
+    """
+    动态详情。序列化结果按动态的版本号缓存（见post_cache.py），命中时不访问数据库；
+    响应头X-Cache为HIT或MISS。
+    """
+    width = parse_width(request)
+
+    def build():
+        # 发布者、媒体文件、点赞数和评论数随查询集一起加载
+        post = post_queryset().filter(id=content_id).first()
+        return serialize_post(post, width) if post is not None else None
+
+    post_detail, hit = post_cache.get_or_build(content_id, width, build)
+    if post_detail is None:
         # 如果动态不存在，返回404错误
         return HttpResponseNotFound({'message': 'Post not found.'})
 
-    # 获取与动态相关联的媒体文件信息
-    media_files = Media.objects.filter(post=post).values('media_type', 'file_path')
+    response = JsonResponse(post_detail)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
 
-    # 构建动态的详细信息
-    post_detail = {
-        'id': post.id,
-        'user': post.user.username,
-        'content': post.content,
-        'created_at': post.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-        'media': list(media_files)
-    }
+SEARCH_PAGE_SIZE = 10
+
+
+def search_posts(request):
+    """
+    搜索动态：?q=为查询文本，?page=为页码。结果按BM25得分和发布时间排序（见search.py），
+    排序结果在动态发生变化前会被缓存，翻页不会重新计算。
+    """
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'message': 'Query is required.'}, status=400)
+    page = request.GET.get('page', '1')
+    if not page.isdigit() or int(page) < 1:
+        return JsonResponse({'message': 'Invalid page.'}, status=400)
+    page = int(page)
 
-    # 如果有其他需要包含的信息，比如评论、点赞数等，也可以在这里添加
+    post_ids, has_next = search.search(query, (page - 1) * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE)
+    posts = post_queryset().in_bulk(post_ids)
+    posts_data = serialize_posts((posts[post_id] for post_id in post_ids if post_id in posts), parse_width(request))
+    return JsonResponse({'posts': posts_data, 'page': page, 'has_next': has_next})
 
-    return JsonResponse(post_detail)
+
+RECOMMEND_PAGE_SIZE = 20
+
+
+def recommend(request, user_id):
+    """
+    为用户推荐动态：合并离线计算好的相似动态列表（见recommendations.py），请求中不做矩阵运算
+    """
+    if not get_user_model().objects.filter(id=user_id).exists():
+        return JsonResponse({'message': 'User not found.'}, status=404)
+    post_ids = recommendations.recommend(user_id, RECOMMEND_PAGE_SIZE)
+    posts = post_queryset().in_bulk(post_ids)
+    posts_data = serialize_posts((posts[post_id] for post_id in post_ids if post_id in posts), parse_width(request))
+    return JsonResponse({'posts': posts_data})
+
+
+@login_required
+def cache_stats(request):
+    """
+    动态详情缓存的命中次数、未命中次数和命中率，仅管理员可见
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'message': 'Permission denied.'}, status=403)
+    return JsonResponse({'post_detail': post_cache.stats()})
+
+
+@require_http_methods(["GET", "HEAD"])
+def serve_media(request, media_id):
+    """
+    下载媒体文件，支持Range、ETag和条件请求（见serving.py）。?width=时返回不小于该宽度的最小缩略图。
+    """
+    media = (Media.objects.select_related('blob').only('id', 'file_path', 'derivatives', 'blob__digest')
+             .filter(id=media_id).first())
+    if media is None:
+        return JsonResponse({'message': 'Media not found.'}, status=404)
+    name = derivatives.pick_variant(media, parse_width(request))
+    # 原文件来自去重存储时，摘要已知，不需要重新计算
+    digest = media.blob.digest if media.blob_id and name == media.file_path.name else None
+    try:
+        path = default_storage.path(name)
+    except NotImplementedError:
+        # 非本地存储（对象存储等）由存储服务直接提供下载
+        return HttpResponseRedirect(default_storage.url(name))
+    response = serving.serve_file(request, name, path, digest)
+    if response is None:
+        return JsonResponse({'message': 'Media not found.'}, status=404)
+    return response
 
 
 @login_required
@@ -161,90 +361,145 @@ def publish_comment(request, post_id):
     if not content:
         return JsonResponse({'message': 'Comment content cannot be empty.'}, status=400)
 
-    # 创建评论实例
-    comment = Comment.objects.create(content=content, post=post, user=request.user)
+    # 回复某条评论时，被回复的评论必须属于同一条动态；只取生成物化路径需要的列
+    parent_id = request.POST.get('parent_id')
+    parent = None
+    if parent_id:
+        parent = (Comment.objects.filter(id=parent_id, post=post).only('id', 'path', 'depth').first()
+                  if parent_id.isdigit() else None)
+        if parent is None:
+            return JsonResponse({'message': 'Parent comment not found.'}, status=404)
+        if parent.depth >= COMMENT_MAX_DEPTH - 1:
+            return JsonResponse({'message': 'Comment thread is nested too deeply.'}, status=400)
+
+    with transaction.atomic():
+        # 创建评论实例（保存时写入物化路径），并在同一事务中更新评论数和回复数
+        comment = Comment.objects.create(content=content, post=post, user=request.user, parent=parent)
+        Post.objects.filter(id=post.id).update(comment_count=F('comment_count') + 1)
+        post_cache.bump(post.id)
+        if parent_id:
+            Comment.objects.filter(id=parent_id).update(reply_count=F('reply_count') + 1)
 
     return JsonResponse({'message': 'Comment published successfully.', 'comment_id': comment.id})
 
 
+def _parse_limit(value, default, maximum):
+    """
+    解析每页条数参数，缺省或无法解析时使用默认值，超过上限时截断
+    """
+    if value is None or not value.isdigit():
+        return default
+    return max(1, min(int(value), maximum))
+
+
+def comment_thread(request, post_id):
+    """
+    评论楼：按发表顺序分页返回根评论（?limit=，默认20条），每条根评论附带其子树按先序遍历的前K条回复（?replies=，默认3条）。
+    回复带有parent_id和depth，客户端可据此还原树形结构；replies_cursor不为null时，
+    把它传给comment_subtree继续读取该根评论的其余回复。无论评论树多深，一页只需要固定的三次查询。
+    """
+    if not Post.objects.filter(id=post_id).exists():
+        return JsonResponse({'message': 'Post not found.'}, status=404)
+    limit = _parse_limit(request.GET.get('limit'), 20, 100)
+    replies_param = request.GET.get('replies', '')
+    # replies=0 表示只要根评论
+    reply_count = min(int(replies_param), 20) if replies_param.isdigit() else 3
+
+    try:
+        roots, next_cursor = threads.root_comments(post_id, request.GET.get('cursor'), limit)
+    except InvalidCursor:
+        return JsonResponse({'message': 'Invalid cursor.'}, status=400)
+    replies = threads.first_replies(post_id, roots, reply_count)
+
+    comments_data = []
+    for root in roots:
+        items, replies_cursor = replies[root.id]
+        data = threads.serialize_comment(root)
+        data['replies'] = [threads.serialize_comment(reply) for reply in items]
+        data['replies_cursor'] = replies_cursor
+        comments_data.append(data)
+    return JsonResponse({'comments': comments_data, 'next_cursor': next_cursor})
+
+
+def comment_subtree(request, comment_id):
+    """
+    按先序遍历分页返回某条评论的全部后代（?limit=，默认50条），用于展开大型评论楼。每页两次查询。
+    """
+    comment = Comment.objects.filter(id=comment_id).only('id', 'post_id', 'path').first()
+    if comment is None:
+        return JsonResponse({'message': 'Comment not found.'}, status=404)
+    limit = _parse_limit(request.GET.get('limit'), 50, 200)
+    try:
+        items, next_cursor = threads.subtree(comment, request.GET.get('cursor'), limit)
+    except InvalidCursor:
+        return JsonResponse({'message': 'Invalid cursor.'}, status=400)
+    return JsonResponse({'comments': [threads.serialize_comment(item) for item in items],
+                         'next_cursor': next_cursor})
+
+
 @login_required
 @require_http_methods(["POST"])
 def like_comment(request, comment_id):
-    try:
-        comment = Comment.objects.get(id=comment_id)
-    except Comment.DoesNotExist:
+    # 只取通知需要的评论作者ID
+    owner_id = Comment.objects.filter(id=comment_id).values_list('user_id', flat=True).first()
+    if owner_id is None:
         return JsonResponse({'message': 'Comment not found.'}, status=404)
 
-    # 检查用户是否已经喜欢了这条评论
-    if CommentLike.objects.filter(user=request.user, comment=comment).exists():
+    try:
+        with transaction.atomic():
+            # 依靠(user, comment)唯一约束实现插入或忽略：不事先检查exists()，重复点赞（包括并发的两次点击）
+            # 会在插入时触发IntegrityError，整个事务回滚，点赞数和通知都不会重复
+            CommentLike.objects.create(user=request.user, comment_id=comment_id)
+            Comment.objects.filter(id=comment_id).update(like_count=F('like_count') + 1)
+            # 创建通知（合并到同一评论的未读点赞通知中）
+            notify('like', owner_id, request.user, ContentType.objects.get_for_model(Comment), comment_id)
+    except IntegrityError:
         return JsonResponse({'message': 'You already liked this comment.'}, status=400)
 
-    # 创建喜欢
-    CommentLike.objects.create(user=request.user, comment=comment)
-
-    # 获取评论的ContentType
-    content_type = ContentType.objects.get_for_model(comment)
-    # 创建通知
-    Notification.objects.create(
-        type='like',
-        to_user=comment.user,
-        from_user=request.user,
-        content_type=content_type,
-        object_id=comment.id
-    )
-
     return JsonResponse({'message': 'Comment liked successfully.'})
 
 
 @login_required
 @require_http_methods(["POST"])
 def unlike_comment(request, comment_id):
-    try:
-        # 尝试获取指定ID的评论
-        comment = Comment.objects.get(id=comment_id)
-    except Comment.DoesNotExist:
-        return JsonResponse({'message': 'Comment not found.'}, status=404)
-
-    # 尝试获取并删除点赞记录
-    like_instance = CommentLike.objects.filter(user=request.user, comment=comment).first()
-    if like_instance:
-        like_instance.delete()
+    # 直接删除点赞记录，只有确实删除了记录才减少点赞数
+    with transaction.atomic():
+        deleted, _ = CommentLike.objects.filter(user=request.user, comment_id=comment_id).delete()
+        if deleted:
+            Comment.objects.filter(id=comment_id, like_count__gt=0).update(like_count=F('like_count') - 1)
+    if deleted:
         return JsonResponse({'message': 'Comment unliked successfully.'})
-    else:
-        return JsonResponse({'message': 'You have not liked this comment.'}, status=400)
+
+    # 没有删除任何记录时，再区分评论不存在和尚未点赞两种情况
+    if not Comment.objects.filter(id=comment_id).exists():
+        return JsonResponse({'message': 'Comment not found.'}, status=404)
+    return JsonResponse({'message': 'You have not liked this comment.'}, status=400)
 
 
 @login_required
 @require_http_methods(["POST"])
 def like_post(request, post_id):
     """
-    点赞喜欢的动态
+    点赞喜欢的动态。点赞记录依靠(user, post)唯一约束去重，重复点赞返回400，不会因为并发而出现500。
     :param request:
     :param post_id:
     :return:
     """
-    try:
-        post = Post.objects.get(id=post_id)
-    except Post.DoesNotExist:
+    # 只取通知需要的发布者ID
+    owner_id = Post.objects.filter(id=post_id).values_list('user_id', flat=True).first()
+    if owner_id is None:
         return JsonResponse({'message': 'Post not found.'}, status=404)
 
-    if PostLike.objects.filter(user=request.user, post=post).exists():
+    try:
+        with transaction.atomic():
+            # 创建点赞记录，并在同一事务中更新点赞数、创建通知；重复点赞会在插入时触发IntegrityError并整体回滚
+            PostLike.objects.create(user=request.user, post_id=post_id)
+            Post.objects.filter(id=post_id).update(like_count=F('like_count') + 1)
+            post_cache.bump(post_id)
+            notify('like', owner_id, request.user, ContentType.objects.get_for_model(Post), post_id)
+    except IntegrityError:
         return JsonResponse({'message': 'You already liked this post.'}, status=400)
 
-    # 创建点赞记录
-    PostLike.objects.create(user=request.user, post=post)
-
-    # 获取动态的ContentType
-    content_type = ContentType.objects.get_for_model(post)
-    # 创建通知
-    Notification.objects.create(
-        type='like',
-        to_user=post.user,
-        from_user=request.user,
-        content_type=content_type,
-        object_id=post.id
-    )
-
     return JsonResponse({'message': 'Post liked successfully.'})
 
 
@@ -257,17 +512,104 @@ def unlike_post(request, post_id):
     :param post_id:
     :return:
     """
-    try:
-        post = Post.objects.get(id=post_id)
-    except Post.DoesNotExist:
+    # 直接删除点赞记录，只有确实删除了记录才减少点赞数
+    with transaction.atomic():
+        deleted, _ = PostLike.objects.filter(user=request.user, post_id=post_id).delete()
+        if deleted:
+            Post.objects.filter(id=post_id, like_count__gt=0).update(like_count=F('like_count') - 1)
+            post_cache.bump(post_id)
+    if deleted:
+        return JsonResponse({'message': 'Post unliked successfully.'})
+
+    # 没有删除任何记录时，再区分动态不存在和尚未点赞两种情况
+    if not Post.objects.filter(id=post_id).exists():
         return JsonResponse({'message': 'Post not found.'}, status=404)
+    return JsonResponse({'message': 'You have not liked this post.'}, status=400)
 
-    like_instance = PostLike.objects.filter(user=request.user, post=post).first()
-    if like_instance:
-        like_instance.delete()
-        return JsonResponse({'message': 'Post unliked successfully.'})
-    else:
-        return JsonResponse({'message': 'You have not liked this post.'}, status=400)
+
+# 批量点赞一次最多处理的动态数
+MAX_BATCH_LIKES = 500
+
+
+@login_required
+@require_http_methods(["POST"])
+def like_posts(request):
+    """
+    批量点赞：客户端离线时积攒的点赞在联网后一次提交。所有点赞在一个事务中完成：
+    一次查询有效的动态，一次查询已有的点赞，bulk_create(ignore_conflicts=True)写入新点赞，
+    一条UPDATE给所有新点赞的动态的点赞数加一，再批量合并或创建通知。查询次数固定，与动态数无关。
+    已经点过赞的动态会被忽略，因此重复提交同一批点赞是安全的。
+    """
+    post_ids = parse_ids(request.POST.getlist('post_ids'))
+    if not post_ids:
+        return JsonResponse({'message': 'Please provide post_ids.'}, status=400)
+    if len(post_ids) > MAX_BATCH_LIKES:
+        return JsonResponse({'message': f'At most {MAX_BATCH_LIKES} posts per request.'}, status=400)
+
+    with transaction.atomic():
+        owners = dict(Post.objects.filter(id__in=post_ids).values_list('id', 'user_id'))
+        already_liked = set(PostLike.objects.filter(user=request.user, post_id__in=list(owners))
+                            .values_list('post_id', flat=True))
+        new_ids = [post_id for post_id in post_ids if post_id in owners and post_id not in already_liked]
+        if new_ids:
+            # ignore_conflicts兜底与单条点赞并发的情况，唯一约束保证不会产生重复记录
+            PostLike.objects.bulk_create([PostLike(user=request.user, post_id=post_id) for post_id in new_ids],
+                                         ignore_conflicts=True)
+            # 每条新点赞只对应一条动态，所以一条UPDATE即可给所有动态的点赞数各加一
+            Post.objects.filter(id__in=new_ids).update(like_count=F('like_count') + 1)
+            post_cache.bump(*new_ids)
+            notify_many('like', request.user, ContentType.objects.get_for_model(Post),
+                        [(post_id, owners[post_id]) for post_id in new_ids])
+
+    return JsonResponse({
+        'message': 'Posts liked successfully.',
+        'liked': new_ids,
+        'already_liked': [post_id for post_id in post_ids if post_id in already_liked],
+        'not_found': [post_id for post_id in post_ids if post_id not in owners],
+    })
+
+
+@login_required
+def list_notifications(request):
+    """
+    通知收件箱：按最近一次活动时间倒序，使用(updated_at, id)游标分页，?unread=1时只返回未读通知。
+    合并后的通知有新的发起者加入时会刷新updated_at并重新排到最前面。
+    """
+    notifications = notification_queryset(request.user.id)
+    if request.GET.get('unread') == '1':
+        notifications = notifications.filter(is_read=False)
+    try:
+        page, next_cursor = paginate_by_cursor(notifications, request.GET.get('cursor'), 20,
+                                               fields=('updated_at', 'id'))
+    except InvalidCursor:
+        return JsonResponse({'message': 'Invalid cursor.'}, status=400)
+    return JsonResponse({'notifications': serialize_notifications(page), 'next_cursor': next_cursor,
+                         'unread_count': unread_count(request.user.id)})
+
+
+@login_required
+def unread_notification_count(request):
+    """
+    未读通知数（角标），命中缓存时不访问数据库
+    """
+    return JsonResponse({'unread_count': unread_count(request.user.id)})
+
+
+@login_required
+@require_http_methods(["POST"])
+def mark_notifications_read(request):
+    """
+    把通知标记为已读。传入up_to（客户端看到的最新一条通知的ID）时，
+    最近一次活动时间不晚于该通知的未读通知全部标记为已读；不传时标记全部未读通知。一条UPDATE完成。
+    """
+    up_to = request.POST.get('up_to')
+    if up_to is not None and not up_to.isdigit():
+        return JsonResponse({'message': 'Invalid up_to.'}, status=400)
+    count = mark_read(request.user.id, int(up_to) if up_to is not None else None)
+    if count is None:
+        return JsonResponse({'message': 'Notification not found.'}, status=404)
+    return JsonResponse({'message': 'Notifications marked as read.', 'marked': count,
+                         'unread_count': unread_count(request.user.id)})
 
 #
 # @csrf_exempt
@@ -288,27 +630,3 @@ def unlike_post(request, post_id):
 #         return JsonResponse({'message': 'User unfollowed successfully', 'user_id': user_id})
 #     else:
 #         return JsonResponse({'error': 'Method not allowed'}, status=405)
-#
-# # 模拟用户数据和内容数据，实际情况应该从数据库或其他数据源获取
-# user_data = [
-#     {'id': 1, 'name': 'User 1', 'preferences': ['sports', 'music']},
-#     {'id': 2, 'name': 'User 2', 'preferences': ['technology', 'travel']},
-#     # 可以根据实际情况添加更多用户信息
-# ]
-#
-#
-# def search(request):
-#     keyword = request.GET.get('keyword')
-#     # 假设这里是关键词搜索的逻辑，可以根据关键词在内容或用户中进行搜索
-#     # 这里只是简单返回包含关键词的内容和用户信息
-#     search_results = {
-#         'content_results': [content for content in content_data if keyword in content['title'] or keyword in content['tags']],
-#         'user_results': [user for user in user_data if keyword in user['name'] or keyword in user['preferences']]
-#     }
-#     return JsonResponse(search_results)
-#
-# def recommend(request, user_id):
-#     # 假设这里是根据用户行为和偏好推荐内容的逻辑
-#     # 可以根据用户的偏好和行为数据生成推荐内容
-#     recommended_content = [content for content in content_data if any(tag in user_data[user_id-1]['preferences'] for tag in content['tags'])]
-#     return JsonResponse(recommended_content)
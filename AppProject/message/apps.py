@@ -8,3 +8,7 @@ from django.apps import AppConfig
 class MessageAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "message"
+
+    def ready(self):
+        # 注册信号处理函数
+        from . import signals  # noqa: F401
@@ -0,0 +1,137 @@
+"""
+私信会话：两个用户之间的全部消息属于同一个会话（Conversation），会话键为(较小的用户ID, 较大的用户ID)。
+
+会话的历史消息按(created_at, id)倒序、游标分页，Message上的(conversation, created_at, id)联合索引
+使每一页都是一次索引范围扫描，与收件箱的总大小和翻页深度无关。
+
+已读状态按会话保存为已读位置（ConversationReadState）：会话中ID不大于last_read_message_id的消息都是已读的，
+读完一段积压的消息只需要移动一次已读位置，不需要逐条更新消息；返回给客户端的消息带有read字段，由with_read()计算。
+未读数是冗余的计数，收到新消息时加一（见signals.py），移动已读位置时用(conversation, id)索引上的范围计数重新计算。
+"""
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from dynamic.pagination import paginate_by_cursor
+
+from .models import Conversation, ConversationReadState, Message
+
+
+def pair_key(user_id, other_id):
+    """
+    :return: 会话键(较小的用户ID, 较大的用户ID)
+    """
+    return (user_id, other_id) if user_id <= other_id else (other_id, user_id)
+
+
+def conversation_ids(pairs):
+    """
+    批量获取或创建会话，用于bulk_create消息之前（bulk_create不会调用Message.save()）
+
+    :param pairs: [(发送者ID, 接收者ID)]
+    :return: {会话键: 会话ID}
+    """
+    keys = {pair_key(*pair) for pair in pairs}
+    Conversation.objects.bulk_create([Conversation(user_low_id=low, user_high_id=high) for low, high in keys],
+                                     ignore_conflicts=True)
+    rows = (Conversation.objects.filter(user_low_id__in={low for low, _ in keys},
+                                        user_high_id__in={high for _, high in keys})
+            .values_list('user_low_id', 'user_high_id', 'id'))
+    return {(low, high): conversation_id for low, high, conversation_id in rows if (low, high) in keys}
+
+
+def history(user_id, other_id, cursor, limit):
+    """
+    读取两个用户之间的历史消息，从最新的一条开始向前翻页，每条消息带有接收者的已读状态read。
+    会话按唯一的会话键关联查询，不需要先单独查出会话ID；两人从未通信时返回空列表
+
+    :return: (本页消息的字典列表, 下一页游标或None)
+    :raises InvalidCursor: 游标无法解析
+    """
+    low, high = pair_key(user_id, other_id)
+    messages = with_read(Message.objects.filter(conversation__user_low_id=low, conversation__user_high_id=high)
+                         .values('id', 'sender_id', 'receiver_id', 'content', 'created_at'))
+    return paginate_by_cursor(messages, cursor, limit)
+
+
+def with_read(messages):
+    """
+    给消息查询集加上read字段：消息ID不大于接收者在这个会话中的已读位置时为已读。
+    已读位置用关联子查询读取（(user, conversation)唯一索引上的一次查找），不增加查询次数
+    """
+    position = (ConversationReadState.objects
+                .filter(user_id=OuterRef('receiver_id'), conversation_id=OuterRef('conversation_id'))
+                .values('last_read_message_id')[:1])
+    return messages.annotate(read=ExpressionWrapper(Q(id__lte=Coalesce(Subquery(position), 0)),
+                                                    output_field=BooleanField()))
+
+
+def message_received(message):
+    """
+    新消息：接收者在这个会话中的未读数加一，第一次收到消息时创建已读位置
+    """
+    states = ConversationReadState.objects.filter(user_id=message.receiver_id, conversation_id=message.conversation_id)
+    if not states.update(unread_count=F('unread_count') + 1):
+        # ignore_conflicts兜底并发创建的情况，计数统一由下面的UPDATE增加
+        ConversationReadState.objects.bulk_create([ConversationReadState(
+            user_id=message.receiver_id, conversation_id=message.conversation_id)], ignore_conflicts=True)
+        states.update(unread_count=F('unread_count') + 1)
+
+
+def message_removed(message):
+    """
+    删除或撤回消息：如果对接收者来说还是未读的，未读数减一
+    """
+    ConversationReadState.objects.filter(
+        user_id=message.receiver_id, conversation_id=message.conversation_id,
+        last_read_message_id__lt=message.id, unread_count__gt=0,
+    ).update(unread_count=F('unread_count') - 1)
+
+
+def set_read_position(user_id, conversation_id, message_id=None, rewind=False):
+    """
+    移动用户在会话中的已读位置并重新计算未读数，查询次数是常数，与移动跨过的消息条数无关
+
+    :param message_id: 读到这条消息为止，不超过会话中实际存在的最后一条消息；None表示读到最新的消息
+    :param rewind: 默认已读位置只向前移动；为True时可以后退，用于把消息重新标记为未读
+    :return: 更新后的ConversationReadState
+    """
+    messages = Message.objects.filter(conversation_id=conversation_id)
+    with transaction.atomic():
+        state, _ = ConversationReadState.objects.select_for_update().get_or_create(
+            user_id=user_id, conversation_id=conversation_id)
+        if message_id is not None:
+            messages = messages.filter(id__lte=message_id)
+        position = messages.aggregate(last=Max('id'))['last'] or 0
+        if not rewind:
+            position = max(position, state.last_read_message_id)
+        state.last_read_message_id = position
+        state.unread_count = Message.objects.filter(conversation_id=conversation_id, receiver_id=user_id,
+                                                    id__gt=position).count()
+        state.save(update_fields=['last_read_message_id', 'unread_count'])
+    return state
+
+
+def mark_read(user_id, other_id, up_to=None):
+    """
+    把与other_id的会话标记为已读，到up_to这条消息为止（默认为最新的消息）
+
+    :return: 更新后的ConversationReadState；两人从未通信时返回None
+    """
+    low, high = pair_key(user_id, other_id)
+    conversation_id = (Conversation.objects.filter(user_low_id=low, user_high_id=high)
+                       .values_list('id', flat=True).first())
+    if conversation_id is None:
+        return None
+    return set_read_position(user_id, conversation_id, up_to)
+
+
+def unread_counts(user_id):
+    """
+    有未读消息的会话及其未读数，一条查询读取冗余的计数
+
+    :return: [(对方的用户ID, 未读数)]，按对方的用户ID排序
+    """
+    rows = (ConversationReadState.objects.filter(user_id=user_id, unread_count__gt=0)
+            .values_list('conversation__user_low_id', 'conversation__user_high_id', 'unread_count'))
+    return sorted((high if low == user_id else low, count) for low, high, count in rows)
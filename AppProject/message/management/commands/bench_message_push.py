@@ -0,0 +1,171 @@
+"""
+私信推送负载测试：在进程内通过ASGI入口建立N个空闲的SSE连接（见push.py），测量每个连接占用的内存、
+空闲期间的数据库查询数和推送到达客户端的延迟，并与每个客户端定时轮询receive_messages的查询量对比。
+
+用法：python manage.py bench_message_push --connections 1000 --idle 5 --poll-interval 5
+不需要ASGI服务器，直接调用get_asgi_application()。所有测试数据在一个事务中写入，结束后回滚。
+"""
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from message import push
+from message.models import Message
+
+
+class Connection:
+    """
+    一个进程内的ASGI客户端连接，记录收到的响应体分块及其到达时间
+    """
+
+    def __init__(self, application, path, session_key, query_string=b''):
+        self.scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                      'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query_string,
+                      'root_path': '', 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+                      'headers': [(b'host', b'localhost'),
+                                  (b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode())]}
+        self.disconnected = asyncio.Event()
+        self.requested = False
+        self.status = None
+        self.chunks = asyncio.Queue()
+        self.task = asyncio.ensure_future(application(self.scope, self.receive, self.send))
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+        elif message.get('body'):
+            self.chunks.put_nowait((time.perf_counter(), message['body']))
+
+    async def close(self):
+        self.disconnected.set()
+        await self.task
+
+
+async def count_queries(function):
+    """
+    执行异步函数function，返回期间在当前事务的数据库连接上执行的查询数
+    """
+    queries = CaptureQueriesContext(connection)
+    # 数据库连接只能在同步代码中访问
+    await sync_to_async(queries.__enter__)()
+    try:
+        await function()
+    finally:
+        await sync_to_async(queries.__exit__)(None, None, None)
+    return await sync_to_async(len)(queries)
+
+
+class Command(BaseCommand):
+    help = 'Load test server-sent message push against polling.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--idle', type=float, default=5.0, help='seconds to hold the connections idle')
+        parser.add_argument('--messages', type=int, default=200)
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help='interval of the polling clients being replaced')
+
+    def _sessions(self, users):
+        keys = []
+        for user in users:
+            session = SessionStore()
+            session.update({SESSION_KEY: str(user.pk), BACKEND_SESSION_KEY: settings.AUTHENTICATION_BACKENDS[0],
+                            HASH_SESSION_KEY: user.get_session_auth_hash()})
+            session.create()
+            keys.append(session.session_key)
+        return keys
+
+    async def _run(self, options, users, session_keys):
+        application = get_asgi_application()
+        hub = push.get_hub()
+        count = options['connections']
+        stream_path = reverse('message_stream')
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        connections = [Connection(application, stream_path, key) for key in session_keys]
+        # 每个连接先收到retry字段，说明已经订阅
+        for client in connections:
+            await client.chunks.get()
+        elapsed = time.perf_counter() - start
+        per_connection = (tracemalloc.get_traced_memory()[0] - before) / count
+        tracemalloc.stop()
+        assert hub.connection_count == count and all(client.status == 200 for client in connections)
+        self.stdout.write(f'opened {count} SSE connections in {elapsed:.2f}s, '
+                          f'{per_connection / 1024:.1f} KiB Python heap per connection')
+
+        idle_queries = await count_queries(lambda: asyncio.sleep(options['idle']))
+        self.stdout.write(f'idle {options["idle"]:.0f}s: {idle_queries} database queries')
+
+        latencies = []
+        for i in range(options['messages']):
+            index = i * 7919 % count
+            payload = {'id': 10 ** 12 + i, 'sender': users[0].pk, 'receiver': users[index].pk, 'content': 'ping'}
+            # 与send_message一样在线程池中发布
+            start = time.perf_counter()
+            await sync_to_async(hub.publish, thread_sensitive=False)(users[index].pk, payload)
+            arrived, body = await connections[index].chunks.get()
+            assert body.startswith(f'id: {payload["id"]}\n'.encode())
+            latencies.append((arrived - start) * 1e3)
+        latencies.sort()
+        self.stdout.write(f'publish -> delivered: median {statistics.median(latencies):.3f} ms, '
+                          f'p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]:.3f} ms')
+
+        # 轮询的对比：receive_messages每次请求的查询数（ETag命中时返回304）
+        poll_path = reverse('receive_messages', args=[users[0].pk])
+        per_poll = await count_queries(lambda: Connection(application, poll_path, session_keys[0]).task)
+        per_long_poll = await count_queries(
+            lambda: Connection(application, reverse('poll_messages'), session_keys[0], b'after=0').task)
+        interval = options['poll_interval']
+        self.stdout.write(f'polling receive_messages every {interval:.0f}s: {per_poll} queries per poll, '
+                          f'{count / interval * per_poll:.0f} queries/s for {count} clients '
+                          f'({count / interval * per_poll * options["idle"]:.0f} during the idle window)')
+        self.stdout.write(f'long polling (MESSAGE_PUSH_LONG_POLL_TIMEOUT={settings.MESSAGE_PUSH_LONG_POLL_TIMEOUT}s): '
+                          f'{per_long_poll} queries per request, at most '
+                          f'{count / settings.MESSAGE_PUSH_LONG_POLL_TIMEOUT * per_long_poll:.0f} queries/s when idle')
+
+        start = time.perf_counter()
+        for client in connections:
+            await client.close()
+        self.stdout.write(f'closed {count} connections in {time.perf_counter() - start:.2f}s, '
+                          f'{hub.connection_count} subscriptions left')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        count = options['connections']
+        # 与测试客户端相同：每个请求的开始和结束不关闭数据库连接，否则事务会被中断
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create([User(username=f'bench_push_{i}', email=f'bench_push_{i}@example.com')
+                                          for i in range(count)])
+                users = list(User.objects.filter(username__startswith='bench_push_').order_by('id'))
+                Message.objects.create(sender=users[-1], receiver=users[0], content='hello')
+                session_keys = self._sessions(users)
+                # 在当前线程中运行事件循环，视图中thread_sensitive的数据库访问回到当前线程，共用这个事务
+                async_to_sync(self._run)(options, users, session_keys)
+                transaction.set_rollback(True)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
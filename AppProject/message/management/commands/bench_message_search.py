@@ -0,0 +1,87 @@
+"""
+私信搜索性能基准：私信表不断增长时，比较索引搜索与原来content__icontains全表扫描的耗时。
+
+用法：python manage.py bench_message_search --sizes 100000 300000 1000000 --history 5000
+被测用户的私信数固定为history条，其中约1%包含罕见词"护照"；其余私信在其他用户之间随机产生，用于扩大私信表。
+对照组为限定在被测用户私信中的content__icontains查询（按ID倒序取20条）。
+所有测试数据在一个事务中写入，结束后回滚。
+"""
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Q
+from django.test import RequestFactory
+
+from message import conversations, search
+from message.models import Message
+from message.views import search_messages
+
+WORDS = ['明天', '上午', '集合', '门票', '故宫', '排队', '地铁', '午饭', '会议', '报告', '周末', '电影',
+         'ticket', 'meeting', 'lunch', 'report', 'movie', 'weekend', 'metro', 'coffee']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark indexed message search as the message table grows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100000, 300000])
+        parser.add_argument('--history', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(0)
+        factory = RequestFactory()
+        User = get_user_model()
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f'bench_msg_{i}', email=f'bench_msg_{i}@example.com') for i in range(options['users'])])
+            users = list(User.objects.filter(username__startswith='bench_msg_').order_by('id'))
+            target, others = users[0], users[1:]
+            self._seed([(target, self.rng.choice(others)) for _ in range(options['history'])], options['batch_size'],
+                       rare=0.01)
+            seeded = options['history']
+
+            self.stdout.write(f'{"messages":>10} {"query":<16} {"index median":>13} {"index p99":>10} '
+                              f'{"icontains median":>17}')
+            for size in sorted(options['sizes']):
+                pairs = [tuple(self.rng.sample(others, 2)) for _ in range(max(size - seeded, 0))]
+                self._seed(pairs, options['batch_size'])
+                seeded = max(size, seeded)
+                for query in ('门票', '故宫 集合', 'meeting', '护照'):
+                    timings = []
+                    for _ in range(options['queries']):
+                        request = factory.get('/message/search_messages/')
+                        request.user = target
+                        start = time.perf_counter()
+                        response = search_messages(request, query)
+                        timings.append((time.perf_counter() - start) * 1000)
+                        assert response.status_code == 200
+                    start = time.perf_counter()
+                    list(Message.objects.filter(Q(sender=target) | Q(receiver=target),
+                                                content__icontains=query.split()[0]).order_by('-id')[:20])
+                    scan = (time.perf_counter() - start) * 1000
+                    timings.sort()
+                    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+                    self.stdout.write(f'{seeded:>10} {query:<16} {statistics.median(timings):>10.2f} ms '
+                                      f'{p99:>7.2f} ms {scan:>14.2f} ms')
+            transaction.set_rollback(True)
+
+    def _seed(self, pairs, batch_size, rare=0.0):
+        for offset in range(0, len(pairs), batch_size):
+            last_id = Message.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+            batch = pairs[offset:offset + batch_size]
+            conversation_ids = conversations.conversation_ids((sender.id, receiver.id) for sender, receiver in batch)
+            Message.objects.bulk_create([
+                Message(sender=sender, receiver=receiver,
+                        conversation_id=conversation_ids[conversations.pair_key(sender.id, receiver.id)],
+                        content=' '.join(self.rng.choices(WORDS, k=8)) + (' 护照' if self.rng.random() < rare else ''))
+                for sender, receiver in batch])
+            # bulk_create不触发post_save，也不一定返回ID，重新查询后建立索引
+            search.index_messages(Message.objects.filter(id__gt=last_id).only('id', 'sender_id', 'receiver_id',
+                                                                               'content'), batch_size)
@@ -0,0 +1,29 @@
+"""
+清空并重建私信的搜索索引（见message/search.py）。
+
+上线私信搜索时为已有的消息建立索引，之后新消息会自动建立索引。按消息ID分批处理，每批单独提交事务，
+大表上也不会长时间锁表；重建期间搜索结果可能不完整。
+
+用法：python manage.py rebuild_message_search_index --batch-size 1000
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from message import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index for private messages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        def progress(indexed):
+            self.stdout.write(f'indexed {indexed} messages ({time.perf_counter() - start:.1f}s)')
+
+        indexed = search.rebuild(options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} messages in {time.perf_counter() - start:.1f}s.'))
@@ -0,0 +1,91 @@
+# Generated by Django 5.0.3 on 2026-10-18 16:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def assign_conversations(apps, schema_editor):
+    Conversation = apps.get_model("message", "Conversation")
+    Message = apps.get_model("message", "Message")
+    # 每一对互发过消息的用户创建一个会话，会话键为(较小的用户ID, 较大的用户ID)
+    pairs = {
+        (min(sender_id, receiver_id), max(sender_id, receiver_id))
+        for sender_id, receiver_id in Message.objects.values_list(
+            "sender_id", "receiver_id"
+        ).distinct()
+    }
+    for low, high in pairs:
+        conversation, _ = Conversation.objects.get_or_create(
+            user_low_id=low, user_high_id=high
+        )
+        Message.objects.filter(
+            Q(sender_id=low, receiver_id=high) | Q(sender_id=high, receiver_id=low)
+        ).update(conversation=conversation)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("message", "0004_message_search_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Conversation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "user_high",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "user_low",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="conversation",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="messages",
+                to="message.conversation",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="conversation",
+            constraint=models.UniqueConstraint(
+                fields=("user_low", "user_high"), name="unique_conversation_pair"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="conversation",
+            constraint=models.CheckConstraint(
+                check=models.Q(("user_low__lte", models.F("user_high"))),
+                name="conversation_pair_order",
+            ),
+        ),
+        migrations.RunPython(assign_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.0.3 on 2026-10-18 17:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def create_read_states(apps, schema_editor):
+    ConversationReadState = apps.get_model("message", "ConversationReadState")
+    Message = apps.get_model("message", "Message")
+    # 每个接收者在每个会话中的已读位置取收到的最后一条已读消息，之前的消息都视为已读
+    rows = (
+        Message.objects.values("receiver_id", "conversation_id")
+        .annotate(last_read=Max("id", filter=Q(read=True)))
+        .order_by()
+    )
+    ConversationReadState.objects.bulk_create(
+        (
+            ConversationReadState(
+                user_id=row["receiver_id"],
+                conversation_id=row["conversation_id"],
+                last_read_message_id=row["last_read"] or 0,
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=1000,
+    )
+    unread = (
+        Message.objects.filter(
+            conversation_id=OuterRef("conversation_id"),
+            receiver_id=OuterRef("user_id"),
+            id__gt=OuterRef("last_read_message_id"),
+        )
+        .order_by()
+        .values("conversation_id")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    ConversationReadState.objects.update(
+        unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("message", "0006_conversation_required"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversationReadState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("last_read_message_id", models.BigIntegerField(default=0)),
+                ("unread_count", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "id"], name="message_conversation_id_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversationreadstate",
+            name="conversation",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="read_states",
+                to="message.conversation",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversationreadstate",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="conversationreadstate",
+            constraint=models.UniqueConstraint(
+                fields=("user", "conversation"), name="unique_conversation_read_state"
+            ),
+        ),
+        migrations.RunPython(create_read_states, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="message",
+            name="read",
+        ),
+    ]
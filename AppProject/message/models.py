@@ -8,9 +8,71 @@ from django.db import models
 from django.conf import settings
 
 
+class Conversation(models.Model):
+    """
+    两个用户之间的私信会话。以(较小的用户ID, 较大的用户ID)作为会话键，两人之间互发的全部消息都属于同一个会话
+    """
+    user_low = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    user_high = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='unique_conversation_pair'),
+            models.CheckConstraint(check=models.Q(user_low__lte=models.F('user_high')), name='conversation_pair_order'),
+        ]
+
+
 class Message(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='sent_messages', on_delete=models.CASCADE)
     receiver = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='received_messages', on_delete=models.CASCADE)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
-    read = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # 打开会话时按(created_at, id)倒序翻页，每页是这个索引上的一次范围扫描
+            models.Index(fields=['conversation', 'created_at', 'id'], name='message_history_idx'),
+            # 已读位置之后的未读消息计数，是这个索引上的一次范围扫描
+            models.Index(fields=['conversation', 'id'], name='message_conversation_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.conversation_id is None:
+            # 新消息归入发送者和接收者之间的会话，第一次通信时创建会话；批量写入时使用conversations.conversation_ids()
+            low, high = sorted((self.sender_id, self.receiver_id))
+            self.conversation, _ = Conversation.objects.get_or_create(user_low_id=low, user_high_id=high)
+        super().save(*args, **kwargs)
+
+
+class ConversationReadState(models.Model):
+    """
+    用户在一个会话中的已读位置（见conversations.py）：会话中ID不大于last_read_message_id的消息都是已读的。
+    unread_count是已读位置之后用户收到的消息数，收到新消息时加一，移动已读位置时重新计数
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='read_states')
+    last_read_message_id = models.BigIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'conversation'], name='unique_conversation_read_state'),
+        ]
+
+
+class MessageSearchPosting(models.Model):
+    """
+    私信搜索的倒排项（见search.py）：消息的每个参与者（发送者和接收者）各有一份，
+    搜索只扫描当前用户自己的倒排项，开销与私信总量无关。词项以64位哈希存储，哈希冲突由搜索时的内容校验排除
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+', db_index=False)
+    term = models.BigIntegerField()
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        indexes = [
+            # 按(用户, 词项)定位，再按消息ID倒序扫描
+            models.Index(fields=['user', 'term', 'message'], name='message_search_idx'),
+        ]
@@ -0,0 +1,178 @@
+"""
+私信实时推送：send_message提交事务后，把新消息推送给接收者当前保持的连接，客户端不再需要每隔几秒轮询receive_messages。
+
+连接通过ASGI入口（AppProject/asgi.py）提供，有两种形式（见views.py）：
+SSE（message_stream）：一个长期保持的text/event-stream响应，每条消息是一个事件，空闲时定期发送注释行保活；
+长轮询（poll_messages）：没有新消息时挂起请求，直到有新消息或超时再返回。
+两者都只在建立连接时查询一次数据库（补发断线期间的消息），空闲连接不产生任何查询。
+
+发布订阅中心（Hub）可以替换，通过settings.MESSAGE_PUSH_HUB配置：
+InProcessHub：进程内的发布订阅，只能推送给连接在同一个工作进程上的客户端，默认使用；
+BrokerHub：经由消息代理在多个工作进程之间扇出，每个进程的Hub把消息发给代理，代理再投递给所有进程的Hub。
+LocalBroker是代理的本地替身（进程内），用于测试和单机开发；多进程部署时替换为Redis发布订阅等跨进程实现，接口相同。
+
+publish()可以在任意线程中调用（同步视图运行在线程池中），订阅在各自连接的事件循环中通过call_soon_threadsafe接收消息。
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import conversations
+from .models import Message
+
+# 订阅的队列溢出（客户端读取太慢）时放入的标记，连接随即结束，客户端重连后用Last-Event-ID从数据库补发
+OVERFLOW = object()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def serialize(message):
+    """
+    推送的消息内容，字段与会话历史接口相同。刚发送的消息在接收者的已读位置之后，总是未读的
+    """
+    return {'id': message.id, 'sender': message.sender_id, 'receiver': message.receiver_id,
+            'content': message.content, 'created_at': message.created_at, 'read': False}
+
+
+def messages_after(user_id, after, limit):
+    """
+    用户收到的ID大于after的消息，按ID升序，用于建立连接时补发断线期间的消息
+    """
+    messages = (conversations.with_read(Message.objects.filter(receiver_id=user_id, id__gt=after)).order_by('id')
+                .values('id', 'sender_id', 'receiver_id', 'content', 'created_at', 'read')[:limit])
+    return [{'id': message['id'], 'sender': message['sender_id'], 'receiver': message['receiver_id'],
+             'content': message['content'], 'created_at': message['created_at'], 'read': message['read']}
+            for message in messages]
+
+
+class Subscription:
+    """
+    一个连接的订阅，必须在连接所在的事件循环中创建。可以用作上下文管理器，退出时取消订阅
+    """
+
+    def __init__(self, hub, user_id, queue_size):
+        self.hub = hub
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def deliver(self, payload):
+        # 可能在其他线程中调用
+        self.loop.call_soon_threadsafe(self._put, payload)
+
+    def _put(self, payload):
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            payload = OVERFLOW
+        self.queue.put_nowait(payload)
+
+    async def get(self, timeout):
+        """
+        :return: 下一条消息；超时返回None；队列溢出后返回OVERFLOW
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class InProcessHub:
+    """
+    进程内的发布订阅，按接收者的用户ID分组保存订阅
+    """
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self, user_id, _setting('MESSAGE_PUSH_QUEUE_SIZE', 100))
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def deliver(self, user_id, payload):
+        """
+        投递给本进程中该用户的全部连接
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.deliver(payload)
+
+    def publish(self, user_id, payload):
+        self.deliver(user_id, payload)
+
+    @property
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+class LocalBroker:
+    """
+    消息代理的进程内替身：把发布的消息转发给所有连接到它的Hub，每个Hub代表一个工作进程
+    """
+
+    def __init__(self):
+        self._hubs = []
+
+    def connect(self, hub):
+        self._hubs.append(hub)
+
+    def publish(self, user_id, payload):
+        for hub in list(self._hubs):
+            hub.deliver(user_id, payload)
+
+
+_local_broker = LocalBroker()
+
+
+class BrokerHub(InProcessHub):
+    """
+    经由消息代理扇出的Hub：发布时交给代理，由代理投递到每个工作进程的Hub，再由各个Hub投递给本进程的连接
+    """
+
+    def __init__(self, broker=None):
+        super().__init__()
+        self.broker = broker or _local_broker
+        self.broker.connect(self)
+
+    def publish(self, user_id, payload):
+        self.broker.publish(user_id, payload)
+
+
+@lru_cache(maxsize=None)
+def _load_hub(path):
+    return import_string(path)()
+
+
+def get_hub():
+    """
+    返回当前配置的Hub（每种配置只实例化一次）
+    """
+    return _load_hub(_setting('MESSAGE_PUSH_HUB', 'message.push.InProcessHub'))
@@ -0,0 +1,177 @@
+"""
+私信搜索：只在当前用户参与的私信（发送或接收）中查找，使用与动态搜索相同的n-gram分词（见dynamic/search.py），
+中文按相邻二元组、其他语言按单词建立倒排项。
+
+倒排项MessageSearchPosting按(用户, 词项哈希, 消息ID)建索引，消息的发送者和接收者各有一份。新消息保存时由信号建立索引，
+删除消息时倒排项随之级联删除；已有的消息用rebuild_message_search_index命令建立索引。
+
+查询时以一个词项（倒排项最少的那个）的倒排表为主，按消息ID倒序每次读取一批，再用一条查询确认其他词项也出现在这些消息中，
+最后加载消息内容校验（排除哈希冲突和二元组拼接出的误匹配）并生成高亮摘要。
+每个请求最多扫描settings.MESSAGE_SEARCH_SCAN_LIMIT条倒排项，扫描到上限时返回游标，下次从该位置继续，
+因此单次请求的耗时有上限，不随私信表和用户历史的增长而增长。
+"""
+import hashlib
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils.html import escape
+
+from dynamic.pagination import decode_cursor, encode_cursor
+from dynamic.search import CJK_RANGES, TOKEN_RE, tokenize
+
+from .models import Message, MessageSearchPosting
+
+# 高亮摘要中匹配位置前后保留的字符数
+SNIPPET_RADIUS = 30
+
+CJK_RE = re.compile(f'[{CJK_RANGES}]')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def term_hash(term):
+    """
+    词项的64位有符号哈希，存入BigIntegerField
+    """
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+def _postings(message):
+    terms = {term_hash(term) for term in tokenize(message.content)}
+    return [MessageSearchPosting(user_id=user_id, term=term, message_id=message.id)
+            for user_id in {message.sender_id, message.receiver_id} for term in terms]
+
+
+def index_messages(messages, batch_size=1000):
+    """
+    为新消息建立倒排项。消息内容不会被修改，不需要先删除旧的倒排项
+    """
+    postings = [posting for message in messages for posting in _postings(message)]
+    MessageSearchPosting.objects.bulk_create(postings, batch_size=batch_size)
+    return len(postings)
+
+
+def rebuild(batch_size=1000, progress=None):
+    """
+    清空并按消息ID分批重建全部私信的倒排项
+
+    :param progress: 每处理完一批时以已处理的消息数调用
+    :return: 建立索引的消息数
+    """
+    MessageSearchPosting.objects.all().delete()
+    last_id, indexed = 0, 0
+    while True:
+        messages = list(Message.objects.filter(id__gt=last_id).order_by('id')
+                        .only('id', 'sender_id', 'receiver_id', 'content')[:batch_size])
+        if not messages:
+            break
+        last_id = messages[-1].id
+        index_messages(messages, batch_size)
+        indexed += len(messages)
+        if progress:
+            progress(indexed)
+    return indexed
+
+
+def _parse(query):
+    """
+    :return: (查询中的片段：连续的中日韩文字或单词, 分词得到的词项)
+    """
+    normalized = unicodedata.normalize('NFKC', query).lower()
+    segments = [cjk or word for cjk, word in TOKEN_RE.findall(normalized)]
+    return segments, sorted(set(tokenize(normalized)))
+
+
+def _matches(content, segments):
+    """
+    校验消息内容：中日韩片段必须原样出现，单词必须是内容中的一个词项
+    """
+    normalized = unicodedata.normalize('NFKC', content).lower()
+    words = set(tokenize(normalized))
+    return all(segment in normalized if CJK_RE.match(segment) else segment in words for segment in segments)
+
+
+def _driver(user_id, hashes, cap):
+    """
+    选择倒排项最少的词项作为主扫描的词项，每个词项最多数cap条
+    """
+    if len(hashes) == 1:
+        return next(iter(hashes))
+    sizes = {term: MessageSearchPosting.objects.filter(user_id=user_id, term=term)[:cap].count() for term in hashes}
+    return min(hashes, key=lambda term: sizes[term])
+
+
+def search(user_id, query, cursor, limit):
+    """
+    在用户参与的私信中搜索，按消息ID倒序（即时间倒序）返回
+
+    :param cursor: 上一页返回的游标，为空时从最新的消息开始
+    :return: (本页消息列表, 下一页游标或None)。扫描达到上限时本页可能少于limit条，但游标不为None
+    :raises InvalidCursor: 游标无法解析
+    """
+    segments, terms = _parse(query)
+    if not terms:
+        return [], None
+    before = decode_cursor(cursor, Message, ('id',))[0] if cursor else None
+    batch_size = _setting('MESSAGE_SEARCH_BATCH_SIZE', 200)
+    scan_limit = _setting('MESSAGE_SEARCH_SCAN_LIMIT', 2000)
+
+    hashes = {term_hash(term) for term in terms}
+    driver = _driver(user_id, hashes, scan_limit)
+    others = hashes - {driver}
+    results, scanned = [], 0
+    while scanned < scan_limit:
+        postings = MessageSearchPosting.objects.filter(user_id=user_id, term=driver)
+        if before is not None:
+            postings = postings.filter(message_id__lt=before)
+        ids = list(postings.order_by('-message_id').values_list('message_id', flat=True)[:batch_size])
+        if not ids:
+            return results, None
+        scanned += len(ids)
+
+        candidates = ids
+        if others:
+            candidates = (MessageSearchPosting.objects
+                          .filter(user_id=user_id, term__in=others, message_id__in=ids)
+                          .values('message_id').annotate(terms=Count('term', distinct=True))
+                          .filter(terms=len(others)).values_list('message_id', flat=True))
+        # 倒排项本身已经按用户隔离，这里再按参与者过滤一次，保证不会返回他人的私信
+        messages = (Message.objects.filter(id__in=list(candidates))
+                    .filter(Q(sender_id=user_id) | Q(receiver_id=user_id)).order_by('-id'))
+        for message in messages:
+            if _matches(message.content, segments):
+                results.append(message)
+                if len(results) == limit:
+                    return results, encode_cursor([message.id])
+
+        before = ids[-1]
+        if len(ids) < batch_size:
+            return results, None
+    return results, encode_cursor([before])
+
+
+def snippet(content, query, radius=SNIPPET_RADIUS):
+    """
+    截取第一个匹配位置附近的文本，匹配的片段用<mark>标记，其余部分做HTML转义
+    """
+    segments, _ = _parse(query)
+    pattern = re.compile('|'.join(re.escape(segment) for segment in sorted(segments, key=len, reverse=True)),
+                         re.IGNORECASE) if segments else None
+    match = pattern.search(content) if pattern else None
+    if match is None:
+        return escape(content[:radius * 2]) + ('…' if len(content) > radius * 2 else '')
+
+    start = max(match.start() - radius, 0)
+    end = min(match.end() + radius, len(content))
+    window = content[start:end]
+    parts, position = [], 0
+    for found in pattern.finditer(window):
+        parts.append(escape(window[position:found.start()]))
+        parts.append(f'<mark>{escape(found.group())}</mark>')
+        position = found.end()
+    parts.append(escape(window[position:]))
+    return ('…' if start > 0 else '') + ''.join(parts) + ('…' if end < len(content) else '')
@@ -0,0 +1,36 @@
+"""
+私信模块的信号处理：新消息保存后建立搜索索引（见search.py），更新接收者的未读数（见conversations.py），
+事务提交后推送给接收者的连接（见push.py）。删除消息时倒排项随之级联删除，未读的消息同时减少未读数。
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import conversations, push, search
+from .models import Message
+
+
+@receiver(post_save, sender=Message)
+def index_new_message(sender, instance, created, **kwargs):
+    # 已读状态等字段的修改不影响消息内容，不需要重建倒排项
+    if created:
+        search.index_messages([instance])
+
+
+@receiver(post_save, sender=Message)
+def push_new_message(sender, instance, created, **kwargs):
+    # 事务提交之后才推送，客户端收到的消息一定能从数据库中读到；事务回滚时不推送
+    if created:
+        payload = push.serialize(instance)
+        transaction.on_commit(lambda: push.get_hub().publish(instance.receiver_id, payload))
+
+
+@receiver(post_save, sender=Message)
+def count_unread_message(sender, instance, created, **kwargs):
+    if created:
+        conversations.message_received(instance)
+
+
+@receiver(post_delete, sender=Message)
+def uncount_removed_message(sender, instance, **kwargs):
+    conversations.message_removed(instance)
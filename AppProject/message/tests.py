@@ -1,6 +1,13 @@
-from django.test import TestCase
+import asyncio
+import io
+import threading
+
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
-from .models import Message
+from . import conversations, push, views
+from .models import Conversation, ConversationReadState, Message, MessageSearchPosting
 from django.contrib.auth import get_user_model
 import json
 
@@ -60,6 +67,7 @@ class SearchMessagesTest(MessageTestCase):
     def test_search_messages(self):
         keyword = 'Hello'
         url = reverse('search_messages', args=[keyword])
+        self.client.login(username='Bob', password='12345')
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertIn("Hello Bob!", response.content.decode())
@@ -85,3 +93,342 @@ class DeleteMessageTest(MessageTestCase):
         response = self.client.post(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Message.objects.count(), 1)  # 一个已被删除
+
+
+class ReceiveMessagesConditionalGetTest(MessageTestCase):
+    def test_unchanged_inbox_returns_304(self):
+        url = reverse('receive_messages', args=[self.user_bob.id])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Message.objects.create(sender=self.user_charlie, receiver=self.user_bob, content='New message')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)), 2)
+
+    def test_deleted_message_changes_etag(self):
+        url = reverse('receive_messages', args=[self.user_bob.id])
+        etag = self.client.get(url)['ETag']
+        self.client.post(reverse('delete_message', args=[self.message1.id]))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(MESSAGE_SEARCH_BATCH_SIZE=3, MESSAGE_SEARCH_SCAN_LIMIT=6)
+class IndexedSearchMessagesTest(MessageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.login(username='Bob', password='12345')
+
+    def _search(self, keyword, cursor=None):
+        params = {'cursor': cursor} if cursor is not None else {}
+        response = self.client.get(reverse('search_messages', args=[keyword]), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_scoped_to_own_conversations(self):
+        Message.objects.create(sender=self.user_alice, receiver=self.user_charlie, content='Hello Charlie!')
+        result = self._search('hello')
+        self.assertEqual([message['id'] for message in result['messages']], [self.message1.id])
+        self.assertIsNone(result['next_cursor'])
+
+        self.client.login(username='Charlie', password='12345')
+        self.assertEqual([message['content'] for message in self._search('Hello')['messages']], ['Hello Charlie!'])
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(reverse('search_messages', args=['Hello']))
+        self.assertEqual(response.status_code, 302)
+
+    def test_chinese_ngrams_and_snippet(self):
+        message = Message.objects.create(sender=self.user_alice, receiver=self.user_bob,
+                                         content='各位同学请注意，' * 3 + '明天上午十点在故宫门口集合，记得带上门票和<身份证>')
+        # "宫门"和"门票"两个二元组都出现了，但"故宫门票"并不是原文的一部分
+        Message.objects.create(sender=self.user_alice, receiver=self.user_bob, content='故宫门口见，门票我买好了')
+        result = self._search('故宫门口')
+        self.assertEqual(len(result['messages']), 2)
+        self.assertEqual(self._search('故宫门票')['messages'], [])
+
+        self.assertEqual([item['id'] for item in self._search('门票')['messages']][-1], message.id)
+        snippet = self._search('身份证')['messages'][0]['snippet']
+        # 匹配位置之前保留30个字符，其余部分省略；HTML特殊字符被转义
+        self.assertEqual(snippet, '…各位同学请注意，明天上午十点在故宫门口集合，记得带上门票和&lt;<mark>身份证</mark>&gt;')
+
+    def test_cursor_pagination(self):
+        ids = [Message.objects.create(sender=self.user_alice, receiver=self.user_bob, content=f'ticket {i}').id
+               for i in range(25)]
+        for i in range(4):
+            Message.objects.create(sender=self.user_alice, receiver=self.user_bob, content=f'other {i}')
+        found, cursor, pages = [], None, 0
+        while True:
+            result = self._search('ticket', cursor)
+            found.extend(message['id'] for message in result['messages'])
+            pages += 1
+            cursor = result['next_cursor']
+            if cursor is None:
+                break
+        # 每页最多扫描6条倒排项，25条结果至少需要5页
+        self.assertEqual(found, ids[::-1])
+        self.assertGreaterEqual(pages, 5)
+
+    def test_multiple_terms(self):
+        Message.objects.create(sender=self.user_alice, receiver=self.user_bob, content='ticket for the palace')
+        Message.objects.create(sender=self.user_alice, receiver=self.user_bob, content='ticket for the museum')
+        contents = [message['content'] for message in self._search('Palace TICKET')['messages']]
+        self.assertEqual(contents, ['ticket for the palace'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('search_messages', args=['Hello']), {'cursor': 'bad'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rebuild_command(self):
+        MessageSearchPosting.objects.all().delete()
+        self.assertEqual(self._search('Hello')['messages'], [])
+        call_command('rebuild_message_search_index', stdout=io.StringIO())
+        self.assertEqual(len(self._search('Hello')['messages']), 1)
+        self.message1.delete()
+        self.assertFalse(MessageSearchPosting.objects.filter(message_id=self.message1.id).exists())
+
+
+class MessageHistoryTest(MessageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.login(username='Alice', password='12345')
+
+    def test_messages_share_conversation(self):
+        reply = Message.objects.create(sender=self.user_alice, receiver=self.user_bob, content='How are you?')
+        self.assertEqual(self.message1.conversation_id, self.message2.conversation_id)
+        self.assertEqual(reply.conversation_id, self.message1.conversation_id)
+        other = Message.objects.create(sender=self.user_charlie, receiver=self.user_alice, content='Hi')
+        self.assertNotEqual(other.conversation_id, self.message1.conversation_id)
+        conversation = Conversation.objects.get(id=other.conversation_id)
+        self.assertEqual((conversation.user_low_id, conversation.user_high_id),
+                         tuple(sorted((self.user_alice.id, self.user_charlie.id))))
+
+        ids = conversations.conversation_ids([(self.user_bob.id, self.user_alice.id),
+                                              (self.user_bob.id, self.user_charlie.id)])
+        self.assertEqual(ids[conversations.pair_key(self.user_alice.id, self.user_bob.id)],
+                         self.message1.conversation_id)
+        self.assertEqual(Conversation.objects.count(), 3)
+
+    def test_history_pages_backwards(self):
+        ids = [self.message1.id, self.message2.id]
+        for i in range(23):
+            sender, receiver = (self.user_alice, self.user_bob) if i % 2 else (self.user_bob, self.user_alice)
+            ids.append(Message.objects.create(sender=sender, receiver=receiver, content=f'message {i}').id)
+        Message.objects.create(sender=self.user_charlie, receiver=self.user_bob, content='not in this chat')
+
+        url = reverse('message_history', args=[self.user_bob.id])
+        # 会话和登录用户各一条，读取一页只有一条查询
+        with self.assertNumQueries(3):
+            first = self.client.get(url).json()
+        self.assertEqual([message['id'] for message in first['messages']], ids[::-1][:20])
+        self.assertEqual(first['messages'][0]['content'], 'message 22')
+        second = self.client.get(url, {'cursor': first['next_cursor']}).json()
+        self.assertEqual([message['id'] for message in second['messages']], ids[::-1][20:])
+        self.assertIsNone(second['next_cursor'])
+
+        self.client.login(username='Bob', password='12345')
+        self.assertEqual(self.client.get(reverse('message_history', args=[self.user_alice.id])).json(), first)
+
+    def test_history_edge_cases(self):
+        empty = self.client.get(reverse('message_history', args=[self.user_charlie.id])).json()
+        self.assertEqual(empty, {'messages': [], 'next_cursor': None})
+        response = self.client.get(reverse('message_history', args=[self.user_bob.id]), {'cursor': 'bad'})
+        self.assertEqual(response.status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('message_history', args=[self.user_bob.id])).status_code, 302)
+
+
+class ConversationReadStateTest(MessageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.login(username='Bob', password='12345')
+        self.backlog = [Message.objects.create(sender=self.user_alice, receiver=self.user_bob, content=f'message {i}')
+                        for i in range(30)]
+
+    def _unread(self):
+        return self.client.get(reverse('unread_counts')).json()
+
+    def test_new_messages_count_as_unread(self):
+        Message.objects.create(sender=self.user_charlie, receiver=self.user_bob, content='Hey')
+        self.assertEqual(self._unread(), {'total': 32, 'conversations': [
+            {'user': self.user_alice.id, 'unread_count': 31}, {'user': self.user_charlie.id, 'unread_count': 1}]})
+        # 自己发出的消息不计入自己的未读数
+        self.client.login(username='Alice', password='12345')
+        self.assertEqual(self._unread()['total'], 1)
+
+    def test_mark_conversation_read(self):
+        url = reverse('mark_conversation_read', args=[self.user_alice.id])
+        response = self.client.post(url, {'up_to': self.backlog[9].id})
+        self.assertEqual(response.json(), {'last_read_message_id': self.backlog[9].id, 'unread_count': 20})
+        # 已读位置不后退
+        response = self.client.post(url, {'up_to': self.message1.id})
+        self.assertEqual(response.json()['last_read_message_id'], self.backlog[9].id)
+
+        # 读完整段积压的消息，查询次数与消息条数无关
+        Message.objects.bulk_create([Message(sender=self.user_alice, receiver=self.user_bob, content='bulk',
+                                             conversation_id=self.message1.conversation_id) for _ in range(200)])
+        with self.assertNumQueries(9):
+            response = self.client.post(url, {'up_to': 10 ** 12})
+        last_id = Message.objects.latest('id').id
+        self.assertEqual(response.json(), {'last_read_message_id': last_id, 'unread_count': 0})
+        self.assertEqual(self._unread(), {'total': 0, 'conversations': []})
+
+        # up_to超过最新的消息时，之后收到的消息仍然是未读的
+        Message.objects.create(sender=self.user_alice, receiver=self.user_bob, content='new')
+        self.assertEqual(self._unread()['total'], 1)
+
+    def test_mark_conversation_read_errors(self):
+        url = reverse('mark_conversation_read', args=[self.user_charlie.id])
+        self.assertEqual(self.client.post(url).status_code, 404)
+        url = reverse('mark_conversation_read', args=[self.user_alice.id])
+        self.assertEqual(self.client.post(url, {'up_to': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+    def test_per_message_compatibility(self):
+        response = self.client.post(reverse('mark_as_read', args=[self.backlog[4].id]))
+        self.assertEqual(response.json()['unread_count'], 25)
+        response = self.client.post(reverse('mark_as_unread', args=[self.backlog[2].id]))
+        self.assertEqual(response.json()['message'], 'Message marked as unread')
+        self.assertEqual(response.json()['unread_count'], 28)
+        self.assertEqual(self.client.post(reverse('mark_as_read', args=[10 ** 9])).status_code, 404)
+
+    def _read_flags(self):
+        # Bob收到的积压消息按ID排列的已读状态，分别来自会话历史、收件箱和推送补发
+        history = self.client.get(reverse('message_history', args=[self.user_alice.id]), {'cursor': ''}).json()
+        flags = {message['id']: message['read'] for message in history['messages']}
+        inbox = {message['id']: message['read']
+                 for message in self.client.get(reverse('receive_messages', args=[self.user_bob.id])).json()}
+        replay = {message['id']: message['read'] for message in push.messages_after(self.user_bob.id, 0, 100)}
+        self.assertEqual({message_id: inbox[message_id] for message_id in flags}, flags)
+        self.assertEqual({message_id: replay[message_id] for message_id in flags}, flags)
+        return [flags[message.id] for message in self.backlog[-20:]]
+
+    def test_messages_carry_read_flag(self):
+        inbox_url = reverse('receive_messages', args=[self.user_bob.id])
+        etag = self.client.get(inbox_url)['ETag']
+        self.assertEqual(self._read_flags(), [False] * 20)
+        self.client.post(reverse('mark_conversation_read', args=[self.user_alice.id]), {'up_to': self.backlog[14].id})
+        self.assertEqual(self._read_flags(), [True] * 5 + [False] * 15)
+        # 移动已读位置会改变收件箱的ETag
+        self.assertEqual(self.client.get(inbox_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        detail = self.client.get(reverse('get_message_detail', args=[self.backlog[14].id])).json()
+        self.assertTrue(detail['read'])
+        detail = self.client.get(reverse('get_message_detail', args=[self.backlog[15].id])).json()
+        self.assertFalse(detail['read'])
+        # Bob发出的消息按Alice的已读位置计算
+        reply = Message.objects.create(sender=self.user_bob, receiver=self.user_alice, content='reply')
+        self.assertFalse(self.client.get(reverse('get_message_detail', args=[reply.id])).json()['read'])
+
+    def test_mark_as_unread_rewinds_read_position(self):
+        self.client.post(reverse('mark_conversation_read', args=[self.user_alice.id]))
+        self.assertEqual(self._read_flags(), [True] * 20)
+        # 已读位置退回到这条消息之前：它和之后的消息都成为未读，之前的消息仍然已读
+        response = self.client.post(reverse('mark_as_unread', args=[self.backlog[20].id]))
+        self.assertEqual(response.json()['unread_count'], 10)
+        self.assertEqual(self._read_flags(), [True] * 10 + [False] * 10)
+
+    def test_removing_unread_message(self):
+        self.client.post(reverse('mark_conversation_read', args=[self.user_alice.id]), {'up_to': self.backlog[9].id})
+        self.backlog[3].delete()
+        self.backlog[20].delete()
+        state = ConversationReadState.objects.get(user=self.user_bob, conversation_id=self.message1.conversation_id)
+        self.assertEqual(state.unread_count, 19)
+
+
+class MessagePushTest(MessageTestCase):
+    async def test_hub_delivers_across_threads(self):
+        hub = push.InProcessHub()
+        with hub.subscribe(self.user_bob.id) as subscription:
+            other = hub.subscribe(self.user_alice.id)
+            self.assertEqual(hub.connection_count, 2)
+            # 同步视图在线程池中发布
+            thread = threading.Thread(target=hub.publish, args=(self.user_bob.id, {'id': 1}))
+            thread.start()
+            thread.join()
+            self.assertEqual(await subscription.get(1), {'id': 1})
+            self.assertIsNone(await other.get(0.01))
+            other.close()
+        self.assertEqual(hub.connection_count, 0)
+
+    @override_settings(MESSAGE_PUSH_QUEUE_SIZE=2)
+    async def test_slow_subscription_overflows(self):
+        hub = push.InProcessHub()
+        with hub.subscribe(self.user_bob.id) as subscription:
+            for i in range(3):
+                hub.publish(self.user_bob.id, {'id': i})
+            self.assertIs(await subscription.get(1), push.OVERFLOW)
+            self.assertIsNone(await subscription.get(0.01))
+
+    async def test_broker_fans_out_to_every_worker(self):
+        broker = push.LocalBroker()
+        first, second = push.BrokerHub(broker), push.BrokerHub(broker)
+        with first.subscribe(self.user_bob.id) as a, second.subscribe(self.user_bob.id) as b:
+            first.publish(self.user_bob.id, {'id': 1})
+            self.assertEqual(await a.get(1), {'id': 1})
+            self.assertEqual(await b.get(1), {'id': 1})
+
+    async def test_new_message_is_pushed_after_commit(self):
+        def send():
+            with self.captureOnCommitCallbacks(execute=True):
+                return Message.objects.create(sender=self.user_alice, receiver=self.user_bob, content='Pushed')
+
+        with push.get_hub().subscribe(self.user_bob.id) as subscription:
+            message = await sync_to_async(send)()
+            payload = await subscription.get(1)
+        self.assertEqual((payload['id'], payload['sender'], payload['content']),
+                         (message.id, self.user_alice.id, 'Pushed'))
+
+    async def test_long_poll(self):
+        url = reverse('poll_messages')
+        self.assertEqual((await self.async_client.get(url, {'after': 0})).status_code, 401)
+        await self.async_client.aforce_login(self.user_alice)
+        self.assertEqual((await self.async_client.get(url)).status_code, 400)
+
+        # 已有更新的消息时立即返回
+        response = await self.async_client.get(url, {'after': 0})
+        self.assertEqual([message['id'] for message in response.json()['messages']], [self.message2.id])
+
+        with override_settings(MESSAGE_PUSH_LONG_POLL_TIMEOUT=0.01):
+            response = await self.async_client.get(url, {'after': self.message2.id})
+        self.assertEqual(response.json(), {'messages': []})
+
+        # 没有新消息时挂起，收到推送后返回
+        request = asyncio.ensure_future(self.async_client.get(url, {'after': self.message2.id}))
+        while not push.get_hub().connection_count:
+            await asyncio.sleep(0.001)
+        push.get_hub().publish(self.user_alice.id, {'id': self.message2.id + 1, 'content': 'Wake up'})
+        response = await request
+        self.assertEqual(response.json()['messages'][0]['content'], 'Wake up')
+        self.assertEqual(push.get_hub().connection_count, 0)
+
+    async def test_stream_requires_login(self):
+        response = await self.async_client.get(reverse('message_stream'))
+        self.assertEqual(response.status_code, 401)
+        await self.async_client.aforce_login(self.user_alice)
+        response = await self.async_client.get(reverse('message_stream'), headers={'Last-Event-ID': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(MESSAGE_PUSH_HEARTBEAT_SECONDS=0.01)
+    async def test_stream_replays_then_pushes(self):
+        await self.async_client.aforce_login(self.user_alice)
+        response = await self.async_client.get(reverse('message_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        events = views._message_events(self.user_alice.id, 0)
+        self.assertEqual(await events.__anext__(), 'retry: 3000\n\n')
+        replayed = await events.__anext__()
+        self.assertTrue(replayed.startswith(f'id: {self.message2.id}\nevent: message\ndata: '))
+        self.assertEqual(json.loads(replayed.split('data: ')[1])['content'], 'Hi Alice!')
+
+        hub = push.get_hub()
+        # 补发过的消息再次推送时不重复发送
+        hub.publish(self.user_alice.id, {'id': self.message2.id})
+        hub.publish(self.user_alice.id, {'id': self.message2.id + 1, 'content': 'Live'})
+        self.assertTrue((await events.__anext__()).startswith(f'id: {self.message2.id + 1}\n'))
+        self.assertEqual(await events.__anext__(), ': keepalive\n\n')
+        await events.aclose()
+        self.assertEqual(hub.connection_count, 0)
@@ -8,9 +8,14 @@ from . import views
 urlpatterns = [
     path('send_message/', views.send_message, name='send_message'),
     path('receive_messages/<int:user_id>/', views.receive_messages, name='receive_messages'),
+    path('stream/', views.message_stream, name='message_stream'),  # 新消息的实时推送（SSE）
+    path('poll/', views.poll_messages, name='poll_messages'),  # 新消息的长轮询
     path('list_messages/', views.list_messages, name='list_messages'),
     path('search_messages/<str:keyword>/', views.search_messages, name='search_messages'),
+    path('history/<int:user_id>/', views.message_history, name='message_history'),
     path('get_message_detail/<int:message_id>/', views.get_message_detail, name='get_message_detail'),
+    path('read/<int:user_id>/', views.mark_conversation_read, name='mark_conversation_read'),  # 会话标记为已读
+    path('unread/', views.unread_counts, name='unread_counts'),
     path('mark_as_read/<int:message_id>/', views.mark_as_read, name='mark_as_read'),
     path('mark_as_unread/<int:message_id>/', views.mark_as_unread, name='mark_as_unread'),
     path('delete_message/<int:message_id>/', views.delete_message, name='delete_message'),
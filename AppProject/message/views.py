@@ -1,3 +1,7 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.serializers.json import DjangoJSONEncoder
 from django.forms import model_to_dict
@@ -7,11 +11,15 @@ from django.shortcuts import render
 包含应用程序的视图函数，处理请求并返回响应，实现应用程序的业务逻辑。
 """
 # Create your views here.
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from .models import Message  # 确保从你的models.py中导入Message模型
+from . import conversations, push, search
+from dynamic.pagination import InvalidCursor
+from django.contrib.auth.decorators import login_required
 from django.core.serializers import serialize
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
+from django.db.models import Count, F, Max, Q
 from django.shortcuts import get_object_or_404
 
 
@@ -36,16 +44,115 @@ def send_message(request):
         return JsonResponse({'error': 'Method not allowed'}, status=405)
 
 
+def _received_messages_etag(request, user_id):
+    """
+    收到的消息的ETag：一条聚合查询取最大消息ID、消息条数和其中已读的条数，新消息、删除、撤回和移动已读位置都会改变它，
+    不需要加载和序列化消息
+    """
+    read_states = 'conversation__read_states'
+    state = Message.objects.filter(receiver_id=user_id).aggregate(
+        last_id=Max('id'), count=Count('id', distinct=True),
+        read=Count('id', distinct=True, filter=Q(**{f'{read_states}__user_id': user_id,
+                                                    'id__lte': F(f'{read_states}__last_read_message_id')})))
+    return f'{state["last_id"]}-{state["count"]}-{state["read"]}'
+
+
 @csrf_exempt
+@condition(etag_func=_received_messages_etag)
 def receive_messages(request, user_id):
     # 从数据库中查询接收者为user_id的所有消息
     received_messages = Message.objects.filter(receiver_id=user_id)
 
-    # 直接构建要返回的数据结构
-    messages_list = list(received_messages.values('id', 'sender_id', 'receiver_id', 'content'))
+    # 直接构建要返回的数据结构，read为按已读位置计算的已读状态
+    messages_list = list(conversations.with_read(received_messages)
+                         .values('id', 'sender_id', 'receiver_id', 'content', 'read'))
     return JsonResponse(messages_list, safe=False)
 
 
+def _parse_after(value):
+    """
+    解析客户端已经收到的最后一条消息ID（Last-Event-ID请求头或after参数）
+
+    :return: 消息ID；没有提供时为None；无法解析时为False
+    """
+    if value is None or value == '':
+        return None
+    return int(value) if value.isdigit() else False
+
+
+def _event(payload):
+    return f'id: {payload["id"]}\nevent: message\ndata: {json.dumps(payload, cls=DjangoJSONEncoder)}\n\n'
+
+
+async def _message_events(user_id, after):
+    """
+    SSE事件流：先订阅，再从数据库补发after之后的消息，之后逐条转发推送的消息，空闲时发送保活注释。
+    先订阅后补发，两者之间提交的消息不会遗漏；同时出现在两处的消息只发送一次
+    """
+    with push.get_hub().subscribe(user_id) as subscription:
+        # 断线后浏览器的EventSource在3秒后自动重连，并带上最后收到的事件ID
+        yield 'retry: 3000\n\n'
+        replayed = set()
+        if after is not None:
+            limit = getattr(settings, 'MESSAGE_PUSH_REPLAY_LIMIT', 100)
+            for payload in await sync_to_async(push.messages_after)(user_id, after, limit):
+                replayed.add(payload['id'])
+                yield _event(payload)
+        heartbeat = getattr(settings, 'MESSAGE_PUSH_HEARTBEAT_SECONDS', 15)
+        while True:
+            payload = await subscription.get(heartbeat)
+            if payload is push.OVERFLOW:
+                return
+            if payload is None:
+                yield ': keepalive\n\n'
+            elif payload['id'] not in replayed:
+                yield _event(payload)
+
+
+@require_http_methods(["GET"])
+async def message_stream(request):
+    """
+    新消息的实时推送（Server-Sent Events，见push.py），替代定时轮询receive_messages。
+    连接保持打开，当前用户收到新消息时立即发送一个事件，事件ID为消息ID；
+    重连时带上Last-Event-ID请求头（或?after=消息ID），先补发这之后的消息。空闲连接不查询数据库。
+    需要通过ASGI服务器（uvicorn、daphne等）提供，WSGI下流式响应会被整体缓冲。
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'message': 'Authentication required.'}, status=401)
+    after = _parse_after(request.headers.get('Last-Event-ID', request.GET.get('after')))
+    if after is False:
+        return JsonResponse({'message': 'Invalid Last-Event-ID.'}, status=400)
+    response = StreamingHttpResponse(_message_events(user.id, after), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # 关闭nginx等反向代理的响应缓冲
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_http_methods(["GET"])
+async def poll_messages(request):
+    """
+    新消息的长轮询，用于不支持SSE的客户端：?after=为客户端已经收到的最后一条消息ID。
+    有更新的消息时立即返回；否则挂起请求，直到收到推送或等待MESSAGE_PUSH_LONG_POLL_TIMEOUT秒后返回空列表。
+    每次请求只查询一次数据库。
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'message': 'Authentication required.'}, status=401)
+    after = _parse_after(request.GET.get('after'))
+    if after is None or after is False:
+        return JsonResponse({'message': 'Please provide after.'}, status=400)
+    with push.get_hub().subscribe(user.id) as subscription:
+        messages = await sync_to_async(push.messages_after)(
+            user.id, after, getattr(settings, 'MESSAGE_PUSH_REPLAY_LIMIT', 100))
+        if not messages:
+            payload = await subscription.get(getattr(settings, 'MESSAGE_PUSH_LONG_POLL_TIMEOUT', 25))
+            if payload is not None and payload is not push.OVERFLOW:
+                messages = [payload]
+    return JsonResponse({'messages': messages})
+
+
 def list_messages(request):
     # 从数据库获取所有消息
     messages = Message.objects.all()
@@ -53,43 +160,115 @@ def list_messages(request):
     return JsonResponse(messages_list, safe=False)
 
 
+MESSAGE_SEARCH_PAGE_SIZE = 20
+
+
+@login_required
 def search_messages(request, keyword):
-    # 根据关键词搜索历史消息
-    messages = Message.objects.filter(content__icontains=keyword)
-    results_list = [model_to_dict(message, fields=['id', 'sender', 'receiver', 'content']) for message in messages]
-    return JsonResponse(results_list, safe=False)
+    """
+    在当前用户发送或接收的私信中搜索关键词（见search.py），按时间倒序、游标分页。
+    ?cursor=为上一页返回的next_cursor；每条结果带有高亮摘要snippet，匹配的片段用<mark>标记。
+    单次请求扫描的倒排项有上限，这一页可能不足20条而next_cursor不为null，客户端继续用游标翻页即可。
+    """
+    try:
+        messages, next_cursor = search.search(request.user.id, keyword, request.GET.get('cursor'),
+                                               MESSAGE_SEARCH_PAGE_SIZE)
+    except InvalidCursor:
+        return JsonResponse({'message': 'Invalid cursor.'}, status=400)
+    results_list = [{'id': message.id, 'sender': message.sender_id, 'receiver': message.receiver_id,
+                     'content': message.content, 'snippet': search.snippet(message.content, keyword)}
+                    for message in messages]
+    return JsonResponse({'messages': results_list, 'next_cursor': next_cursor})
 
 
+MESSAGE_HISTORY_PAGE_SIZE = 20
+
+
+@login_required
+@require_http_methods(["GET"])
+def message_history(request, user_id):
+    """
+    打开与某个用户的会话：按时间倒序返回两人之间的消息，从最新的一条开始向前翻页（见conversations.py）。
+    ?cursor=为上一页返回的next_cursor，next_cursor为null表示已经到最早的消息。
+    read为接收者是否已读：消息ID不大于接收者在这个会话中的已读位置。
+    每一页是(conversation, created_at, id)索引上的一次范围扫描，耗时与收件箱的大小无关。
+    """
+    try:
+        messages, next_cursor = conversations.history(request.user.id, user_id, request.GET.get('cursor'),
+                                                      MESSAGE_HISTORY_PAGE_SIZE)
+    except InvalidCursor:
+        return JsonResponse({'message': 'Invalid cursor.'}, status=400)
+    messages_list = [{'id': message['id'], 'sender': message['sender_id'], 'receiver': message['receiver_id'],
+                      'content': message['content'], 'created_at': message['created_at'], 'read': message['read']}
+                     for message in messages]
+    return JsonResponse({'messages': messages_list, 'next_cursor': next_cursor})
 
 
 def get_message_detail(request, message_id):
     # 根据消息ID返回特定消息的详情
-    message = get_object_or_404(Message, pk=message_id)
+    message = get_object_or_404(conversations.with_read(Message.objects.all()), pk=message_id)
     message_detail = model_to_dict(message, fields=['id', 'sender', 'receiver', 'content'])
+    message_detail['read'] = message.read
     return JsonResponse(message_detail)
 
 
+@login_required
+@require_http_methods(["POST"])
+def mark_conversation_read(request, user_id):
+    """
+    把与某个用户的会话标记为已读（见conversations.py）：POST up_to=消息ID，读到这条消息为止，不传时读到最新的消息。
+    已读位置只向前移动，这条消息和之前的消息都成为已读，一次请求的查询次数与消息条数无关
+    """
+    up_to = request.POST.get('up_to')
+    if up_to is not None and not up_to.isdigit():
+        return JsonResponse({'message': 'Invalid up_to.'}, status=400)
+    state = conversations.mark_read(request.user.id, user_id, None if up_to is None else int(up_to))
+    if state is None:
+        return JsonResponse({'message': 'Conversation not found.'}, status=404)
+    return JsonResponse({'last_read_message_id': state.last_read_message_id, 'unread_count': state.unread_count})
+
+
+@login_required
+@require_http_methods(["GET"])
+def unread_counts(request):
+    """
+    当前用户的未读消息数：总数以及每个有未读消息的会话的未读数，读取冗余的计数，不扫描消息
+    """
+    counts = conversations.unread_counts(request.user.id)
+    return JsonResponse({'total': sum(count for _, count in counts),
+                         'conversations': [{'user': other_id, 'unread_count': count} for other_id, count in counts]})
+
+
+def _move_read_position(message_id, rewind):
+    # 逐条标记的兼容实现：移动接收者在消息所在会话中的已读位置
+    message = Message.objects.filter(id=message_id).values('receiver_id', 'conversation_id').first()
+    if message is None:
+        return None
+    return conversations.set_read_position(message['receiver_id'], message['conversation_id'],
+                                           message_id - 1 if rewind else message_id, rewind=rewind)
+
+
 @require_http_methods(["POST"])
 def mark_as_read(request, message_id):
-    # 标记消息为已读
-    try:
-        message = Message.objects.get(id=message_id)
-        message.read = True
-        message.save()
-        return JsonResponse({'message': 'Message marked as read', 'message_id': message_id})
-    except Message.DoesNotExist:
+    # 标记消息为已读：接收者的已读位置前移到这条消息，之前的消息也都成为已读。新客户端使用mark_conversation_read
+    state = _move_read_position(message_id, rewind=False)
+    if state is None:
         return JsonResponse({'error': 'Message not found'}, status=404)
+    return JsonResponse({'message': 'Message marked as read', 'message_id': message_id,
+                         'unread_count': state.unread_count})
 
 
 def mark_as_unread(request, message_id):
-    # 标记消息为未读
-    try:
-        message = Message.objects.get(id=message_id)
-        message.read = False
-        message.save()
-        return JsonResponse({'message': 'Message marked as read', 'message_id': message_id})
-    except Message.DoesNotExist:
+    """
+    标记消息为未读。已读状态是每个会话一个已读位置，不是逐条的标记：
+    接收者的已读位置退回到这条消息之前，这条消息以及会话中在它之后的所有消息都会成为未读，
+    之前已读的消息仍然是已读的；之后再标记已读时，已读位置重新前移。消息的read字段和未读数都按已读位置计算
+    """
+    state = _move_read_position(message_id, rewind=True)
+    if state is None:
         return JsonResponse({'error': 'Message not found'}, status=404)
+    return JsonResponse({'message': 'Message marked as unread', 'message_id': message_id,
+                         'unread_count': state.unread_count})
 
 
 @require_http_methods(["POST"])  # 确保只有POST请求可以调用此视图